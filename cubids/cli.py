@@ -31,6 +31,34 @@ def _is_file(path, parser):
     return path
 
 
+def _tolerance_sweep(value, parser):
+    """Parse a COLUMN=start:stop:steps tolerance sweep."""
+    try:
+        column, tolerance_range = value.split("=")
+        start, stop, steps = tolerance_range.split(":")
+        sweep = (column, float(start), float(stop), int(steps))
+    except ValueError:
+        raise parser.error(
+            f"Tolerance sweep should be formatted as COLUMN=start:stop:steps: <{value}>."
+        )
+
+    if not column or sweep[3] < 1:
+        raise parser.error(f"Invalid tolerance sweep: <{value}>.")
+    return sweep
+
+
+def _shard(value, parser):
+    """Parse an i/N shard specification."""
+    try:
+        shard_index, n_shards = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise parser.error(f"Shard should be formatted as i/N: <{value}>.")
+
+    if not 0 <= shard_index < n_shards:
+        raise parser.error(f"Shard index should be between 0 and N - 1: <{value}>.")
+    return shard_index, n_shards
+
+
 def _parse_validate():
     parser = argparse.ArgumentParser(
         description="cubids-validate: Wrapper around the official BIDS Validator",
@@ -92,6 +120,112 @@ def _parse_validate():
         nargs="+",
         required=False,
     )
+    parser.add_argument(
+        "--link-mode",
+        default="auto",
+        choices=["auto", "copy", "hardlink", "symlink", "reflink"],
+        action="store",
+        help=(
+            "How files are placed in each subject's temporary directory in sequential runs. "
+            "'auto' uses a reflink, hardlink, or symlink (whichever the filesystem supports) "
+            "and only copies the data as a last resort. "
+            "With --ignore_nifti_headers, NIfTI files are replaced with empty, sparse stubs."
+        ),
+        required=False,
+    )
+    parser.add_argument(
+        "--n-jobs",
+        type=int,
+        default=1,
+        action="store",
+        help="Number of subjects to validate at once in a sequential run.",
+        required=False,
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=None,
+        action="store",
+        help=(
+            "Number of seconds after which a subject's validator run is stopped "
+            "in a sequential run. Subjects that time out or fail are recorded "
+            "in the validation output instead of stopping the run."
+        ),
+        required=False,
+    )
+    parser.add_argument(
+        "--use-cache",
+        action="store_true",
+        default=False,
+        help=(
+            "In a sequential run, only validate subjects whose files have changed since "
+            "the last run, and reuse the cached issues for the rest. "
+            "The cache is stored in validation_cache.json, next to the validation outputs, "
+            "and is saved as the run goes."
+        ),
+        required=False,
+    )
+    parser.add_argument(
+        "--shard",
+        type=partial(_shard, parser=parser),
+        default=None,
+        action="store",
+        metavar="i/N",
+        help=(
+            "In a sequential run, only validate shard i (counting from 0) of N, "
+            "e.g., --shard ${SLURM_ARRAY_TASK_ID}/10. "
+            "Each shard writes <output_prefix>_shard-<i>-of-<N>_validation.tsv. "
+            "Combine the shards with cubids validate-merge."
+        ),
+        required=False,
+    )
+    parser.add_argument(
+        "--aggregate",
+        action="store_true",
+        default=False,
+        help=(
+            "Instead of listing every issue, write <output_prefix>_validation_summary.tsv, "
+            "with one row per issue code, subCode, severity and rule, "
+            "the number of issues, the affected subjects and a few example locations."
+        ),
+        required=False,
+    )
+    parser.add_argument(
+        "--since",
+        action="store",
+        default=None,
+        metavar="REV",
+        help=(
+            "Only validate the subjects whose files changed since this git revision "
+            "(e.g., HEAD~1), including uncommitted and untracked files. "
+            "If files outside of the subject directories changed, "
+            "such as dataset_description.json, the whole dataset is validated."
+        ),
+        required=False,
+    )
+    parser.add_argument(
+        "--by-acq-group",
+        type=PathExists,
+        action="store",
+        default=None,
+        metavar="ACQGROUPING_TSV",
+        help=(
+            "Path to the _AcqGrouping.tsv written by cubids group. "
+            "Only validate a few subjects from each acquisition group, "
+            "and project their issues onto the rest of the group, marked as inferred. "
+            "The groups that need a full validation are flagged in "
+            "<output_prefix>_validation_triage.tsv."
+        ),
+        required=False,
+    )
+    parser.add_argument(
+        "--n-representatives",
+        type=int,
+        action="store",
+        default=1,
+        help="Number of subjects to validate from each acquisition group with --by-acq-group.",
+        required=False,
+    )
     return parser
 
 
@@ -107,6 +241,84 @@ def _enter_validate(argv=None):
     workflows.validate(**args)
 
 
+def _parse_validate_merge():
+    parser = argparse.ArgumentParser(
+        description="cubids validate-merge: Combine the outputs of a sharded validation run",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    PathExists = partial(_path_exists, parser=parser)
+
+    parser.add_argument(
+        "bids_dir",
+        type=PathExists,
+        action="store",
+        help=(
+            "The root of a BIDS dataset. It should contain "
+            "sub-X directories and dataset_description.json"
+        ),
+    )
+    parser.add_argument(
+        "output_prefix",
+        type=Path,
+        action="store",
+        help=(
+            "The output prefix that was given to each `cubids validate --shard` run. "
+            "The combined issues are written to <output_prefix>_validation.tsv."
+        ),
+    )
+    parser.add_argument(
+        "--aggregate",
+        action="store_true",
+        default=False,
+        help=(
+            "Write <output_prefix>_validation_summary.tsv, with the merged issues "
+            "aggregated by code, subCode, severity and rule, instead of every issue."
+        ),
+        required=False,
+    )
+    return parser
+
+
+def _parse_prevalidate():
+    parser = argparse.ArgumentParser(
+        description=(
+            "cubids prevalidate: Quickly check filenames and sidecars against the BIDS schema, "
+            "without the BIDS Validator"
+        ),
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    PathExists = partial(_path_exists, parser=parser)
+
+    parser.add_argument(
+        "bids_dir",
+        type=PathExists,
+        action="store",
+        help=(
+            "The root of a BIDS dataset. It should contain "
+            "sub-X directories and dataset_description.json"
+        ),
+    )
+    parser.add_argument(
+        "output_prefix",
+        type=Path,
+        action="store",
+        help=(
+            "file prefix to which the issues are written, as <output_prefix>_prevalidation.tsv. "
+            "If users pass in just a filename prefix "
+            "e.g. V1, then CuBIDS will put the output in bids_dir/code/CuBIDS."
+        ),
+    )
+    parser.add_argument(
+        "--n-jobs",
+        type=int,
+        action="store",
+        default=1,
+        help="Number of threads used to read the JSON files.",
+        required=False,
+    )
+    return parser
+
+
 def _parse_bids_version():
     parser = argparse.ArgumentParser(
         description="cubids bids-version: Get BIDS Validator and Schema version",
@@ -133,6 +345,15 @@ def _parse_bids_version():
             "By default, `cubids bids-version /bids/path` prints to the terminal."
         ),
     )
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        default=False,
+        help=(
+            "Look the validator and schema versions up again, "
+            "instead of using the versions cached in ~/.cache/cubids."
+        ),
+    )
     return parser
 
 
@@ -220,12 +441,40 @@ def _parse_group():
     )
     parser.add_argument(
         "--config",
-        action="store",
+        action="append",
         type=PathExists,
         default=None,
         help=(
             "Path to a config file for grouping. "
-            "If not provided, then the default config file from CuBIDS will be used."
+            "If not provided, then the default config file from CuBIDS will be used. "
+            "May be provided more than once to compare several configs in one pass, "
+            "in which case the outputs for each config are prefixed with the config's name "
+            "and a <output_prefix>_ConfigComparison.tsv file is written."
+        ),
+    )
+    parser.add_argument(
+        "--sweep-tolerance",
+        action="append",
+        type=partial(_tolerance_sweep, parser=parser),
+        default=None,
+        metavar="COLUMN=start:stop:steps",
+        help=(
+            "Instead of grouping, count the parameter groups for a range of tolerances "
+            "on a column (e.g., EchoTime=0:0.01:20). "
+            "The counts are written to <output_prefix>_ToleranceSweep.tsv, "
+            "and the files that change groups to <output_prefix>_ToleranceSweepFiles.tsv. "
+            "May be provided more than once to sweep several columns."
+        ),
+    )
+    parser.add_argument(
+        "--engine",
+        default="pandas",
+        choices=["pandas", "polars"],
+        action="store",
+        help=(
+            "Dataframe engine used to find parameter and acquisition groups. "
+            "The polars engine is faster on large datasets and requires polars to be installed. "
+            "Both engines write the same outputs."
         ),
     )
     return parser
@@ -324,6 +573,30 @@ def _parse_apply():
             "If not provided, then the default config file from CuBIDS will be used."
         ),
     )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        default=False,
+        help=(
+            "Continue an apply that was interrupted, "
+            "skipping the steps of its plan that were already done. "
+            "Use the same new_tsv_prefix as the interrupted apply. "
+            "This also runs a plan written with --dry-run."
+        ),
+    )
+    parser.add_argument(
+        "--dry-run",
+        "--plan-only",
+        dest="dry_run",
+        action="store_true",
+        default=False,
+        help=(
+            "Only write the plan to <new_tsv_prefix>_apply_plan.json and report its cost "
+            "(files and bytes renamed, deleted and rewritten, IntendedFor edits, "
+            "datalad paths to save and name collisions), without changing the dataset. "
+            "Run the plan later with --resume."
+        ),
+    )
 
     return parser
 
@@ -383,7 +656,7 @@ def _enter_datalad_save(argv=None):
 
 def _parse_undo():
     parser = argparse.ArgumentParser(
-        description="cubids-undo: revert most recent commit",
+        description="cubids-undo: undo the most recent CuBIDS operation",
         formatter_class=argparse.ArgumentDefaultsHelpFormatter,
     )
     PathExists = partial(_path_exists, parser=parser)
@@ -402,6 +675,25 @@ def _parse_undo():
         action="store",
         help="Docker image tag or Singularity image file.",
     )
+    parser.add_argument(
+        "--prune",
+        action="store_true",
+        default=False,
+        help=(
+            "Instead of undoing an operation, permanently remove the files deleted by "
+            "earlier operations, which are kept in code/CuBIDS/journal in datasets "
+            "without datalad. Those operations can no longer be undone. "
+            "Metadata values that older versions of CuBIDS recorded for "
+            "remove-metadata-fields are removed from the journal too."
+        ),
+    )
+    parser.add_argument(
+        "--keep",
+        type=int,
+        action="store",
+        default=0,
+        help="With --prune, keep the deleted files of this many of the most recent operations.",
+    )
 
     return parser
 
@@ -498,6 +790,60 @@ def _parse_copy_exemplars():
         default=False,
         help="unlock dataset before adding nifti info ",
     )
+    parser.add_argument(
+        "--link-mode",
+        default="copy",
+        choices=["copy", "auto", "hardlink", "symlink", "reflink"],
+        action="store",
+        help=(
+            "How files are placed in the exemplar dataset. "
+            "'auto' uses a reflink, hardlink, or symlink (whichever the filesystem supports) "
+            "and only copies the data as a last resort."
+        ),
+        required=False,
+    )
+    parser.add_argument(
+        "--n-jobs",
+        type=int,
+        default=1,
+        action="store",
+        help="Number of files to copy at once.",
+        required=False,
+    )
+    parser.add_argument(
+        "--only-group-files",
+        action="store_true",
+        default=False,
+        help=(
+            "only copy the scans of each exemplar's Acquisition Group "
+            "(e.g., a single session), with their sidecars and other associated files, "
+            "instead of the exemplar subject's whole directory"
+        ),
+    )
+    parser.add_argument(
+        "--datalad-clone",
+        action="store_true",
+        default=False,
+        help=(
+            "with --use-datalad, create the exemplar dataset as a local clone "
+            "and get the exemplars' content from the BIDS dataset's annex, "
+            "hardlinking it where possible instead of copying it"
+        ),
+    )
+    parser.add_argument(
+        "--selection",
+        default="first",
+        choices=["first", "smallest", "cover"],
+        action="store",
+        help=(
+            "How exemplars are chosen. "
+            "'first' takes the first subject listed for each Acquisition Group. "
+            "'smallest' takes the subject with the fewest bytes to copy for each group. "
+            "'cover' takes the subjects with the fewest bytes that, together, "
+            "cover every Parameter Group in the _files.tsv next to the exemplars tsv."
+        ),
+        required=False,
+    )
     return parser
 
 
@@ -543,7 +889,7 @@ def _parse_add_nifti_info():
         "--force-unlock",
         action="store_true",
         default=False,
-        help="unlock dataset before adding nifti info ",
+        help="unlock the sidecars that will be modified before adding nifti info",
     )
     parser.add_argument(
         "--container",
@@ -605,6 +951,28 @@ def _parse_purge():
         action="store",
         help="Docker image tag or Singularity image file.",
     )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        default=False,
+        help=(
+            "Continue a purge that was interrupted, "
+            "skipping the steps of its plan that were already done. "
+            "This also runs a plan written with --dry-run."
+        ),
+    )
+    parser.add_argument(
+        "--dry-run",
+        "--plan-only",
+        dest="dry_run",
+        action="store_true",
+        default=False,
+        help=(
+            "Only write the plan next to the scans file (<scans>_purge_plan.json) "
+            "and report its cost, without changing the dataset. "
+            "Run the plan later with --resume."
+        ),
+    )
     return parser
 
 
@@ -647,6 +1015,14 @@ def _parse_remove_metadata_fields():
         action="store",
         help="Docker image tag or Singularity image file.",
     )
+    parser.add_argument(
+        "--n-jobs",
+        type=int,
+        default=1,
+        action="store",
+        help="Number of threads used to read and write the sidecars.",
+        required=False,
+    )
 
     return parser
 
@@ -678,7 +1054,9 @@ def _parse_print_metadata_fields():
         action="store",
         help=(
             "The root of a BIDS dataset. It should contain "
-            "sub-X directories and dataset_description.json"
+            "sub-X directories and dataset_description.json. "
+            "Sidecars in its code, sourcedata, stimuli and models directories "
+            "(including code/CuBIDS) are not read."
         ),
     )
     parser.add_argument(
@@ -686,6 +1064,28 @@ def _parse_print_metadata_fields():
         action="store",
         help="Docker image tag or Singularity image file.",
     )
+    parser.add_argument(
+        "--n-jobs",
+        type=int,
+        default=1,
+        action="store",
+        help="Number of threads used to read the sidecars.",
+        required=False,
+    )
+    parser.add_argument(
+        "--output-prefix",
+        type=Path,
+        default=None,
+        action="store",
+        help=(
+            "file prefix for writing the number of sidecars with each field, "
+            "in total and by modality (<prefix>_MetadataFields.tsv) "
+            "and by entity set (<prefix>_MetadataFieldsByEntitySet.tsv). "
+            "If users pass in just a filename prefix, the files are written to "
+            "bids_dir/code/CuBIDS."
+        ),
+        required=False,
+    )
 
     return parser
 
@@ -704,6 +1104,8 @@ def _enter_print_metadata_fields(argv=None):
 
 COMMANDS = [
     ("validate", _parse_validate, workflows.validate),
+    ("validate-merge", _parse_validate_merge, workflows.validate_merge),
+    ("prevalidate", _parse_prevalidate, workflows.prevalidate),
     ("bids-version", _parse_bids_version, workflows.bids_version),
     ("sidecar-merge", _parse_bids_sidecar_merge, workflows.bids_sidecar_merge),
     ("group", _parse_group, workflows.group),
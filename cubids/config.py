@@ -1,5 +1,8 @@
 """Functions for configuring CuBIDS."""
 
+import hashlib
+import json
+from dataclasses import dataclass, field
 from pathlib import Path
 
 import yaml
@@ -15,3 +18,195 @@ def load_config(config_file):
         config = yaml.safe_load(f)
 
     return config
+
+
+@dataclass(frozen=True)
+class ModalitySpec:
+    """Compiled grouping settings for a single modality.
+
+    Parameters
+    ----------
+    modality : :obj:`str`
+        Name of the modality (e.g., "func").
+    sidecar_columns : :obj:`tuple` of :obj:`str`
+        Sidecar fields to include in the parameter groups.
+    derived_columns : :obj:`tuple` of :obj:`str`
+        Fields derived by CuBIDS (e.g., from the NIfTI header).
+    columns : :obj:`tuple` of :obj:`str`
+        All grouping columns. Derived columns take precedence over sidecar columns.
+    tolerance_columns : :obj:`tuple` of :obj:`str`
+        Columns that are clustered according to a tolerance.
+    tolerances : :obj:`tuple` of :obj:`float`
+        Tolerances, aligned with ``tolerance_columns``.
+    precision_columns : :obj:`tuple` of :obj:`str`
+        Columns that are rounded to a precision.
+    precisions : :obj:`tuple` of :obj:`int`
+        Precisions, aligned with ``precision_columns``.
+    rename_columns : :obj:`tuple` of :obj:`str`
+        Columns used when suggesting variant renames.
+    """
+
+    modality: str
+    sidecar_columns: tuple
+    derived_columns: tuple
+    columns: tuple
+    tolerance_columns: tuple
+    tolerances: tuple
+    precision_columns: tuple
+    precisions: tuple
+    rename_columns: tuple
+
+    @classmethod
+    def from_config(cls, modality, sidecar_params, derived_params):
+        """Compile the sidecar and derived parameter dictionaries for one modality."""
+        params = dict(sidecar_params)
+        params.update(derived_params)
+
+        tolerance_items = [(k, v["tolerance"]) for k, v in params.items() if "tolerance" in v]
+        precision_items = [(k, v["precision"]) for k, v in params.items() if "precision" in v]
+        return cls(
+            modality=modality,
+            sidecar_columns=tuple(sidecar_params.keys()),
+            derived_columns=tuple(derived_params.keys()),
+            columns=tuple(params.keys()),
+            tolerance_columns=tuple(k for k, _ in tolerance_items),
+            tolerances=tuple(float(v) for _, v in tolerance_items),
+            precision_columns=tuple(k for k, _ in precision_items),
+            precisions=tuple(int(v) for _, v in precision_items),
+            rename_columns=tuple(
+                k for k, v in params.items() if v.get("suggest_variant_rename", False)
+            ),
+        )
+
+    @property
+    def tolerance_dict(self):
+        """Map each tolerance column to its tolerance."""
+        return dict(zip(self.tolerance_columns, self.tolerances))
+
+    @property
+    def precision_dict(self):
+        """Map each precision column to its precision."""
+        return dict(zip(self.precision_columns, self.precisions))
+
+
+@dataclass(frozen=True)
+class GroupingSpec:
+    """A compiled, immutable version of the grouping config.
+
+    This is built once per run from ``config.yml``, so the grouping functions don't need to
+    re-derive (or modify) the config for every entity set.
+    It is picklable and hashable, so it can be shared with parallel workers
+    and used as a cache key.
+
+    Parameters
+    ----------
+    modality_specs : :obj:`tuple` of :obj:`ModalitySpec`
+        Compiled settings for each modality.
+    relational_params : :obj:`tuple` of :obj:`tuple`
+        ``(name, display_mode, suggest_variant_rename)`` for each relational parameter
+        (e.g., "FieldmapKey" or "IntendedForKey").
+    config_hash : :obj:`str`
+        SHA-256 hash of the config the spec was built from.
+    """
+
+    modality_specs: tuple
+    relational_params: tuple
+    config_hash: str
+    _by_modality: dict = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        object.__setattr__(
+            self, "_by_modality", {spec.modality: spec for spec in self.modality_specs}
+        )
+
+    @classmethod
+    def from_config(cls, config):
+        """Build a GroupingSpec from a loaded config dictionary.
+
+        Parameters
+        ----------
+        config : :obj:`dict` or :obj:`GroupingSpec`
+            The config, as returned by :func:`load_config`.
+            If it is already a GroupingSpec, it is returned unchanged.
+
+        Returns
+        -------
+        :obj:`GroupingSpec`
+        """
+        if isinstance(config, cls):
+            return config
+
+        sidecar_params = config.get("sidecar_params", {}) or {}
+        derived_params = config.get("derived_params", {}) or {}
+        modalities = list(sidecar_params.keys())
+        modalities += [mod for mod in derived_params.keys() if mod not in modalities]
+        modality_specs = tuple(
+            ModalitySpec.from_config(
+                mod, sidecar_params.get(mod, {}) or {}, derived_params.get(mod, {}) or {}
+            )
+            for mod in modalities
+        )
+
+        relational = config.get("relational_params", {}) or {}
+        relational_params = tuple(
+            (
+                name,
+                settings.get("display_mode", "bool"),
+                bool(settings.get("suggest_variant_rename", False)),
+            )
+            for name, settings in relational.items()
+        )
+
+        canonical = json.dumps(config, sort_keys=True, default=str)
+        return cls(
+            modality_specs=modality_specs,
+            relational_params=relational_params,
+            config_hash=hashlib.sha256(canonical.encode("utf-8")).hexdigest(),
+        )
+
+    @classmethod
+    def from_file(cls, config_file):
+        """Load and compile a grouping config file.
+
+        Parameters
+        ----------
+        config_file : :obj:`pathlib.Path` or None
+            Path to the config file. If None, the default config in CuBIDS is used.
+
+        Returns
+        -------
+        :obj:`GroupingSpec`
+        """
+        return cls.from_config(load_config(config_file))
+
+    def __getitem__(self, modality):
+        """Get the compiled settings for a modality."""
+        return self._by_modality[modality]
+
+    def __getstate__(self):
+        return {
+            "modality_specs": self.modality_specs,
+            "relational_params": self.relational_params,
+            "config_hash": self.config_hash,
+        }
+
+    def __setstate__(self, state):
+        for key, value in state.items():
+            object.__setattr__(self, key, value)
+        self.__post_init__()
+
+    @property
+    def modalities(self):
+        """Names of the modalities in the spec."""
+        return tuple(spec.modality for spec in self.modality_specs)
+
+    def get_relational(self, name):
+        """Get ``(display_mode, suggest_variant_rename)`` for a relational parameter.
+
+        Returns None if the parameter isn't in the config.
+        """
+        for param_name, display_mode, suggest_rename in self.relational_params:
+            if param_name == name:
+                return display_mode, suggest_rename
+
+        return None
@@ -7,8 +7,9 @@ import re
 import subprocess
 import warnings
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
-from shutil import copyfile, copytree
 
 import bids
 import bids.layout
@@ -21,9 +22,25 @@ from bids.utils import listify
 from sklearn.cluster import AgglomerativeClustering
 from tqdm import tqdm
 
-from cubids.config import load_config
+from cubids.config import GroupingSpec, load_config
 from cubids.constants import ID_VARS, NON_KEY_ENTITIES
+from cubids.engines import check_engine, get_param_group_ids
+from cubids.journal import (
+    TRASH_DIR,
+    Journal,
+    _get_head,
+    pop_journal_entry,
+    read_journal,
+    undo_entry,
+)
 from cubids.metadata_merge import check_merging_operations, group_by_acquisition_sets
+from cubids.utils import link_file
+
+# plan steps that edit sidecars in place, instead of running a command
+SIDECAR_OPS = ("remove_intended_for", "rename_intended_for")
+# top-level directories that are not indexed as BIDS data
+IGNORED_DIRS = ("code", "stimuli", "sourcedata", "models")
+MODALITIES = ("dwi", "anat", "func", "perf", "fmap")
 
 warnings.simplefilter(action="ignore", category=FutureWarning)
 bids.config.set_option("extension_initial_dot", True)
@@ -45,8 +62,12 @@ class CuBIDS(object):
         Path to the grouping config file.
         Default is None, in which case the default config in CuBIDS is used.
     force_unlock : :obj:`bool`, optional
-        If True, force unlock all files in the BIDS dataset.
+        If True, unlock the sidecars that add_nifti_info will modify.
         Default is False.
+    engine : {"pandas", "polars"}, optional
+        Dataframe engine used to find parameter and acquisition groups.
+        The polars engine requires the optional polars dependency.
+        Both engines produce the same groups. Default is "pandas".
 
     Attributes
     ----------
@@ -68,8 +89,12 @@ class CuBIDS(object):
         A list of new filenames.
     IF_rename_paths : :obj:`list`
         A list of IntendedFor paths that have been renamed.
+    IF_rename_steps : :obj:`list` of :obj:`dict`
+        Plan steps that rename IntendedFor references in those sidecars.
     grouping_config : :obj:`dict`
         The grouping config dictionary.
+    grouping_spec : :obj:`~cubids.config.GroupingSpec`
+        The compiled grouping config, built once from ``grouping_config``.
     acq_group_level : :obj:`str`
         The level at which to group scans.
     scans_txt : :obj:`str`
@@ -77,13 +102,20 @@ class CuBIDS(object):
         you want to be deleted from the dataset, along
         with their associations.
     force_unlock : :obj:`bool`
-        If True, force unlock all files in the BIDS dataset.
+        If True, unlock the sidecars that add_nifti_info will modify.
     cubids_code_dir : :obj:`bool`
         If True, the CuBIDS code directory exists.
     data_dict : :obj:`dict`
         A data dictionary for TSV outputs.
     use_datalad : :obj:`bool`
         If True, use datalad to track changes to the BIDS dataset.
+    engine : :obj:`str`
+        Dataframe engine used to find parameter and acquisition groups.
+    touched_paths : :obj:`set`
+        Paths that the last operation wrote, moved or deleted.
+        Only these paths are saved and checked with datalad.
+    journal : :obj:`~cubids.journal.Journal` or None
+        Record of the changes made by the operation that is running, so it can be undone.
     """
 
     def __init__(
@@ -93,7 +125,9 @@ class CuBIDS(object):
         acq_group_level="subject",
         grouping_config=None,
         force_unlock=False,
+        engine="pandas",
     ):
+        check_engine(engine)
         self.path = os.path.abspath(data_root)
         self._layout = None
         self.keys_files = {}
@@ -103,13 +137,20 @@ class CuBIDS(object):
         self.old_filenames = []  # files whose entity sets changed
         self.new_filenames = []  # new filenames for files to change
         self.IF_rename_paths = []  # fmap jsons with rename intended fors
+        self.IF_rename_steps = []  # plan steps for the intended for renames
         self.grouping_config = load_config(grouping_config)
+        self.grouping_spec = GroupingSpec.from_config(self.grouping_config)
         self.acq_group_level = acq_group_level
         self.scans_txt = None  # txt file of scans to purge (for purge only)
         self.force_unlock = force_unlock  # force unlock for add-nifti-info
         self.cubids_code_dir = Path(self.path + "/code/CuBIDS").is_dir()
         self.data_dict = {}  # data dictionary for TSV outputs
+        self._sidecar_cache = None  # sidecar metadata shared across grouping configs
+        self._entity_set_files = None  # entity set files shared across grouping configs
         self.use_datalad = use_datalad  # True if flag set, False if flag unset
+        self.engine = engine
+        self.touched_paths = set()  # paths changed by the last operation
+        self.journal = None  # journal of the operation that is running
         if self.use_datalad:
             self.init_datalad()
 
@@ -140,11 +181,7 @@ class CuBIDS(object):
         """
         # create BIDS Layout Indexer class
 
-        ignores = [
-            "code",
-            "stimuli",
-            "sourcedata",
-            "models",
+        ignores = list(IGNORED_DIRS) + [
             re.compile(r"^\."),
             re.compile(r"/\."),
         ]
@@ -189,7 +226,7 @@ class CuBIDS(object):
                 self.path, cfg_proc="text2git", force=True, annex=True
             )
 
-    def datalad_save(self, message=None):
+    def datalad_save(self, message=None, paths=None):
         """Perform a DataLad Save operation on the BIDS tree.
 
         Additionally a check for an active datalad handle and that the
@@ -199,18 +236,39 @@ class CuBIDS(object):
         -----------
         message : str or None
             Commit message to use with datalad save.
+        paths : list of str or None
+            Only save these paths, so datalad doesn't need to check the rest of the dataset.
+            If empty, nothing is saved. If None, the whole dataset is saved.
         """
         if not self.datalad_ready:
             raise Exception("DataLad has not been initialized. use datalad_init()")
 
-        statuses = self.datalad_handle.save(message=message or "CuBIDS Save")
+        if paths is not None:
+            if not paths:
+                return
+
+            statuses = self.datalad_handle.save(
+                message=message or "CuBIDS Save", path=sorted(str(path) for path in paths)
+            )
+        else:
+            statuses = self.datalad_handle.save(message=message or "CuBIDS Save")
+
         saved_status = set([status["status"] for status in statuses])
         if not saved_status == set(["ok"]):
             raise Exception("Failed to save in DataLad")
 
-    def is_datalad_clean(self):
+    def is_datalad_clean(self, paths=None):
         """If True, no changes are detected in the datalad dataset.
 
+        This uses ``git diff-index`` and ``git ls-files``,
+        which are much faster than ``datalad status`` on large datasets.
+
+        Parameters
+        ----------
+        paths : :obj:`list` of :obj:`str`, optional
+            Only check these paths. If empty, the paths are clean.
+            Default is None, in which case the whole dataset is checked.
+
         Returns
         -------
         :obj:`bool`
@@ -223,8 +281,32 @@ class CuBIDS(object):
         """
         if not self.datalad_ready:
             raise Exception("Datalad not initialized, can't determine status")
-        statuses = set([status["state"] for status in self.datalad_handle.status()])
-        return statuses == set(["clean"])
+
+        if paths is not None and not paths:
+            return True
+
+        pathspec = ["--"] + sorted(str(path) for path in paths) if paths else []
+
+        # Refresh the stat info in the index, so unchanged files aren't reported as modified
+        subprocess.run(["git", "update-index", "-q", "--refresh"], cwd=self.path)
+        diff_proc = subprocess.run(
+            ["git", "diff-index", "--quiet", "HEAD"] + pathspec,
+            cwd=self.path,
+            stderr=subprocess.PIPE,
+        )
+        if diff_proc.returncode == 1:
+            return False
+        elif diff_proc.returncode != 0:
+            # e.g., there are no commits yet
+            statuses = set([status["state"] for status in self.datalad_handle.status()])
+            return statuses == set(["clean"])
+
+        untracked_proc = subprocess.run(
+            ["git", "ls-files", "--others", "--exclude-standard"] + pathspec,
+            cwd=self.path,
+            stdout=subprocess.PIPE,
+        )
+        return not untracked_proc.stdout.strip()
 
     def datalad_undo_last_commit(self):
         """Revert the most recent commit, remove it from history.
@@ -241,12 +323,112 @@ class CuBIDS(object):
         reset_proc = subprocess.run(["git", "reset", "--hard", "HEAD~1"], cwd=self.path)
         reset_proc.check_returncode()
 
+    def undo_last_operation(self):
+        """Reverse the most recent operation recorded in the CuBIDS journal.
+
+        Only the files that the operation renamed, deleted or modified are changed,
+        so this works for datalad and plain datasets.
+        If the journal is empty and datalad is used, the most recent commit is reverted instead.
+
+        Returns
+        -------
+        entry : :obj:`dict`
+            The journal entry that was undone, or None if a commit was reverted.
+
+        Raises
+        ------
+        Exception
+            If there is nothing to undo, or if the files to restore have unsaved changes.
+        """
+        entries = read_journal(self.path)
+        if not entries:
+            if self.use_datalad:
+                self.datalad_undo_last_commit()
+                return None
+
+            raise Exception("No operations to undo in the CuBIDS journal")
+
+        entry = entries[-1]
+        new_names = dict(entry["renames"])
+        modified = [
+            os.path.join(self.path, new_names.get(path, path)) for path in entry["sidecars"]
+        ]
+        touched = set(modified + [os.path.join(self.path, path) for path in entry["deletions"]])
+        for old_path, new_path in entry["renames"]:
+            touched.update([os.path.join(self.path, old_path), os.path.join(self.path, new_path)])
+
+        if self.use_datalad and not self.is_datalad_clean(paths=sorted(touched)):
+            raise Exception("Unsaved changes present. Run clear_untracked_changes first")
+
+        self.unlock_files(modified)
+        undo_entry(self.path, entry)
+        journal_file = pop_journal_entry(self.path)
+        self.touched_paths = touched
+        if entry.get("redacted") and not entry["base"] and entry["sidecars"]:
+            print(
+                f"The values changed by {entry['operation']} ({entry['id']}) were not recorded, "
+                "so they were not restored"
+            )
+
+        if self.use_datalad:
+            self.datalad_save(
+                message=f"Undid {entry['operation']} ({entry['id']})",
+                paths=self.touched_paths | {journal_file},
+            )
+
+        self.reset_bids_layout()
+        return entry
+
+    def _write_journal(self):
+        """Add the running operation to the CuBIDS journal.
+
+        Returns
+        -------
+        journal_file : :obj:`str` or None
+            Path to the journal file, or None if the operation didn't change anything.
+        """
+        journal_file = self.journal.write()
+        self.journal = None
+        return journal_file
+
+    def unlock_files(self, paths, batch_size=500):
+        """Unlock annexed files so they can be modified in place.
+
+        Only locked git-annex files are unlocked.
+        Files that are already unlocked or tracked by git directly
+        (e.g., sidecars in a text2git dataset) are skipped.
+
+        Parameters
+        ----------
+        paths : :obj:`list` of :obj:`str`
+            Paths to the files that will be modified.
+        batch_size : :obj:`int`, optional
+            Number of files to unlock with each datalad call. Default is 500.
+
+        Returns
+        -------
+        locked : :obj:`list` of :obj:`str`
+            The files that were unlocked.
+        """
+        locked = sorted(set(str(path) for path in paths if _is_annex_locked(path)))
+        for start in range(0, len(locked), batch_size):
+            batch = [
+                os.path.relpath(path, self.path) for path in locked[start : start + batch_size]
+            ]
+            unlock_proc = subprocess.run(["datalad", "unlock"] + batch, cwd=self.path)
+            unlock_proc.check_returncode()
+
+        return locked
+
     def add_nifti_info(self):
-        """Add info from nifti files to json sidecars."""
-        # check if force_unlock is set
-        if self.force_unlock:
-            # CHANGE TO SUBPROCESS.CALL IF NOT BLOCKING
-            subprocess.run(["datalad", "unlock"], cwd=self.path)
+        """Add info from nifti files to json sidecars.
+
+        Sidecars are only rewritten if new info was added.
+        """
+        self.touched_paths = set()
+
+        # sidecars that need new info, and their updated contents
+        to_update = {}
 
         # loop through all niftis in the bids dir
         for path in Path(self.path).rglob("sub-*/**/*.*"):
@@ -274,6 +456,7 @@ class CuBIDS(object):
                     except Exception:
                         print("Error parsing this sidecar: ", sidecar)
 
+                    n_fields = len(data)
                     if "Obliquity" not in data.keys():
                         data["Obliquity"] = str(obliquity)
                     if "VoxelSizeDim1" not in data.keys():
@@ -298,21 +481,48 @@ class CuBIDS(object):
                         joined = "".join(orient) + "+"
                         data["ImageOrientation"] = joined
 
-                    with open(sidecar, "w") as file:
-                        json.dump(data, file, indent=4)
+                    if len(data) > n_fields:
+                        to_update[sidecar] = data
+
+        # check if force_unlock is set, and only unlock the sidecars that will change
+        if self.force_unlock:
+            self.unlock_files(to_update.keys())
+
+        self.journal = Journal(self.path, "add-nifti-info", use_datalad=self.use_datalad)
+        self.journal.track_sidecars(to_update.keys())
+        for sidecar, data in to_update.items():
+            with open(sidecar, "w") as file:
+                json.dump(data, file, indent=4)
+
+            self.touched_paths.add(sidecar)
 
+        journal_file = self._write_journal()
         if self.use_datalad:
-            self.datalad_save(message="Added nifti info to sidecars")
+            save_paths = self.touched_paths | ({journal_file} if journal_file else set())
+            self.datalad_save(message="Added nifti info to sidecars", paths=save_paths)
 
         self.reset_bids_layout()
 
-    def apply_tsv_changes(self, summary_tsv, files_tsv, new_prefix, raise_on_error=True):
+    def apply_tsv_changes(
+        self,
+        summary_tsv,
+        files_tsv,
+        new_prefix,
+        raise_on_error=True,
+        resume=False,
+        dry_run=False,
+    ):
         """Apply changes documented in the edited summary tsv and generate the new tsv files.
 
         This function looks at the RenameEntitySet and MergeInto
         columns and modifies the bids dataset according to the
         specified changs.
 
+        All of the changes are written to a plan (``<new_prefix>_apply_plan.json``)
+        before the dataset is modified,
+        and each step is marked as done in ``<new_prefix>_apply_progress.txt`` once it has run.
+        If apply is interrupted, it can be continued with ``resume=True``.
+
         Parameters
         ----------
         summary_tsv : :obj:`str`
@@ -323,10 +533,25 @@ class CuBIDS(object):
             Path prefix to the new tsv files.
         raise_on_error : :obj:`bool`
             If True, raise an error if the MergeInto column contains invalid merges.
+        resume : :obj:`bool`
+            If True, continue the unfinished plan of an earlier apply with the same new_prefix,
+            skipping the steps that are done.
+        dry_run : :obj:`bool`
+            If True, only write the plan, with an estimate of its cost, and don't run it.
+            The plan can be run later with ``resume=True``,
+            as long as the files it touches haven't changed and none of its renames collide.
+
+        Returns
+        -------
+        plan : :obj:`dict` or None
+            The plan, with its estimate, if ``dry_run`` is True.
         """
         # reset lists of old and new filenames
         self.old_filenames = []
         self.new_filenames = []
+        self.IF_rename_paths = []
+        self.IF_rename_steps = []
+        self.touched_paths = set()
 
         if "/" not in str(summary_tsv):
             if not self.cubids_code_dir:
@@ -338,13 +563,87 @@ class CuBIDS(object):
                 self.create_cubids_code_dir()
             files_tsv = self.path + "/code/CuBIDS/" + files_tsv
 
+        plan_file = str(Path(self.path) / (new_prefix + "_apply_plan.json"))
+        progress_file = str(Path(self.path) / (new_prefix + "_apply_progress.txt"))
+        if resume:
+            if not Path(plan_file).exists():
+                raise Exception(f"No unfinished apply to resume: {plan_file} does not exist")
+
+            with open(plan_file, "r") as fo:
+                plan = json.load(fo)
+
+        else:
+            if Path(plan_file).exists():
+                raise Exception(
+                    f"Found the plan of an unfinished apply in {plan_file}. "
+                    "Use --resume to continue it, or delete it to start over."
+                )
+
+            plan = self._plan_tsv_changes(summary_tsv, files_tsv, raise_on_error)
+            if dry_run:
+                plan["estimate"] = self.estimate_plan(plan)
+                _write_plan(plan, plan_file)
+                _print_estimate(plan, plan_file)
+                return plan
+
+            # write the plan before changing anything
+            _write_plan(plan, plan_file)
+            if Path(progress_file).exists():
+                os.remove(progress_file)
+
+        s1 = "Renamed Variant Group scans according to their variant "
+        s2 = "parameters"
+        rename_commit = s1 + s2
+        self._run_plan(
+            plan,
+            str(Path(self.path) / (new_prefix + "_full_cmd.sh")),
+            progress_file=progress_file,
+            if_message="Renamed IntendedFor references to Variant Group scans",
+            run_message=rename_commit,
+        )
+
+        # the plan is done
+        os.remove(plan_file)
+        if Path(progress_file).exists():
+            os.remove(progress_file)
+
+        if "regroup" in plan:
+            self._update_tsvs(files_tsv, summary_tsv, plan, new_prefix)
+        else:
+            # plans from older versions of CuBIDS don't list the entity sets they change
+            self.reset_bids_layout()
+            self.get_tsvs(new_prefix)
+
+        # remove renames file that gets created under the hood
+        subprocess.run(["rm", "-rf", "renames"])
+
+    def _plan_tsv_changes(self, summary_tsv, files_tsv, raise_on_error=True):
+        """Plan the merges, deletions and renames requested in the edited tsv files.
+
+        Nothing is changed in the dataset.
+
+        Parameters
+        ----------
+        summary_tsv : :obj:`str`
+            Path to the edited summary tsv file.
+        files_tsv : :obj:`str`
+            Path to the edited files tsv file.
+        raise_on_error : :obj:`bool`
+            If True, raise an error if the MergeInto column contains invalid merges.
+
+        Returns
+        -------
+        plan : :obj:`dict`
+            The steps to run, in order, the state of the operation's journal,
+            and the stats of the files the steps touch.
+        """
         summary_df = pd.read_table(summary_tsv)
         files_df = pd.read_table(files_tsv)
 
         # Check that the MergeInto column only contains valid merges
         ok_merges, deletions = check_merging_operations(summary_tsv, raise_on_error=raise_on_error)
 
-        merge_commands = []
+        merge_steps = []
         for source_id, dest_id in ok_merges:
             dest_files = files_df.loc[(files_df[["ParamGroup", "EntitySet"]] == dest_id).all(1)]
             source_files = files_df.loc[
@@ -357,10 +656,9 @@ class CuBIDS(object):
             for dest_nii in dest_files.FilePath:
                 dest_json = img_to_new_ext(self.path + dest_nii, ".json")
                 if Path(dest_json).exists() and Path(source_json).exists():
-                    merge_commands.append(f"bids-sidecar-merge {source_json} {dest_json}")
+                    merge_steps.append({"op": "merge", "source": source_json, "dest": dest_json})
 
-        # Get the delete commands
-        # delete_commands = []
+        # Get the files to delete
         to_remove = []
         for rm_id in deletions:
             files_to_rm = files_df.loc[(files_df[["ParamGroup", "EntitySet"]] == rm_id).all(1)]
@@ -368,14 +666,13 @@ class CuBIDS(object):
             for rm_me in files_to_rm.FilePath:
                 if Path(self.path + rm_me).exists():
                     to_remove.append(self.path + rm_me)
-                    # delete_commands.append("rm " + rm_me)
 
-        # call purge associations on list of files to remove
-        self._purge_associations(to_remove)
+        # plan the removal of the files and their associations
+        purge_steps = self._plan_purge(to_remove)
 
         # Now do the file renaming
         change_keys_df = summary_df[summary_df.RenameEntitySet.notnull()]
-        move_ops = []
+        rename_steps = []
         # return if nothing to change
         if len(change_keys_df) > 0:
             entity_sets = {}
@@ -405,52 +702,221 @@ class CuBIDS(object):
                         # generate new filenames according to new entity set
                         self.change_filename(file_path, new_entities)
 
-            # create string of mv command ; mv command for dlapi.run
             for from_file, to_file in zip(self.old_filenames, self.new_filenames):
                 if Path(from_file).exists():
-                    # if using datalad, we want to git mv instead of mv
-                    if self.use_datalad:
-                        move_ops.append(f"git mv {from_file} {to_file}")
-                    else:
-                        move_ops.append(f"mv {from_file} {to_file}")
+                    rename_steps.append({"op": "rename", "old": from_file, "new": to_file})
 
-        full_cmd = "\n".join(merge_commands + move_ops)
-        if full_cmd:
-            renames = str(Path(self.path) / (new_prefix + "_full_cmd.sh"))
+        steps = purge_steps + self.IF_rename_steps + merge_steps + rename_steps
+        return {
+            "operation": "apply",
+            "steps": steps,
+            "journal": self._plan_journal("apply", steps),
+            "stats": _get_path_stats(steps),
+            "regroup": self._get_changed_entity_sets(files_df, steps),
+        }
 
-            # write full_cmd to a .sh file
-            with open(renames, "w") as fo:
-                fo.write("#!/bin/bash\n")
-                fo.write(full_cmd)
+    def _get_changed_entity_sets(self, files_df, steps):
+        """Find the entity sets whose param groups may be changed by a plan.
 
-            if self.use_datalad:
-                # first check if IntendedFor renames need to be saved
-                if not self.is_datalad_clean():
-                    s1 = "Renamed IntendedFor references to "
-                    s2 = "Variant Group scans"
-                    IF_rename_msg = s1 + s2
-                    self.datalad_handle.save(message=IF_rename_msg)
+        These are the entity sets that gain or lose files,
+        the entity sets of the files whose sidecars are edited,
+        and the entity sets of the files that lose a fieldmap.
+        This must be run before the plan, while the deleted fieldmaps still exist.
+
+        Parameters
+        ----------
+        files_df : :obj:`pandas.DataFrame`
+            The files tsv.
+        steps : :obj:`list` of :obj:`dict`
+            The steps of the plan.
+
+        Returns
+        -------
+        entity_sets : :obj:`list` of :obj:`str`
+            The entity sets to group again once the plan is done.
+        """
+        niftis = set(self.path + files_df["FilePath"])
+        json_to_nifti = {img_to_new_ext(nifti, ".json"): nifti for nifti in niftis}
+
+        changed_files = set()
+        for step in steps:
+            if step["op"] == "rename":
+                if step["old"] in niftis:
+                    changed_files.update([step["old"], step["new"]])
+            elif step["op"] == "delete":
+                changed_files.add(step["path"])
+                if step["path"] in json_to_nifti:
+                    # the scans this fieldmap was intended for lose it
+                    metadata = get_sidecar_metadata(step["path"])
+                    if metadata != "Erroneous sidecar":
+                        subject = Path(step["path"]).relative_to(self.path).parts[0]
+                        for intended_for in listify(metadata.get("IntendedFor", [])):
+                            changed_files.add(str(Path(self.path) / subject / intended_for))
+            else:
+                sidecar = step["dest"] if step["op"] == "merge" else step["path"]
+                changed_files.add(json_to_nifti.get(sidecar, sidecar))
+
+        return sorted(
+            set(_file_to_entity_set(path) for path in changed_files if ".nii" in Path(path).name)
+        )
+
+    def _plan_journal(self, operation, steps):
+        """Start the journal of a planned operation, before any of its steps run."""
+        journal = Journal(self.path, operation, use_datalad=self.use_datalad)
+        journal.track_sidecars(
+            step["dest"] if step["op"] == "merge" else step["path"]
+            for step in steps
+            if step["op"] in SIDECAR_OPS + ("merge",)
+        )
+        return journal.get_state()
+
+    def estimate_plan(self, plan):
+        """Estimate the cost of a plan without running it.
+
+        Parameters
+        ----------
+        plan : :obj:`dict`
+            The plan, from ``_plan_tsv_changes`` or ``_plan_purge``.
+
+        Returns
+        -------
+        estimate : :obj:`dict`
+            The number of files and bytes that are renamed, deleted and rewritten,
+            the number of IntendedFor references that are edited,
+            the number of paths that datalad saves,
+            and the renames whose new paths collide with other files.
+        """
+        steps = plan["steps"]
+        renamed = [step["old"] for step in steps if step["op"] == "rename"]
+        deleted = [step["path"] for step in steps if step["op"] == "delete"]
+        rewritten = sorted(
+            set(step["dest"] for step in steps if step["op"] == "merge")
+            | set(step["path"] for step in steps if step["op"] in SIDECAR_OPS)
+        )
+
+        return {
+            "renamed": {"files": len(renamed), "bytes": sum(map(_file_size, renamed))},
+            "deleted": {"files": len(deleted), "bytes": sum(map(_file_size, deleted))},
+            "sidecars_rewritten": {
+                "files": len(rewritten),
+                "bytes": sum(map(_file_size, rewritten)),
+            },
+            "intended_for_edits": sum(
+                len(step["references"]) if step["op"] == "remove_intended_for" else 1
+                for step in steps
+                if step["op"] in SIDECAR_OPS
+            ),
+            "datalad_paths": len(_get_plan_paths(steps)) if self.use_datalad else 0,
+            "collisions": _find_collisions(steps),
+        }
+
+    def _run_plan(self, plan, script_file, progress_file=None, if_message=None, run_message=None):
+        """Run the steps of a plan that aren't done yet.
+
+        IntendedFor edits are run in Python.
+        The other steps are written to a bash script,
+        which is run with ``datalad run`` if datalad is used.
+        Before the first step runs, the plan is checked against the dataset
+        (see :func:`_check_plan`).
+
+        Parameters
+        ----------
+        plan : :obj:`dict`
+            The plan, from ``_plan_tsv_changes`` or ``_plan_purge``.
+        script_file : :obj:`str`
+            Path to the bash script to write.
+        progress_file : :obj:`str`, optional
+            File listing the steps that are done.
+            Steps listed in it are skipped, and steps are added to it once they have run.
+            Default is None, in which case no progress is recorded.
+        if_message : :obj:`str`, optional
+            Commit message for the IntendedFor edits.
+        run_message : :obj:`str`, optional
+            Commit message for the script.
+        """
+        steps = plan["steps"]
+        journal = Journal(
+            self.path, plan["operation"], use_datalad=self.use_datalad, state=plan["journal"]
+        )
+        done = set()
+        if progress_file and Path(progress_file).exists():
+            with open(progress_file, "r") as fo:
+                done = set(int(line) for line in fo if line.strip())
+
+        if not done:
+            _check_plan(plan, journal)
+
+        todo = [(i, step) for i, step in enumerate(steps) if i not in done]
+        sidecar_steps = [(i, step) for i, step in todo if step["op"] in SIDECAR_OPS]
+        if_paths = sorted(set(step["path"] for _, step in sidecar_steps))
+
+        # only unlock the sidecars that will change
+        unlocked = self.unlock_files(
+            if_paths + [step["dest"] for _, step in todo if step["op"] == "merge"]
+        )
+        for i, step in sidecar_steps:
+            _edit_intended_for(step)
+            if progress_file:
+                _mark_step_done(progress_file, i)
+
+        # save IntendedFor edits so that you can datalad run
+        # the other commands on a clean dataset
+        if self.use_datalad:
+            save_paths = if_paths + unlocked
+            if not self.is_datalad_clean(paths=save_paths):
+                self.datalad_save(message=if_message, paths=save_paths)
+
+            # datalad run needs a clean dataset, so save any other pending changes too
+            # (e.g., from an interrupted run)
+            if not self.is_datalad_clean():
+                self.datalad_save(message=if_message)
+
+            self._layout = None
+
+        commands = []
+        for i, step in todo:
+            if step["op"] in SIDECAR_OPS:
+                continue
 
-                s1 = "Renamed Variant Group scans according to their variant "
-                s2 = "parameters"
+            commands += _get_step_commands(step, journal, self.use_datalad)
+            if progress_file:
+                commands.append(f"echo {i} >> {progress_file}")
 
-                rename_commit = s1 + s2
+        if commands:
+            # write the commands to a .sh file, stopping at the first failure
+            with open(script_file, "w") as fo:
+                fo.write("#!/bin/bash\nset -e\n")
+                fo.write("\n".join(commands))
 
-                self.datalad_handle.run(cmd=["bash", renames], message=rename_commit)
+            if self.use_datalad:
+                self.datalad_handle.run(cmd=["bash", script_file], message=run_message)
             else:
-                subprocess.run(
-                    ["bash", renames],
+                run_proc = subprocess.run(
+                    ["bash", script_file],
                     stdout=subprocess.PIPE,
-                    cwd=str(Path(new_prefix).parent),
+                    cwd=str(Path(script_file).parent),
                 )
+                if run_proc.returncode != 0:
+                    raise Exception(f"Failed to run {script_file}")
+
+            # the layout is indexed again the next time it is needed
+            self._layout = None
         else:
             print("Not running any commands")
 
-        self.reset_bids_layout()
-        self.get_tsvs(new_prefix)
+        for step in steps:
+            if step["op"] == "rename":
+                journal.add_renames([step["old"]], [step["new"]])
+            elif step["op"] == "delete":
+                journal.add_deletions([step["path"]])
 
-        # remove renames file that gets created under the hood
-        subprocess.run(["rm", "-rf", "renames"])
+        self.touched_paths.update(_get_plan_paths(steps))
+
+        journal_file = journal.write()
+        if journal_file and self.use_datalad:
+            self.datalad_save(
+                message=f"Recorded {plan['operation']} in the CuBIDS journal", paths=[journal_file]
+            )
 
     def change_filename(self, filepath, entities):
         """Apply changes to a filename based on the renamed entity sets.
@@ -619,7 +1085,6 @@ class CuBIDS(object):
         files_with_if += Path(ses_path).rglob("perf/*_m0scan.json")
         for path_with_if in files_with_if:
             filename_with_if = str(path_with_if)
-            self.IF_rename_paths.append(filename_with_if)
             # json_file = self.layout.get_file(filename_with_if)
             # data = json_file.get_dict()
             data = get_sidecar_metadata(filename_with_if)
@@ -629,16 +1094,18 @@ class CuBIDS(object):
 
             if "IntendedFor" in data.keys():
                 # Coerce IntendedFor to a list.
-                data["IntendedFor"] = listify(data["IntendedFor"])
-                for item in data["IntendedFor"]:
-                    if item in _get_intended_for_reference(filepath):
-                        # remove old filename
-                        data["IntendedFor"].remove(item)
-                        # add new filename
-                        data["IntendedFor"].append(_get_intended_for_reference(new_path))
-
-                # update the json with the new data dictionary
-                _update_json(filename_with_if, data)
+                old_reference = _get_intended_for_reference(filepath)
+                if any(item in old_reference for item in listify(data["IntendedFor"])):
+                    # the reference is replaced when the plan runs
+                    self.IF_rename_paths.append(filename_with_if)
+                    self.IF_rename_steps.append(
+                        {
+                            "op": "rename_intended_for",
+                            "path": filename_with_if,
+                            "old": old_reference,
+                            "new": _get_intended_for_reference(new_path),
+                        }
+                    )
 
         # save IntendedFor purges so that you can datalad run the
         # remove association file commands on a clean dataset
@@ -649,7 +1116,17 @@ class CuBIDS(object):
         # else:
         #     print("No IntendedFor References to Rename")
 
-    def copy_exemplars(self, exemplars_dir, exemplars_tsv, min_group_size):
+    def copy_exemplars(
+        self,
+        exemplars_dir,
+        exemplars_tsv,
+        min_group_size,
+        link_mode="copy",
+        n_jobs=1,
+        only_group_files=False,
+        datalad_clone=False,
+        selection="first",
+    ):
         """Copy one subject from each Acquisition Group into a new directory for testing preps.
 
         Raises an error if the subjects are not unlocked,
@@ -669,7 +1146,56 @@ class CuBIDS(object):
         min_group_size : :obj:`int`
             Minimum number of subjects in an acq group for it to be included
             in the exemplar dataset.
+        link_mode : {"copy", "auto", "hardlink", "symlink", "reflink"}, optional
+            How files are placed in the exemplar dataset.
+            See :func:`cubids.utils.link_file`. Default is "copy".
+        n_jobs : :obj:`int`, optional
+            Number of files to copy at once. Default is 1.
+        only_group_files : :obj:`bool`, optional
+            If True, only copy the scans (and their sidecars and other associated files)
+            of each exemplar's acquisition group, e.g., a single session,
+            instead of the exemplar subject's whole directory.
+            Default is False.
+        datalad_clone : :obj:`bool`, optional
+            If True, make the exemplar dataset as a local datalad clone of this dataset,
+            remove everything but the exemplars and get their content,
+            which is hardlinked from this dataset's annex instead of copied where possible.
+            Requires ``use_datalad``. Default is False.
+        selection : {"first", "smallest", "cover"}, optional
+            How exemplars are chosen.
+            "first" takes the first subject listed for each Acquisition Group.
+            "smallest" takes the subject with the fewest bytes to copy for each group.
+            "cover" picks the subjects with the fewest bytes that, together,
+            cover every Parameter Group, which needs the ``_files.tsv``
+            written next to ``exemplars_tsv``.
+            Default is "first".
         """
+        if os.sep not in str(exemplars_tsv):
+            if not self.cubids_code_dir:
+                self.create_cubids_code_dir()
+            exemplars_tsv = self.path + "/code/CuBIDS/" + exemplars_tsv
+
+        # load the exemplars tsv
+        subs = pd.read_table(exemplars_tsv)
+
+        # if min group size flag set, drop acq groups with less than min
+        if min_group_size > 1:
+            group_sizes = subs.groupby("AcqGroup")["AcqGroup"].transform("size")
+            subs = subs[group_sizes >= min_group_size]
+
+        unique = self._select_exemplars(subs, exemplars_tsv, selection, only_group_files)
+        to_copy = self._get_exemplar_files(unique, only_group_files)
+
+        s1 = "Copied one subject from each Acquisition Group "
+        s2 = "into the Exemplar Dataset"
+        msg = s1 + s2
+        if datalad_clone:
+            if not self.use_datalad:
+                raise Exception("Cloning the exemplar dataset requires use_datalad")
+
+            self._clone_exemplars(exemplars_dir, to_copy, msg)
+            return
+
         # create the exemplar ds
         if self.use_datalad:
             subprocess.run(
@@ -683,48 +1209,215 @@ class CuBIDS(object):
                     exemplars_dir,
                 ]
             )
-        if os.sep not in str(exemplars_tsv):
-            if not self.cubids_code_dir:
-                self.create_cubids_code_dir()
-            exemplars_tsv = self.path + "/code/CuBIDS/" + exemplars_tsv
 
-        # load the exemplars tsv
-        subs = pd.read_table(exemplars_tsv)
+        def _copy(relpath):
+            dest = os.path.join(exemplars_dir, relpath)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            link_file(os.path.join(self.path, relpath), dest, mode=link_mode)
 
-        # if min group size flag set, drop acq groups with less than min
-        if min_group_size > 1:
-            for row in range(len(subs)):
-                acq_group = subs.loc[row, "AcqGroup"]
-                size = int(subs["AcqGroup"].value_counts()[acq_group])
-                if size < min_group_size:
-                    subs = subs.drop([row])
-
-        # get one sub from each acq group
-        unique = subs.drop_duplicates(subset=["AcqGroup"])
-
-        # cast list to a set to drop duplicates, then convert back to list
-        unique_subs = list(set(unique["subject"].tolist()))
-        for subid in unique_subs:
-            source = str(self.path) + "/" + subid
-            dest = exemplars_dir + "/" + subid
-            # Copy the content of source to destination
-            copytree(source, dest)
-
-        # Copy the dataset_description.json
-        copyfile(
-            str(self.path) + "/" + "dataset_description.json",
-            exemplars_dir + "/" + "dataset_description.json",
-        )
+        with ThreadPoolExecutor(max_workers=max(1, n_jobs)) as executor:
+            # list() re-raises the first copy error
+            list(executor.map(_copy, to_copy + ["dataset_description.json"]))
 
-        s1 = "Copied one subject from each Acquisition Group "
-        s2 = "into the Exemplar Dataset"
-        msg = s1 + s2
         if self.use_datalad:
             subprocess.run(["datalad", "save", "-d", exemplars_dir, "-m", msg])
 
-    def purge(self, scans_txt):
+    def _select_exemplars(self, subs, exemplars_tsv, selection="first", only_group_files=False):
+        """Choose the exemplars to copy.
+
+        Parameters
+        ----------
+        subs : :obj:`pandas.DataFrame`
+            Rows of the AcqGrouping tsv to choose from.
+        exemplars_tsv : :obj:`str`
+            Path to the AcqGrouping tsv.
+        selection : {"first", "smallest", "cover"}, optional
+            How exemplars are chosen. See :meth:`copy_exemplars`.
+        only_group_files : :obj:`bool`, optional
+            If True, the cost of an exemplar is the size of its group files.
+            Otherwise, it is the size of its subject's directory.
+
+        Returns
+        -------
+        exemplars : :obj:`pandas.DataFrame`
+            Rows of the AcqGrouping tsv for the chosen exemplars.
+        """
+        if selection == "first":
+            # get one sub from each acq group
+            return subs.drop_duplicates(subset=["AcqGroup"])
+
+        if selection not in ("smallest", "cover"):
+            raise Exception(f"Unknown exemplar selection '{selection}'")
+
+        subs = subs.reset_index(drop=True)
+        if not only_group_files:
+            # subjects are copied whole, so sessions don't change the cost
+            subs["session"] = np.nan
+
+        candidates = subs.drop_duplicates(subset=["subject", "session"]).reset_index(drop=True)
+        costs = np.array(
+            [
+                sum(
+                    _file_size(os.path.join(self.path, path))
+                    for path in self._get_exemplar_files(
+                        candidates.iloc[[i]], only_group_files=only_group_files
+                    )
+                )
+                for i in range(len(candidates))
+            ],
+            dtype=float,
+        )
+        candidates["Bytes"] = costs
+
+        if selection == "smallest":
+            costs = subs.merge(candidates[["subject", "session", "Bytes"]], how="left")
+            chosen = costs.loc[costs.groupby("AcqGroup", sort=False)["Bytes"].idxmin()]
+            exemplars = subs.loc[chosen.index]
+            total = chosen.drop_duplicates(subset=["subject", "session"])["Bytes"].sum()
+        else:
+            files_tsv = str(exemplars_tsv).replace("_AcqGrouping.tsv", "_files.tsv")
+            if not Path(files_tsv).exists():
+                raise Exception(f"Selecting exemplars by cover needs {files_tsv}")
+
+            covers = self._get_param_group_covers(files_tsv, candidates)
+            chosen = _greedy_weighted_cover(covers, costs)
+            exemplars = candidates.loc[chosen].drop(columns="Bytes")
+            total = costs[chosen].sum()
+
+        print(f"Selected {len(exemplars)} exemplars ({int(total)} bytes)")
+        return exemplars
+
+    def _get_param_group_covers(self, files_tsv, candidates):
+        """Find the KeyParamGroups of each exemplar candidate.
+
+        Parameters
+        ----------
+        files_tsv : :obj:`str`
+            Path to the files tsv.
+        candidates : :obj:`pandas.DataFrame`
+            The candidates, with subject and session columns.
+            A missing session means the candidate is the whole subject.
+
+        Returns
+        -------
+        covers : :obj:`list` of :obj:`set`
+            The KeyParamGroups of each candidate.
+        """
+        files_df = pd.read_table(files_tsv)
+        subjects = files_df["FilePath"].str.split("/").str[1]
+        sessions = files_df["FilePath"].str.extract(r"/ses-([^/_]+)/", expand=False)
+        covers = []
+        for candidate in candidates.itertuples(index=False):
+            in_candidate = subjects == candidate.subject
+            if pd.notnull(candidate.session):
+                in_candidate &= sessions == str(candidate.session)
+            covers.append(set(files_df.loc[in_candidate, "KeyParamGroup"]))
+
+        return covers
+
+    def _get_exemplar_files(self, exemplars, only_group_files=False):
+        """List the files to copy into the exemplar dataset.
+
+        Parameters
+        ----------
+        exemplars : :obj:`pandas.DataFrame`
+            Rows of the AcqGrouping tsv for the exemplars.
+        only_group_files : :obj:`bool`, optional
+            If True, only list the scans of each exemplar's subject/session,
+            with their associated files.
+            Otherwise, list the exemplar subjects' whole directories.
+
+        Returns
+        -------
+        files : :obj:`list` of :obj:`str`
+            Paths of the files, relative to the dataset root.
+        """
+        if not only_group_files:
+            subject_dirs = [
+                Path(self.path) / subject for subject in sorted(set(exemplars["subject"]))
+            ]
+        else:
+            subject_dirs = []
+            for _, row in exemplars.iterrows():
+                if "session" in row and pd.notnull(row["session"]):
+                    subject_dirs.append(Path(self.path) / row["subject"] / f"ses-{row['session']}")
+                else:
+                    subject_dirs.append(Path(self.path) / row["subject"])
+
+        files = set()
+        for subject_dir in subject_dirs:
+            for root, dirs, filenames in os.walk(subject_dir):
+                # ignore all dot directories
+                dirs[:] = [dirname for dirname in dirs if not dirname.startswith(".")]
+                if not only_group_files:
+                    files.update(os.path.join(root, filename) for filename in filenames)
+                    continue
+
+                for filename in filenames:
+                    if ".nii" not in filename:
+                        continue
+
+                    # the scan, its sidecar, bval, bvec, etc., and its events
+                    stem = filename.split(".")[0]
+                    events = stem.replace("_bold", "_events")
+                    files.update(
+                        os.path.join(root, other)
+                        for other in filenames
+                        if other.split(".")[0] in (stem, events)
+                    )
+
+        return sorted(os.path.relpath(path, self.path) for path in files)
+
+    def _clone_exemplars(self, exemplars_dir, to_copy, message, batch_size=500):
+        """Make the exemplar dataset as a local clone that shares this dataset's annex.
+
+        Parameters
+        ----------
+        exemplars_dir : :obj:`str`
+            Path to the exemplar dataset to create.
+        to_copy : :obj:`list` of :obj:`str`
+            Paths of the files to keep, relative to the dataset root.
+        message : :obj:`str`
+            Commit message for removing the other files.
+        batch_size : :obj:`int`, optional
+            Number of files to remove with each git call. Default is 500.
+        """
+        dlapi.clone(source=self.path, path=exemplars_dir)
+
+        # get content as hardlinks to this dataset's annexed files, where possible
+        subprocess.run(["git", "config", "annex.hardlink", "true"], cwd=exemplars_dir, check=True)
+
+        # remove everything but the exemplars, dataset_description.json and dot files
+        keep = set(to_copy + ["dataset_description.json"])
+        ls_proc = subprocess.run(
+            ["git", "ls-files", "-z"], cwd=exemplars_dir, stdout=subprocess.PIPE, check=True
+        )
+        to_remove = [
+            path
+            for path in ls_proc.stdout.decode().split("\0")
+            if path and path not in keep and not path.startswith(".")
+        ]
+        for start in range(0, len(to_remove), batch_size):
+            subprocess.run(
+                ["git", "rm", "-q", "--"] + to_remove[start : start + batch_size],
+                cwd=exemplars_dir,
+                check=True,
+            )
+
+        dlapi.save(dataset=exemplars_dir, message=message)
+        dlapi.get(
+            dataset=exemplars_dir, path=[os.path.join(exemplars_dir, path) for path in to_copy]
+        )
+
+    def purge(self, scans_txt, resume=False, dry_run=False):
         """Purge all associations of desired scans from a bids dataset.
 
+        The plan is written to ``<scans_txt without extension>_purge_plan.json``
+        before the dataset is modified, as in :meth:`apply_tsv_changes`.
+        Without datalad, the purged files are kept in the journal's trash,
+        until the purge is undone or the trash is emptied
+        with :func:`~cubids.journal.prune_trash`.
+
         Parameters
         ----------
         scans_txt : str
@@ -732,26 +1425,92 @@ class CuBIDS(object):
             you want to be deleted from the dataset, along
             with their associations.
             example path: /Users/Covitz/CCNP/scans_to_delete.txt
+        resume : :obj:`bool`
+            If True, continue the unfinished plan of an earlier purge of the same scans,
+            skipping the steps that are done.
+        dry_run : :obj:`bool`
+            If True, only write the plan, with an estimate of its cost, and don't run it.
+            The plan can be run later with ``resume=True``,
+            as long as the files it touches haven't changed and none of its renames collide.
+
+        Returns
+        -------
+        plan : :obj:`dict` or None
+            The plan, with its estimate, if ``dry_run`` is True.
         """
         self.scans_txt = scans_txt
+        self.touched_paths = set()
+
+        plan_file = str(Path(scans_txt).with_suffix("")) + "_purge_plan.json"
+        progress_file = str(Path(scans_txt).with_suffix("")) + "_purge_progress.txt"
+        if resume:
+            if not Path(plan_file).exists():
+                raise Exception(f"No unfinished purge to resume: {plan_file} does not exist")
 
-        scans = []
-        with open(scans_txt, "r") as fd:
-            reader = csv.reader(fd)
-            for row in reader:
-                scans.append(self.path + "/" + str(row[0]))
+            with open(plan_file, "r") as fo:
+                plan = json.load(fo)
+
+        else:
+            if Path(plan_file).exists():
+                raise Exception(
+                    f"Found the plan of an unfinished purge in {plan_file}. "
+                    "Use --resume to continue it, or delete it to start over."
+                )
 
-        # check to ensure scans are all real files in the ds!
+            scans = []
+            with open(scans_txt, "r") as fd:
+                reader = csv.reader(fd)
+                for row in reader:
+                    scans.append(self.path + "/" + str(row[0]))
+
+            # check to ensure scans are all real files in the ds!
+
+            steps = self._plan_purge(scans)
+            if not steps:
+                print("Not running any association removals")
+                return
+
+            plan = {
+                "operation": "purge",
+                "steps": steps,
+                "journal": self._plan_journal("purge", steps),
+                "stats": _get_path_stats(steps),
+            }
+            if dry_run:
+                plan["estimate"] = self.estimate_plan(plan)
+                _write_plan(plan, plan_file)
+                _print_estimate(plan, plan_file)
+                return plan
+
+            _write_plan(plan, plan_file)
+            if Path(progress_file).exists():
+                os.remove(progress_file)
+
+        self._run_plan(
+            plan,
+            str(Path(self.path).parent / "_full_cmd.sh"),
+            progress_file=progress_file,
+            if_message="Purged IntendedFor references to files requested for removal",
+            run_message=f"Purged scans listed in {self.scans_txt} from dataset",
+        )
 
-        self._purge_associations(scans)
+        # the plan is done
+        os.remove(plan_file)
+        if Path(progress_file).exists():
+            os.remove(progress_file)
 
-    def _purge_associations(self, scans):
-        """Purge field map JSONs' IntendedFor references.
+    def _plan_purge(self, scans):
+        """Plan the removal of scans, their associations and IntendedFor references to them.
 
         Parameters
         ----------
         scans : :obj:`list` of :obj:`str`
-            List of file paths to remove from field map JSONs.
+            List of file paths to remove from the dataset and from field map JSONs.
+
+        Returns
+        -------
+        steps : :obj:`list` of :obj:`dict`
+            IntendedFor edits, followed by file deletions.
         """
         # truncate all paths to intendedfor reference format
         # sub, ses, modality only (no self.path)
@@ -759,7 +1518,8 @@ class CuBIDS(object):
         for scan in scans:
             if_scans.append(_get_intended_for_reference(self.path + scan))
 
-        for path in Path(self.path).rglob("sub-*/*/fmap/*.json"):
+        steps = []
+        for path in sorted(Path(self.path).rglob("sub-*/*/fmap/*.json")):
             # json_file = self.layout.get_file(str(path))
             # data = json_file.get_dict()
             data = get_sidecar_metadata(str(path))
@@ -769,24 +1529,11 @@ class CuBIDS(object):
 
             # remove scan references in the IntendedFor
             if "IntendedFor" in data.keys():
-                data["IntendedFor"] = listify(data["IntendedFor"])
-
-                for item in data["IntendedFor"]:
-                    if item in if_scans:
-                        data["IntendedFor"].remove(item)
-
-                # update the json with the new data dictionary
-                _update_json(str(path), data)
-
-        # save IntendedFor purges so that you can datalad run the
-        # remove association file commands on a clean dataset
-        if self.use_datalad:
-            if not self.is_datalad_clean():
-                s1 = "Purged IntendedFor references to files "
-                s2 = "requested for removal"
-                message = s1 + s2
-                self.datalad_save(message=message)
-                self.reset_bids_layout()
+                references = [item for item in listify(data["IntendedFor"]) if item in if_scans]
+                if references:
+                    steps.append(
+                        {"op": "remove_intended_for", "path": str(path), "references": references}
+                    )
 
         # NOW WE WANT TO PURGE ALL ASSOCIATIONS
 
@@ -821,46 +1568,15 @@ class CuBIDS(object):
 
         to_remove += scans
 
-        # create rm commands for all files that need to be purged
-        purge_commands = []
-        for rm_me in to_remove:
+        # delete each file once
+        for rm_me in dict.fromkeys(str(rm_me) for rm_me in to_remove):
             if Path(rm_me).exists():
-                purge_commands.append("rm " + rm_me)
-
-        # datalad run the file deletions (purges)
-        full_cmd = "\n".join(purge_commands)
-        if full_cmd:
-            # write full_cmd to a .sh file
-            # Open file for writing
+                steps.append({"op": "delete", "path": rm_me})
 
-            path_prefix = str(Path(self.path).parent)
+        return steps
 
-            with open(path_prefix + "/" + "_full_cmd.sh", "w") as fo:
-                fo.write("#!/bin/bash\n")
-                fo.write(full_cmd)
-
-            if self.scans_txt:
-                cmt = f"Purged scans listed in {self.scans_txt} from dataset"
-            else:
-                cmt = "Purged Parameter Groups marked for removal"
-
-            purge_file = path_prefix + "/" + "_full_cmd.sh"
-            if self.use_datalad:
-                self.datalad_handle.run(cmd=["bash", purge_file], message=cmt)
-            else:
-                subprocess.run(
-                    ["bash", path_prefix + "/" + "_full_cmd.sh"],
-                    stdout=subprocess.PIPE,
-                    cwd=path_prefix,
-                )
-
-            self.reset_bids_layout()
-
-        else:
-            print("Not running any association removals")
-
-    def get_nifti_associations(self, nifti):
-        """Get nifti associations.
+    def get_nifti_associations(self, nifti):
+        """Get nifti associations.
 
         This uses globbing to find files with the same path, entities, and suffix as the NIfTI,
         but with a different extension.
@@ -874,12 +1590,28 @@ class CuBIDS(object):
 
         return associations
 
-    def _cache_fieldmaps(self):
-        """Search all fieldmaps and create a lookup for each file."""
+    def _cache_fieldmaps(self, subjects=None):
+        """Search all fieldmaps and create a lookup for each file.
+
+        Parameters
+        ----------
+        subjects : :obj:`list` of :obj:`str`, optional
+            Only search the fieldmaps of these subjects (e.g., "sub-01"),
+            by walking their folders instead of indexing the whole dataset.
+            Default is None, in which case all fieldmaps are searched.
+        """
         suffix = "(phase1|phasediff|epi|fieldmap)"
-        fmap_files = self.layout.get(
-            suffix=suffix, regex_search=True, extension=[".nii.gz", ".nii"]
-        )
+        if subjects is None:
+            fmap_files = self.layout.get(
+                suffix=suffix, regex_search=True, extension=[".nii.gz", ".nii"]
+            )
+        else:
+            fmap_pattern = re.compile(rf"_{suffix}\.nii(\.gz)?$")
+            fmap_files = []
+            for subject in sorted(subjects):
+                for path in sorted(Path(self.path, subject).rglob("*.nii*")):
+                    if "/." not in str(path) and fmap_pattern.search(path.name):
+                        fmap_files.append(bids.layout.BIDSFile(str(path)))
 
         misfits = []
         files_to_fmaps = defaultdict(list)
@@ -892,7 +1624,7 @@ class CuBIDS(object):
                 continue
             if_list = metadata.get("IntendedFor")
             intentions = listify(if_list)
-            subject_prefix = f"sub-{fmap_file.entities['subject']}"
+            subject_prefix = Path(fmap_file.path).relative_to(self.path).parts[0]
 
             if intentions is not None:
                 for intended_for in intentions:
@@ -927,40 +1659,25 @@ class CuBIDS(object):
         """
         if not self.fieldmaps_cached:
             raise Exception("Fieldmaps must be cached to find parameter groups.")
-        key_entities = _entity_set_to_entities(entity_set)
-        key_entities["extension"] = ".nii[.gz]*"
-
-        matching_files = self.layout.get(
-            return_type="file", scope="self", regex_search=True, **key_entities
-        )
 
-        # ensure files who's entities contain key_entities but include other
-        # entities do not also get added to matching_files
-        to_include = []
-        for filepath in matching_files:
-            f_entity_set = _file_to_entity_set(filepath)
-
-            if f_entity_set == entity_set:
-                to_include.append(filepath)
-
-        # get the modality associated with the entity set
-        modalities = ["/dwi/", "/anat/", "/func/", "/perf/", "/fmap/"]
-        modality = ""
-        for mod in modalities:
-            if mod in filepath:
-                modality = mod.replace("/", "").replace("/", "")
+        if self._entity_set_files is not None and entity_set in self._entity_set_files:
+            to_include = self._entity_set_files[entity_set]
+        else:
+            to_include = self._get_entity_set_files(entity_set)
+            if self._entity_set_files is not None:
+                self._entity_set_files[entity_set] = to_include
 
-        if modality == "":
-            print("Unusual Modality Detected")
-            modality = "other"
+        modality = _get_entity_set_modality(to_include)
 
         ret = _get_param_groups(
             to_include,
             self.fieldmap_lookup,
             entity_set,
-            self.grouping_config,
+            self.grouping_spec,
             modality,
             self.keys_files,
+            sidecar_cache=self._sidecar_cache,
+            engine=self.engine,
         )
 
         if ret == "erroneous sidecar found":
@@ -972,24 +1689,39 @@ class CuBIDS(object):
         tup_ret = tuple(l_ret)
         return tup_ret
 
+    def _get_entity_set_files(self, entity_set):
+        """Find the NIfTI files that belong to an entity set."""
+        key_entities = _entity_set_to_entities(entity_set)
+        key_entities["extension"] = ".nii[.gz]*"
+
+        matching_files = self.layout.get(
+            return_type="file", scope="self", regex_search=True, **key_entities
+        )
+
+        # ensure files who's entities contain key_entities but include other
+        # entities do not also get added to matching_files
+        to_include = []
+        for filepath in matching_files:
+            f_entity_set = _file_to_entity_set(filepath)
+
+            if f_entity_set == entity_set:
+                to_include.append(filepath)
+
+        return to_include
+
     def create_data_dictionary(self):
         """Create a data dictionary."""
-        sidecar_params = self.grouping_config.get("sidecar_params")
-        for mod in sidecar_params.keys():
-            mod_dict = sidecar_params[mod]
-            for s_param in mod_dict.keys():
+        for mod_spec in self.grouping_spec.modality_specs:
+            for s_param in mod_spec.sidecar_columns:
                 if s_param not in self.data_dict.keys():
                     self.data_dict[s_param] = {"Description": "Scanning Parameter"}
 
-        relational_params = self.grouping_config.get("relational_params")
-        for r_param in relational_params.keys():
+        for r_param, _, _ in self.grouping_spec.relational_params:
             if r_param not in self.data_dict.keys():
                 self.data_dict[r_param] = {"Description": "Scanning Parameter"}
 
-        derived_params = self.grouping_config.get("derived_params")
-        for mod in derived_params.keys():
-            mod_dict = derived_params[mod]
-            for d_param in mod_dict.keys():
+        for mod_spec in self.grouping_spec.modality_specs:
+            for d_param in mod_spec.derived_columns:
                 if d_param not in self.data_dict.keys():
                     self.data_dict[d_param] = {"Description": "NIfTI Header Parameter"}
 
@@ -1072,9 +1804,35 @@ class CuBIDS(object):
 
         return json_dict
 
-    def get_param_groups_dataframes(self):
-        """Create DataFrames of files x param groups and a summary."""
-        entity_sets = self.get_entity_sets()
+    def get_param_groups_dataframes(self, entity_sets=None):
+        """Create DataFrames of files x param groups and a summary.
+
+        Parameters
+        ----------
+        entity_sets : :obj:`list` of :obj:`str`, optional
+            Entity sets to group. If None, the entity sets are found with
+            :meth:`get_entity_sets`.
+        """
+        big_df, summary, modality = self._group_entity_sets(entity_sets)
+        summary = self._add_summary_columns(summary, modality)
+
+        return (big_df, summary)
+
+    def _group_entity_sets(self, entity_sets=None):
+        """Find the param groups of entity sets.
+
+        Returns
+        -------
+        big_df : :obj:`pandas.DataFrame`
+            One row per file.
+        summary : :obj:`pandas.DataFrame`
+            One row per param group, without the columns users fill in.
+        modality : :obj:`str`
+            Modality of the last entity set.
+        """
+        if entity_sets is None:
+            entity_sets = self.get_entity_sets()
+
         labeled_files = []
         param_group_summaries = []
         for entity_set in entity_sets:
@@ -1094,9 +1852,7 @@ class CuBIDS(object):
         big_df = _order_columns(pd.concat(labeled_files, ignore_index=True))
 
         # make Filepaths relative to bids dir
-        for row in range(len(big_df)):
-            long_name = big_df.loc[row, "FilePath"]
-            big_df.loc[row, "FilePath"] = long_name.replace(self.path, "")
+        big_df["FilePath"] = big_df["FilePath"].str.replace(self.path, "", regex=False)
 
         summary = _order_columns(pd.concat(param_group_summaries, ignore_index=True))
 
@@ -1114,6 +1870,23 @@ class CuBIDS(object):
         key_param_col = big_df.pop("KeyParamGroup")
         big_df.insert(0, "KeyParamGroup", key_param_col)
 
+        return big_df, summary, modality
+
+    def _add_summary_columns(self, summary, modality):
+        """Add the columns users fill in to a summary, and suggest renames for variant groups.
+
+        Parameters
+        ----------
+        summary : :obj:`pandas.DataFrame`
+            The param group summary.
+        modality : :obj:`str`
+            Modality whose rename columns are used to suggest renames.
+
+        Returns
+        -------
+        summary : :obj:`pandas.DataFrame`
+            The summary, with Notes, ManualCheck, MergeInto and RenameEntitySet columns.
+        """
         summary.insert(0, "RenameEntitySet", np.nan)
         summary.insert(0, "MergeInto", np.nan)
         summary.insert(0, "ManualCheck", np.nan)
@@ -1122,38 +1895,28 @@ class CuBIDS(object):
         # Now automate suggested rename based on variant params
         # loop though imaging and derived param keys
 
-        sidecar = self.grouping_config.get("sidecar_params")
-        sidecar = sidecar[modality]
-
-        relational = self.grouping_config.get("relational_params")
+        mod_spec = self.grouping_spec[modality]
 
         # list of columns names that we account for in suggested renaming
         summary["RenameEntitySet"] = summary["RenameEntitySet"].apply(str)
 
-        rename_cols = []
-        tolerance_cols = []
-        for col in sidecar.keys():
-            if "suggest_variant_rename" in sidecar[col].keys():
-                if sidecar[col]["suggest_variant_rename"] and col in summary.columns:
-                    rename_cols.append(col)
-                    if "tolerance" in sidecar[col].keys():
-                        tolerance_cols.append(col)
+        rename_cols = [col for col in mod_spec.rename_columns if col in summary.columns]
 
         # deal with Fmap!
-        if "FieldmapKey" in relational:
-            if "suggest_variant_rename" in relational["FieldmapKey"].keys():
-                if relational["FieldmapKey"]["suggest_variant_rename"]:
-                    # check if 'bool' or 'columns'
-                    if relational["FieldmapKey"]["display_mode"] == "bool":
-                        rename_cols.append("HasFieldmap")
+        fieldmap_key = self.grouping_spec.get_relational("FieldmapKey")
+        if fieldmap_key is not None:
+            display_mode, suggest_rename = fieldmap_key
+            # check if 'bool' or 'columns'
+            if suggest_rename and display_mode == "bool":
+                rename_cols.append("HasFieldmap")
 
         # deal with IntendedFor Key!
-        if "IntendedForKey" in relational:
-            if "suggest_variant_rename" in relational["IntendedForKey"].keys():
-                if relational["FieldmapKey"]["suggest_variant_rename"]:
-                    # check if 'bool' or 'columns'
-                    if relational["IntendedForKey"]["display_mode"] == "bool":
-                        rename_cols.append("UsedAsFieldmap")
+        intended_for_key = self.grouping_spec.get_relational("IntendedForKey")
+        if intended_for_key is not None:
+            display_mode, suggest_rename = intended_for_key
+            # check if 'bool' or 'columns'
+            if suggest_rename and display_mode == "bool":
+                rename_cols.append("UsedAsFieldmap")
 
         dom_dict = {}
         # loop through summary tsv and create dom_dict
@@ -1231,7 +1994,7 @@ class CuBIDS(object):
                 if summary.loc[row, col] == "nan":
                     summary.at[row, col] = ""
 
-        return (big_df, summary)
+        return summary
 
     def get_tsvs(self, path_prefix):
         """Create the _summary and _files tsvs for the bids dataset.
@@ -1255,8 +2018,283 @@ class CuBIDS(object):
             # send outputs to code/CuBIDS in BIDS tree
             path_prefix = self.path + "/code/CuBIDS/" + path_prefix
 
-        big_df, summary = self.get_param_groups_dataframes()
+        self._write_tsvs(path_prefix)
 
+    def _update_tsvs(self, files_tsv, summary_tsv, plan, path_prefix):
+        """Write the grouping outputs of apply by grouping only the entity sets it changed.
+
+        The rows of the other entity sets are copied from the tsvs that were applied,
+        and only the fieldmaps of the subjects with changed entity sets are read.
+        The outputs match those of :meth:`get_tsvs`, except for the order of rows.
+        If the applied tsvs don't list the dataset's files, all entity sets are grouped.
+
+        Parameters
+        ----------
+        files_tsv : :obj:`str`
+            Path to the files tsv that was applied.
+        summary_tsv : :obj:`str`
+            Path to the summary tsv that was applied.
+        plan : :obj:`dict`
+            The plan that was run, from ``_plan_tsv_changes``.
+        path_prefix : :obj:`str`
+            Prefix of the new tsv files.
+        """
+        if "/" not in path_prefix:
+            self.create_cubids_code_dir()
+            path_prefix = self.path + "/code/CuBIDS/" + path_prefix
+
+        regroup = set(plan["regroup"])
+        old_files = pd.read_table(files_tsv)
+        old_summary = pd.read_table(summary_tsv)
+
+        # the tsvs can only be reused if they listed the dataset's files before the plan
+        new_names = {step["old"]: step["new"] for step in plan["steps"] if step["op"] == "rename"}
+        deleted = set(step["path"] for step in plan["steps"] if step["op"] == "delete")
+        expected = set(
+            new_names.get(file_path, file_path)
+            for file_path in self.path + old_files["FilePath"]
+            if file_path not in deleted
+        )
+        self.get_entity_sets()
+        self.keys_files = {
+            entity_set: [str(path) for path in files]
+            for entity_set, files in self.keys_files.items()
+        }
+        if expected != set(path for files in self.keys_files.values() for path in files):
+            print("The applied tsvs don't match the dataset, so all entity sets are grouped")
+            self.reset_bids_layout()
+            self.get_tsvs(path_prefix)
+            return
+
+        entity_sets = sorted(regroup & set(self.keys_files))
+        subjects = set(
+            Path(file_path).relative_to(self.path).parts[0]
+            for entity_set in entity_sets
+            for file_path in self.keys_files[entity_set]
+        )
+        self._cache_fieldmaps(subjects=subjects)
+
+        labeled_files = [old_files.loc[~old_files["EntitySet"].isin(regroup)]]
+        summaries = [
+            old_summary.loc[~old_summary["EntitySet"].isin(regroup)].drop(
+                columns=["Notes", "ManualCheck", "MergeInto", "RenameEntitySet"]
+            )
+        ]
+        if entity_sets:
+            self._entity_set_files = {
+                entity_set: sorted(self.keys_files[entity_set]) for entity_set in entity_sets
+            }
+            try:
+                new_files, new_summary, _ = self._group_entity_sets(entity_sets)
+            finally:
+                self._entity_set_files = None
+
+            labeled_files.append(new_files)
+            summaries.append(new_summary)
+
+        big_df = pd.concat(labeled_files, ignore_index=True)
+        summary = pd.concat(summaries, ignore_index=True)
+
+        # drop the columns that only the changed entity sets had
+        big_df = big_df.dropna(axis=1, how="all")
+        summary = summary.dropna(axis=1, how="all")
+
+        big_df = _order_columns(big_df)
+        key_param_col = big_df.pop("KeyParamGroup")
+        big_df.insert(0, "KeyParamGroup", key_param_col)
+
+        summary = _order_columns(summary)
+        key_param_col = summary.pop("KeyParamGroup")
+        summary.insert(0, "KeyParamGroup", key_param_col)
+
+        # renames are suggested with the modality of the last entity set, as in get_tsvs
+        modality = summary.sort_values(by="EntitySet")["Modality"].iloc[-1]
+        summary = self._add_summary_columns(summary, modality)
+
+        self._save_tsvs(big_df, summary, path_prefix)
+
+    def get_tsvs_for_configs(self, path_prefix, grouping_configs):
+        """Create the grouping outputs for several grouping configs in one pass.
+
+        The entity sets and sidecar metadata are loaded once and shared across configs,
+        so only the grouping itself is repeated for each config.
+        One set of outputs is written for each config, using the prefix
+        ``<path_prefix>_<config label>``, where the label is the config file's name
+        (or "default" for the default config).
+        A ``<path_prefix>_ConfigComparison.tsv`` file is also written,
+        with the number of Parameter Groups in each entity set for each config,
+        as well as the total number of Parameter Groups and Acquisition Groups.
+
+        Parameters
+        ----------
+        path_prefix : str
+            prefix of the path to the directory where you want
+            to save your tsvs
+            example path: /Users/Covitz/PennLINC/RBC/CCNP/
+        grouping_configs : :obj:`list` of :obj:`pathlib.Path`
+            Paths to the grouping config files.
+            None may be used to refer to the default config in CuBIDS.
+
+        Returns
+        -------
+        comparison : :obj:`pandas.DataFrame`
+            Side-by-side comparison of the group counts from each config.
+        """
+        self._cache_fieldmaps()
+
+        if "/" not in path_prefix:
+            self.create_cubids_code_dir()
+            path_prefix = self.path + "/code/CuBIDS/" + path_prefix
+
+        labels = _get_config_labels(grouping_configs)
+        entity_sets = self.get_entity_sets()
+
+        orig_config, orig_spec = self.grouping_config, self.grouping_spec
+        self._sidecar_cache = {}
+        self._entity_set_files = {}
+        counts = {}
+        try:
+            for label, config_file in zip(labels, grouping_configs):
+                self.grouping_config = load_config(config_file)
+                self.grouping_spec = GroupingSpec.from_config(self.grouping_config)
+                self.data_dict = {}
+                print(f"Grouping with config {label}")
+                summary, acq_groups = self._write_tsvs(
+                    f"{path_prefix}_{label}", entity_sets=entity_sets
+                )
+                param_group_counts = summary.groupby("EntitySet", sort=False).size()
+                param_group_counts["TotalParamGroups"] = len(summary)
+                param_group_counts["AcqGroups"] = acq_groups["AcqGroup"].nunique()
+                counts[label] = param_group_counts
+        finally:
+            self.grouping_config, self.grouping_spec = orig_config, orig_spec
+            self._sidecar_cache = None
+            self._entity_set_files = None
+
+        comparison = pd.DataFrame(counts).fillna(0).astype(int)
+        comparison.index.name = "EntitySet"
+        comparison = comparison.reset_index()
+        comparison.to_csv(f"{path_prefix}_ConfigComparison.tsv", sep="\t", index=False)
+        print(comparison.to_string(index=False))
+
+        return comparison
+
+    def get_tolerance_sweep(self, path_prefix, sweeps):
+        """Count the parameter groups over a range of tolerances for one or more columns.
+
+        The clustering tree for each swept column is built once per entity set,
+        and is then cut at every tolerance,
+        so sweeping many tolerances costs about the same as grouping once.
+        Each column is swept on its own, with the other columns kept at their configured
+        tolerances.
+
+        Two files are written:
+        ``<path_prefix>_ToleranceSweep.tsv`` has the total number of Parameter Groups
+        and the number of files that change Parameter Group (compared to the configured
+        tolerance) for each column and tolerance.
+        ``<path_prefix>_ToleranceSweepFiles.tsv`` lists those files.
+
+        Parameters
+        ----------
+        path_prefix : str
+            prefix of the path to the directory where you want
+            to save your tsvs
+            example path: /Users/Covitz/PennLINC/RBC/CCNP/
+        sweeps : :obj:`dict`
+            Mapping of column names (e.g., "EchoTime") to a list of tolerances to try.
+
+        Returns
+        -------
+        sweep_df : :obj:`pandas.DataFrame`
+            The Parameter Group and changed file counts for each column and tolerance.
+        """
+        self._cache_fieldmaps()
+
+        if "/" not in path_prefix:
+            self.create_cubids_code_dir()
+            path_prefix = self.path + "/code/CuBIDS/" + path_prefix
+
+        sweep_rows = []
+        changed_dfs = []
+        for entity_set in tqdm(self.get_entity_sets()):
+            files = self._get_entity_set_files(entity_set)
+            if not files:
+                continue
+
+            modality = _get_entity_set_modality(files)
+            param_group_df = _get_param_group_table(
+                files, self.fieldmap_lookup, entity_set, self.grouping_spec, modality
+            )
+            if "FilePath" not in param_group_df:
+                continue
+
+            param_group_df = format_params(param_group_df, self.grouping_spec, modality)
+            file_paths = param_group_df["FilePath"].str.replace(self.path, "", regex=False)
+            config_labels = _param_group_labels(param_group_df)
+
+            for column_name, tolerances in sweeps.items():
+                sweep_labels = sweep_tolerance(param_group_df, column_name, tolerances)
+                for tolerance, labels in zip(tolerances, sweep_labels):
+                    changed = _changed_group_mask(config_labels, labels)
+                    sweep_rows.append(
+                        {
+                            "Column": column_name,
+                            "Tolerance": tolerance,
+                            "ParamGroups": len(np.unique(labels)),
+                            "ChangedFiles": int(changed.sum()),
+                        }
+                    )
+                    if changed.any():
+                        changed_dfs.append(
+                            pd.DataFrame(
+                                {
+                                    "Column": column_name,
+                                    "Tolerance": tolerance,
+                                    "EntitySet": entity_set,
+                                    "FilePath": file_paths[changed].to_numpy(),
+                                }
+                            )
+                        )
+
+        sweep_df = pd.DataFrame(
+            sweep_rows, columns=["Column", "Tolerance", "ParamGroups", "ChangedFiles"]
+        )
+        sweep_df = sweep_df.groupby(["Column", "Tolerance"], sort=False, as_index=False).sum()
+        sweep_df.to_csv(f"{path_prefix}_ToleranceSweep.tsv", sep="\t", index=False)
+
+        if changed_dfs:
+            changed_df = pd.concat(changed_dfs, ignore_index=True)
+        else:
+            changed_df = pd.DataFrame(columns=["Column", "Tolerance", "EntitySet", "FilePath"])
+
+        changed_df.to_csv(f"{path_prefix}_ToleranceSweepFiles.tsv", sep="\t", index=False)
+        print(sweep_df.to_string(index=False))
+
+        return sweep_df
+
+    def _write_tsvs(self, path_prefix, entity_sets=None):
+        """Find the parameter and acquisition groups and write the grouping outputs.
+
+        Parameters
+        ----------
+        path_prefix : str
+            Absolute prefix of the output files.
+        entity_sets : :obj:`list` of :obj:`str`, optional
+            Entity sets to group. If None, the entity sets are found from the dataset.
+
+        Returns
+        -------
+        summary : :obj:`pandas.DataFrame`
+            The parameter group summary.
+        acq_groups : :obj:`pandas.DataFrame`
+            The mapping of subjects/sessions to acquisition groups.
+        """
+        big_df, summary = self.get_param_groups_dataframes(entity_sets=entity_sets)
+
+        return self._save_tsvs(big_df, summary, path_prefix)
+
+    def _save_tsvs(self, big_df, summary, path_prefix):
+        """Sort and write the files and summary tsvs, their dictionaries and the acq groups."""
         summary = summary.sort_values(by=["Modality", "EntitySetCount"], ascending=[True, False])
         big_df = big_df.sort_values(by=["Modality", "EntitySetCount"], ascending=[True, False])
 
@@ -1277,10 +2315,14 @@ class CuBIDS(object):
         summary.to_csv(f"{path_prefix}_summary.tsv", sep="\t", index=False)
 
         # Calculate the acq groups
-        group_by_acquisition_sets(f"{path_prefix}_files.tsv", path_prefix, self.acq_group_level)
+        acq_groups = group_by_acquisition_sets(
+            f"{path_prefix}_files.tsv", path_prefix, self.acq_group_level, engine=self.engine
+        )
 
         print(f"CuBIDS detected {len(summary)} Parameter Groups.")
 
+        return summary, acq_groups
+
     def get_entity_sets(self):
         """Identify the entity sets for the bids dataset."""
         # reset self.keys_files
@@ -1334,37 +2376,147 @@ class CuBIDS(object):
 
                 # write out
                 _update_json(json_file.path, sidecar)
+                self.touched_paths.add(json_file.path)
+
+    def get_all_metadata_fields(self, n_jobs=1):
+        """Return all metadata fields in a bids directory.
+
+        Parameters
+        ----------
+        n_jobs : :obj:`int`, optional
+            Number of threads used to read the sidecars. Default is 1.
+        """
+        census = self.get_metadata_field_census(n_jobs=n_jobs)
+        return sorted(census["Field"].unique())
 
-    def get_all_metadata_fields(self):
-        """Return all metadata fields in a bids directory."""
-        found_fields = set()
-        for json_file in Path(self.path).rglob("*.json"):
-            if ".git" not in str(json_file):
+    def get_metadata_field_census(self, n_jobs=1, chunk_size=1000):
+        """Count the sidecars that have each metadata field.
+
+        The dataset is walked once, without entering dot directories (e.g., .git and .datalad)
+        or the top-level directories that are not BIDS data (e.g., code and sourcedata),
+        and the sidecars are read by a pool of threads.
+
+        Parameters
+        ----------
+        n_jobs : :obj:`int`, optional
+            Number of threads used to read the sidecars. Default is 1.
+        chunk_size : :obj:`int`, optional
+            Number of sidecars read by each task. Default is 1000.
+
+        Returns
+        -------
+        census : :obj:`pandas.DataFrame`
+            The number of sidecars (Count) that have each field (Field),
+            by modality (Modality) and entity set (EntitySet).
+            Sidecars outside of subject directories have no entity set,
+            and sidecars outside of modality directories have the "other" modality.
+        """
+        json_files = list(_find_json_files(self.path, skip_ignored=True))
+
+        def _census(chunk):
+            counts = defaultdict(int)
+            for json_file in chunk:
                 # add this in case `print-metadata-fields` is run before validate
-                try:
-                    with open(json_file, "r", encoding="utf-8") as jsonr:
-                        content = jsonr.read().strip()
-                        if not content:
-                            print(f"Empty file: {json_file}")
-                            continue
-                        metadata = json.loads(content)
-                    found_fields.update(metadata.keys())
-                except json.JSONDecodeError as e:
-                    warnings.warn(f"Error decoding JSON in {json_file}: {e}")
-                except Exception as e:
-                    warnings.warn(f"Unexpected error with file {json_file}: {e}")
-
-        return sorted(found_fields)
-
-    def remove_metadata_fields(self, fields_to_remove):
-        """Remove specific fields from all metadata files."""
+                fields = _read_metadata_fields(json_file)
+                if not fields:
+                    continue
+
+                modality = os.path.basename(os.path.dirname(json_file))
+                if modality not in MODALITIES:
+                    modality = "other"
+
+                entity_set = ""
+                if os.path.relpath(json_file, self.path).startswith("sub-"):
+                    entity_set = _file_to_entity_set(json_file)
+
+                for field in fields:
+                    counts[(field, modality, entity_set)] += 1
+
+            return counts
+
+        chunks = [
+            json_files[start : start + chunk_size]
+            for start in range(0, len(json_files), chunk_size)
+        ]
+        counts = defaultdict(int)
+        with ThreadPoolExecutor(max_workers=max(1, n_jobs)) as executor:
+            for chunk_counts in executor.map(_census, chunks):
+                for key, count in chunk_counts.items():
+                    counts[key] += count
+
+        census = pd.DataFrame(
+            [key + (count,) for key, count in counts.items()],
+            columns=["Field", "Modality", "EntitySet", "Count"],
+        )
+        return census.sort_values(by=["Field", "Modality", "EntitySet"], ignore_index=True)
+
+    def write_metadata_field_census(self, path_prefix, census):
+        """Write the metadata field census to tsv files.
+
+        This writes ``<path_prefix>_MetadataFields.tsv``,
+        with the number of sidecars that have each field, in total and by modality,
+        and ``<path_prefix>_MetadataFieldsByEntitySet.tsv``, with the counts by entity set.
+
+        Parameters
+        ----------
+        path_prefix : :obj:`str`
+            Prefix of the output files.
+            If it is not a path, the files are written to code/CuBIDS.
+        census : :obj:`pandas.DataFrame`
+            The census, from :meth:`get_metadata_field_census`.
+        """
+        if "/" not in path_prefix:
+            self.create_cubids_code_dir()
+            path_prefix = self.path + "/code/CuBIDS/" + path_prefix
+
+        by_modality = census.pivot_table(
+            index="Field", columns="Modality", values="Count", aggfunc="sum", fill_value=0
+        )
+        by_modality.insert(0, "Count", by_modality.sum(axis=1))
+        by_modality.columns.name = None
+        by_modality.reset_index().to_csv(
+            f"{path_prefix}_MetadataFields.tsv", sep="\t", index=False
+        )
+        census.to_csv(f"{path_prefix}_MetadataFieldsByEntitySet.tsv", sep="\t", index=False)
+
+    def remove_metadata_fields(self, fields_to_remove, n_jobs=1, chunk_size=1000):
+        """Remove specific fields from all metadata files.
+
+        Only the sidecars whose bytes contain one of the quoted field names
+        (or could spell one with escapes or another encoding) are parsed,
+        and they are parsed and rewritten by a pool of threads.
+
+        Since the fields are often removed because they hold PHI,
+        the CuBIDS journal only records which fields were removed from each sidecar,
+        not their values. Undo restores the values from git if datalad is used,
+        and can't restore them otherwise.
+
+        Parameters
+        ----------
+        fields_to_remove : :obj:`list` of :obj:`str`
+            Fields to remove.
+        n_jobs : :obj:`int`, optional
+            Number of threads used to read and write the sidecars. Default is 1.
+        chunk_size : :obj:`int`, optional
+            Number of sidecars read by each task. Default is 1000.
+        """
+        self.touched_paths = set()
         remove_fields = set(fields_to_remove)
         if not remove_fields:
             return
 
-        for json_file in tqdm(Path(self.path).rglob("*.json")):
-            # Check for offending keys in the json file
-            if ".git" not in str(json_file):
+        json_files = list(_find_json_files(self.path))
+        needles = [
+            json.dumps(field, ensure_ascii=False).encode("utf-8") for field in remove_fields
+        ]
+
+        def _find_offending(chunk):
+            found = {}
+            for json_file in chunk:
+                if not _may_contain_keys(json_file, needles):
+                    continue
+
+                # Check for offending keys in the json file
                 with open(json_file, "r") as jsonr:
                     metadata = json.load(jsonr)
 
@@ -1376,9 +2528,48 @@ class CuBIDS(object):
                 # Remove the offending keys
                 for key in offending_keys:
                     del metadata[key]
-                # Write the cleaned output
-                with open(json_file, "w") as jsonr:
-                    json.dump(metadata, jsonr, indent=4)
+
+                found[json_file] = metadata
+
+            return found
+
+        chunks = [
+            json_files[start : start + chunk_size]
+            for start in range(0, len(json_files), chunk_size)
+        ]
+        to_update = {}
+        with ThreadPoolExecutor(max_workers=max(1, n_jobs)) as executor:
+            for found in tqdm(executor.map(_find_offending, chunks), total=len(chunks)):
+                to_update.update(found)
+
+        # only unlock the sidecars that will change
+        self.unlock_files(to_update.keys())
+        # the removed values are often PHI, so they aren't written into the journal
+        self.journal = Journal(
+            self.path,
+            "remove-metadata-fields",
+            use_datalad=self.use_datalad,
+            record_values=False,
+        )
+        self.journal.track_sidecars(to_update.keys())
+
+        def _write(item):
+            # Write the cleaned output
+            json_file, metadata = item
+            with open(json_file, "w") as jsonr:
+                json.dump(metadata, jsonr, indent=4)
+
+        with ThreadPoolExecutor(max_workers=max(1, n_jobs)) as executor:
+            # list() re-raises the first write error
+            list(executor.map(_write, to_update.items()))
+
+        self.touched_paths.update(to_update)
+        self._write_journal()
+        if to_update and not self.use_datalad:
+            print(
+                "The removed values are not kept in the CuBIDS journal, "
+                "so undo can't restore them without datalad"
+            )
 
     # # # # FOR TESTING # # # #
     def get_filenames(self):
@@ -1403,6 +2594,317 @@ def _validate_json():
     return True
 
 
+def _edit_intended_for(step):
+    """Run a plan step that removes or renames IntendedFor references in a sidecar.
+
+    Running a step again doesn't change the sidecar.
+    """
+    data = get_sidecar_metadata(step["path"])
+    if data == "Erroneous sidecar":
+        print("Error parsing sidecar: ", step["path"])
+        return
+
+    if "IntendedFor" not in data.keys():
+        return
+
+    intended_for = listify(data["IntendedFor"])
+    if step["op"] == "remove_intended_for":
+        new_intended_for = [item for item in intended_for if item not in step["references"]]
+    else:
+        new_intended_for = [item for item in intended_for if item not in step["old"]]
+        if len(new_intended_for) != len(intended_for):
+            new_intended_for.append(step["new"])
+
+    if new_intended_for != intended_for:
+        # update the json with the new data dictionary
+        data["IntendedFor"] = new_intended_for
+        _update_json(step["path"], data)
+
+
+def _get_step_commands(step, journal, use_datalad):
+    """Get the bash commands that run a merge, rename or delete step of a plan.
+
+    A step's commands run before it is marked as done,
+    so renames and deletions are skipped if they already happened
+    and an interrupted script can be run again.
+    """
+    if step["op"] == "merge":
+        return [f"bids-sidecar-merge {step['source']} {step['dest']}"]
+    elif step["op"] == "rename":
+        # if using datalad, we want to git mv instead of mv
+        mv = "git mv" if use_datalad else "mv"
+        old, new = step["old"], step["new"]
+        return [f"if {_path_exists(old)} || ! {_path_exists(new)}; then {mv} {old} {new}; fi"]
+    elif use_datalad:
+        return [f"if {_path_exists(step['path'])}; then rm {step['path']}; fi"]
+
+    # keep the file in the journal's trash, so the deletion can be undone
+    path = step["path"]
+    trash_path = journal.trash_path(path)
+    return [
+        f"mkdir -p {Path(trash_path).parent}",
+        f"if {_path_exists(path)} || ! {_path_exists(trash_path)}; "
+        f"then mv {path} {trash_path}; fi",
+    ]
+
+
+def _path_exists(path):
+    """Get a bash test for whether a path exists, including broken (e.g., annexed) symlinks."""
+    return f"{{ [ -e {path} ] || [ -L {path} ]; }}"
+
+
+def _mark_step_done(progress_file, step_index):
+    """Record that a plan step is done, making sure it's on disk before moving on."""
+    with open(progress_file, "a") as fo:
+        fo.write(f"{step_index}\n")
+        fo.flush()
+        os.fsync(fo.fileno())
+
+
+def _write_plan(plan, plan_file):
+    """Write a plan atomically, so an interruption never leaves a partial plan behind."""
+    tmp_plan_file = plan_file + ".tmp"
+    with open(tmp_plan_file, "w") as fo:
+        json.dump(plan, fo, indent=4)
+        fo.flush()
+        os.fsync(fo.fileno())
+
+    os.replace(tmp_plan_file, plan_file)
+
+
+def _get_plan_paths(steps):
+    """Get the paths that the steps of a plan write, move or delete."""
+    paths = set()
+    for step in steps:
+        if step["op"] == "rename":
+            paths.update([step["old"], step["new"]])
+        else:
+            paths.add(step["dest"] if step["op"] == "merge" else step["path"])
+
+    return paths
+
+
+def _find_collisions(steps):
+    """Find the renames of a plan that would overwrite other files.
+
+    A new path collides if it is the new path of several renames,
+    or if it is a file that is neither renamed nor deleted before.
+    """
+    renamed_to = defaultdict(list)
+    moved_away = set()
+    collisions = []
+    for step in steps:
+        if step["op"] == "delete":
+            moved_away.add(step["path"])
+        elif step["op"] == "rename":
+            renamed_to[step["new"]].append(step["old"])
+            if os.path.lexists(step["new"]) and step["new"] not in moved_away:
+                collisions.append({"path": step["new"], "sources": [step["old"]]})
+            moved_away.add(step["old"])
+
+    collisions += [
+        {"path": new_path, "sources": old_paths}
+        for new_path, old_paths in renamed_to.items()
+        if len(old_paths) > 1
+    ]
+    return collisions
+
+
+def _get_path_stats(steps):
+    """Get the size and modification time of the files that the steps of a plan read or change.
+
+    Files that don't exist are listed as None.
+    """
+    paths = _get_plan_paths(steps) | set(step["source"] for step in steps if step["op"] == "merge")
+    stats = {}
+    for path in sorted(paths):
+        try:
+            stat = os.lstat(path)
+            stats[path] = [stat.st_size, stat.st_mtime_ns]
+        except OSError:
+            stats[path] = None
+
+    return stats
+
+
+def _check_plan(plan, journal):
+    """Check that a plan that hasn't started yet can still run on the dataset.
+
+    A plan can be written long before it runs (e.g., with ``dry_run=True``),
+    so the files it touches, and the dataset's commit if datalad is used,
+    must not have changed since it was written.
+    Otherwise, its steps and the sidecar contents its journal recorded are out of date.
+    Plans whose renames would overwrite other files are refused.
+    """
+    if journal.base is not None and _get_head(journal.bids_dir) != journal.base:
+        raise Exception(
+            f"The dataset changed since the {plan['operation']} was planned, "
+            f"at commit {journal.base}. Delete the plan and start over."
+        )
+
+    # plans from older versions of CuBIDS don't record the file stats
+    if "stats" in plan and _get_path_stats(plan["steps"]) != plan["stats"]:
+        raise Exception(
+            f"Files changed since the {plan['operation']} was planned. "
+            "Delete the plan and start over."
+        )
+
+    collisions = _find_collisions(plan["steps"])
+    if collisions:
+        raise Exception(
+            f"The {plan['operation']} would overwrite files: "
+            + ", ".join(
+                f"{collision['path']} <- {', '.join(collision['sources'])}"
+                for collision in collisions
+            )
+        )
+
+
+def _file_size(path):
+    """Get the size of a file.
+
+    The size of an annexed file is read from its key, so its content doesn't need to be present.
+    """
+    if os.path.islink(path):
+        annex_size = re.search(r"annex/objects/.*-s(\d+)--", os.readlink(path))
+        if annex_size:
+            return int(annex_size.group(1))
+
+    if os.path.exists(path):
+        return os.path.getsize(path)
+
+    return os.lstat(path).st_size if os.path.lexists(path) else 0
+
+
+def _greedy_weighted_cover(covers, costs):
+    """Choose sets that cover the union of all sets, for a low total cost.
+
+    This is the greedy approximation of weighted set cover:
+    the set with the lowest cost per newly covered element is chosen until all are covered.
+
+    Parameters
+    ----------
+    covers : :obj:`list` of :obj:`set`
+        The elements of each set.
+    costs : :obj:`numpy.ndarray`
+        The cost of each set.
+
+    Returns
+    -------
+    chosen : :obj:`list` of :obj:`int`
+        Indices of the chosen sets, in the order they were chosen.
+    """
+    uncovered = set().union(*covers)
+    chosen = []
+    while uncovered:
+        gains = np.array([len(cover & uncovered) for cover in covers])
+        with np.errstate(divide="ignore"):
+            ratios = np.where(gains > 0, costs / np.maximum(gains, 1), np.inf)
+
+        best = int(np.argmin(ratios))
+        chosen.append(best)
+        uncovered -= covers[best]
+
+    return chosen
+
+
+def _print_estimate(plan, plan_file):
+    """Print the estimated cost of a plan."""
+    estimate = plan["estimate"]
+    print(f"Planned {plan['operation']} with {len(plan['steps'])} steps:")
+    for key in ["renamed", "deleted", "sidecars_rewritten"]:
+        files, n_bytes = estimate[key]["files"], estimate[key]["bytes"]
+        print(f"    {key.replace('_', ' ').capitalize()}: {files} files ({n_bytes} bytes)")
+
+    print(f"    IntendedFor edits: {estimate['intended_for_edits']}")
+    print(f"    Datalad paths to save: {estimate['datalad_paths']}")
+    print(f"    Name collisions: {len(estimate['collisions'])}")
+    for collision in estimate["collisions"]:
+        print(f"        {collision['path']} <- {', '.join(collision['sources'])}")
+
+    print(f"Wrote the plan to {plan_file}. Run it with --resume.")
+
+
+def _is_annex_locked(path):
+    """Check if a file is a locked git-annex file (a symlink into the annex)."""
+    return os.path.islink(path) and "annex/objects/" in os.readlink(path)
+
+
+def _find_json_files(root, skip_ignored=False):
+    """Find the json files in a dataset, without entering dot directories or the journal's trash.
+
+    Parameters
+    ----------
+    root : :obj:`str`
+        Path to the root of the dataset.
+    skip_ignored : :obj:`bool`, optional
+        If True, don't enter the top-level directories that are not BIDS data
+        (code, stimuli, sourcedata and models). Default is False.
+
+    Yields
+    ------
+    json_file : :obj:`str`
+        Path to a json file.
+    """
+    trash_dir = os.path.join(root, TRASH_DIR)
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(
+            dirname
+            for dirname in dirnames
+            if not dirname.startswith(".")
+            and not (skip_ignored and dirpath == root and dirname in IGNORED_DIRS)
+            and os.path.join(dirpath, dirname) != trash_dir
+        )
+        for filename in sorted(filenames):
+            if filename.endswith(".json"):
+                yield os.path.join(dirpath, filename)
+
+
+def _may_contain_keys(json_file, needles):
+    """Check the bytes of a json file for keys, without parsing it.
+
+    This never misses a key: files with escape sequences (which can spell a key differently)
+    or NUL bytes (which UTF-16 and UTF-32 encoded files have) are always reported.
+
+    Parameters
+    ----------
+    json_file : :obj:`str`
+        Path to the json file.
+    needles : :obj:`list` of :obj:`bytes`
+        The keys, quoted and encoded as UTF-8.
+
+    Returns
+    -------
+    :obj:`bool`
+        False if the file can't contain any of the keys.
+    """
+    with open(json_file, "rb") as fo:
+        content = fo.read()
+
+    if b"\\" in content or b"\x00" in content:
+        return True
+
+    return any(needle in content for needle in needles)
+
+
+def _read_metadata_fields(json_file):
+    """Read the fields of a sidecar, warning instead of failing if it can't be read."""
+    try:
+        with open(json_file, "r", encoding="utf-8") as jsonr:
+            content = jsonr.read().strip()
+            if not content:
+                print(f"Empty file: {json_file}")
+                return []
+            metadata = json.loads(content)
+        return list(metadata.keys())
+    except json.JSONDecodeError as e:
+        warnings.warn(f"Error decoding JSON in {json_file}: {e}")
+    except Exception as e:
+        warnings.warn(f"Unexpected error with file {json_file}: {e}")
+
+    return []
+
+
 def _update_json(json_file, metadata):
     if _validate_json():
         with open(json_file, "w", encoding="utf-8") as f:
@@ -1411,6 +2913,39 @@ def _update_json(json_file, metadata):
         print("INVALID JSON DATA")
 
 
+def _get_entity_set_modality(files):
+    """Get the modality associated with an entity set from its files."""
+    filepath = files[-1] if files else ""
+
+    modalities = ["/dwi/", "/anat/", "/func/", "/perf/", "/fmap/"]
+    modality = ""
+    for mod in modalities:
+        if mod in filepath:
+            modality = mod.replace("/", "").replace("/", "")
+
+    if modality == "":
+        print("Unusual Modality Detected")
+        modality = "other"
+
+    return modality
+
+
+def _get_config_labels(grouping_configs):
+    """Create a unique, filename-friendly label for each grouping config."""
+    labels = []
+    for config_file in grouping_configs:
+        label = "default" if config_file is None else Path(config_file).stem
+        label = re.sub(r"[^A-Za-z0-9]+", "", label) or "config"
+        unique_label, i_label = label, 1
+        while unique_label in labels:
+            i_label += 1
+            unique_label = f"{label}{i_label}"
+
+        labels.append(unique_label)
+
+    return labels
+
+
 def _entity_set_to_entities(entity_set):
     """Split a entity_set name into a pybids dictionary of entities."""
     return dict([group.split("-") for group in entity_set.split("_")])
@@ -1432,18 +2967,15 @@ def _get_intended_for_reference(scan):
     return "/".join(Path(scan).parts[-3:])
 
 
-def _get_param_groups(
+def _get_param_group_table(
     files,
     fieldmap_lookup,
     entity_set_name,
     grouping_config,
     modality,
-    keys_files,
+    sidecar_cache=None,
 ):
-    """Find a list of *parameter groups* from a list of files.
-
-    For each file in `files`, find critical parameters for metadata. Then find
-    unique sets of these critical parameters.
+    """Collect the grouping parameters for each file in an entity set.
 
     Parameters
     ----------
@@ -1452,40 +2984,44 @@ def _get_param_groups(
     fieldmap_lookup : :obj:`dict`
         mapping of filename strings relative to the bids root
         (e.g. "sub-X/ses-Y/func/sub-X_ses-Y_task-rest_bold.nii.gz")
-    grouping_config : :obj:`dict`
+    entity_set_name : :obj:`str`
+        Name of the entity set.
+    grouping_config : :obj:`~cubids.config.GroupingSpec` or :obj:`dict`
         configuration for defining parameter groups
+    modality : :obj:`str`
+        Modality of the scan.
+    sidecar_cache : :obj:`dict`, optional
+        Mapping of sidecar paths to their metadata.
+        If provided, sidecars are only read from disk if they are not already in the cache,
+        and newly read sidecars are added to it.
 
     Returns
     -------
-    labeled_files : :obj:`pandas.DataFrame`
-        A data frame with one row per file where the ParamGroup column
-        indicates which group each scan is a part of.
-    param_groups_with_counts : :obj:`pandas.DataFrame`
-        A data frame with param group summaries.
+    df : :obj:`pandas.DataFrame`
+        A data frame with one row per file and one column per grouping parameter,
+        rounded according to the config, but not yet clustered.
     """
-    if not files:
-        print("WARNING: no files for", entity_set_name)
-        return None, None
-
-    # Split the config into separate parts
-    imaging_params = grouping_config.get("sidecar_params", {})
-    imaging_params = imaging_params[modality]
-
-    relational_params = grouping_config.get("relational_params", {})
-
-    derived_params = grouping_config.get("derived_params")
-    derived_params = derived_params[modality]
-
-    imaging_params.update(derived_params)
+    spec = GroupingSpec.from_config(grouping_config)
+    imaging_params = set(spec[modality].columns)
+    derived_params = spec[modality].derived_columns
+    fieldmap_key = spec.get_relational("FieldmapKey")
+    intended_for_key = spec.get_relational("IntendedForKey")
 
     dfs = []
     # path needs to be relative to the root with no leading prefix
 
     for path in files:
         # metadata = layout.get_metadata(path)
-        metadata = get_sidecar_metadata(img_to_new_ext(path, ".json"))
+        sidecar = img_to_new_ext(path, ".json")
+        if sidecar_cache is None:
+            metadata = get_sidecar_metadata(sidecar)
+        else:
+            if sidecar not in sidecar_cache:
+                sidecar_cache[sidecar] = get_sidecar_metadata(sidecar)
+            metadata = sidecar_cache[sidecar]
+
         if metadata == "Erroneous sidecar":
-            print("Error parsing sidecar: ", img_to_new_ext(path, ".json"))
+            print("Error parsing sidecar: ", sidecar)
         else:
             intentions = metadata.get("IntendedFor", [])
             slice_times = metadata.get("SliceTiming", [])
@@ -1495,13 +3031,13 @@ def _get_param_groups(
             example_data["EntitySet"] = entity_set_name
 
             # Get the fieldmaps out and add their types
-            if "FieldmapKey" in relational_params:
+            if fieldmap_key is not None:
                 fieldmap_types = sorted(
                     [_file_to_entity_set(fmap.path) for fmap in fieldmap_lookup[path]]
                 )
 
                 # check if config says columns or bool
-                if relational_params["FieldmapKey"]["display_mode"] == "bool":
+                if fieldmap_key[0] == "bool":
                     if len(fieldmap_types) > 0:
                         example_data["HasFieldmap"] = True
                     else:
@@ -1517,13 +3053,13 @@ def _get_param_groups(
             example_data["FilePath"] = path
 
             # If it's a fieldmap, see what entity set it's intended to correct
-            if "IntendedForKey" in relational_params:
+            if intended_for_key is not None:
                 intended_entity_sets = sorted(
                     [_file_to_entity_set(intention) for intention in intentions]
                 )
 
                 # check if config says columns or bool
-                if relational_params["IntendedForKey"]["display_mode"] == "bool":
+                if intended_for_key[0] == "bool":
                     if len(intended_entity_sets) > 0:
                         example_data["UsedAsFieldmap"] = True
                     else:
@@ -1537,10 +3073,62 @@ def _get_param_groups(
     # Assign each file to a ParamGroup
 
     # round param groups based on precision
-    df = round_params(pd.DataFrame(dfs), grouping_config, modality)
+    df = round_params(pd.DataFrame(dfs), spec, modality)
+
+    return df
+
+
+def _get_param_groups(
+    files,
+    fieldmap_lookup,
+    entity_set_name,
+    grouping_config,
+    modality,
+    keys_files,
+    sidecar_cache=None,
+    engine="pandas",
+):
+    """Find a list of *parameter groups* from a list of files.
+
+    For each file in `files`, find critical parameters for metadata. Then find
+    unique sets of these critical parameters.
+
+    Parameters
+    ----------
+    files : :obj:`list` of :obj:`str`
+        List of file names
+    fieldmap_lookup : :obj:`dict`
+        mapping of filename strings relative to the bids root
+        (e.g. "sub-X/ses-Y/func/sub-X_ses-Y_task-rest_bold.nii.gz")
+    grouping_config : :obj:`~cubids.config.GroupingSpec` or :obj:`dict`
+        configuration for defining parameter groups
+    sidecar_cache : :obj:`dict`, optional
+        Mapping of sidecar paths to their metadata.
+        If provided, sidecars are only read from disk if they are not already in the cache,
+        and newly read sidecars are added to it.
+    engine : {"pandas", "polars"}, optional
+        Dataframe engine used to find the unique parameter groups.
+        Default is "pandas".
+
+    Returns
+    -------
+    labeled_files : :obj:`pandas.DataFrame`
+        A data frame with one row per file where the ParamGroup column
+        indicates which group each scan is a part of.
+    param_groups_with_counts : :obj:`pandas.DataFrame`
+        A data frame with param group summaries.
+    """
+    if not files:
+        print("WARNING: no files for", entity_set_name)
+        return None, None
+
+    spec = GroupingSpec.from_config(grouping_config)
+    df = _get_param_group_table(
+        files, fieldmap_lookup, entity_set_name, spec, modality, sidecar_cache=sidecar_cache
+    )
 
     # cluster param groups based on tolerance
-    df = format_params(df, grouping_config, modality)
+    df = format_params(df, spec, modality)
     # param_group_cols = list(set(df.columns.to_list()) - set(["FilePath"]))
 
     # get the subset of columns to drop duplicates by
@@ -1555,34 +3143,39 @@ def _get_param_groups(
     except Exception:
         return "erroneous sidecar found"
 
-    deduped = deduped.drop_duplicates(subset=check_cols, ignore_index=True)
-    deduped["ParamGroup"] = np.arange(deduped.shape[0]) + 1
+    if engine == "polars":
+        ordered_labeled_files, param_groups_with_counts = _label_param_groups_polars(
+            df, deduped, check_cols, modality, len(keys_files[entity_set_name])
+        )
+    else:
+        deduped = deduped.drop_duplicates(subset=check_cols, ignore_index=True)
+        deduped["ParamGroup"] = np.arange(deduped.shape[0]) + 1
 
-    # add the modality as a column
-    deduped["Modality"] = modality
+        # add the modality as a column
+        deduped["Modality"] = modality
 
-    # add entity set count column (will delete later)
-    deduped["EntitySetCount"] = len(keys_files[entity_set_name])
+        # add entity set count column (will delete later)
+        deduped["EntitySetCount"] = len(keys_files[entity_set_name])
 
-    # Add the ParamGroup to the whole list of files
-    labeled_files = pd.merge(df, deduped, on=check_cols)
+        # Add the ParamGroup to the whole list of files
+        labeled_files = pd.merge(df, deduped, on=check_cols)
 
-    value_counts = labeled_files.ParamGroup.value_counts()
+        value_counts = labeled_files.ParamGroup.value_counts()
 
-    param_group_counts = pd.DataFrame(
-        {"Counts": value_counts.to_numpy(), "ParamGroup": value_counts.index.to_numpy()}
-    )
+        param_group_counts = pd.DataFrame(
+            {"Counts": value_counts.to_numpy(), "ParamGroup": value_counts.index.to_numpy()}
+        )
 
-    param_groups_with_counts = pd.merge(deduped, param_group_counts, on=["ParamGroup"])
+        param_groups_with_counts = pd.merge(deduped, param_group_counts, on=["ParamGroup"])
 
-    # Sort by counts and relabel the param groups
-    param_groups_with_counts.sort_values(by=["Counts"], inplace=True, ascending=False)
-    param_groups_with_counts["ParamGroup"] = np.arange(param_groups_with_counts.shape[0]) + 1
+        # Sort by counts and relabel the param groups
+        param_groups_with_counts.sort_values(by=["Counts"], inplace=True, ascending=False)
+        param_groups_with_counts["ParamGroup"] = np.arange(param_groups_with_counts.shape[0]) + 1
 
-    # Send the new, ordered param group ids to the files list
-    ordered_labeled_files = pd.merge(
-        df, param_groups_with_counts, on=check_cols, suffixes=("_x", "")
-    )
+        # Send the new, ordered param group ids to the files list
+        ordered_labeled_files = pd.merge(
+            df, param_groups_with_counts, on=check_cols, suffixes=("_x", "")
+        )
 
     # sort ordered_labeled_files by param group
     ordered_labeled_files.sort_values(by=["Counts"], inplace=True, ascending=False)
@@ -1598,24 +3191,110 @@ def _get_param_groups(
     return ordered_labeled_files, param_groups_with_counts
 
 
+def _label_param_groups_polars(df, deduped, check_cols, modality, entity_set_count):
+    """Find and rank the parameter groups with the polars engine.
+
+    This gives the same results as the pandas engine in :func:`_get_param_groups`,
+    but the unique parameter groups are found with polars,
+    and the files are matched to their groups by position instead of by merging on
+    every parameter column.
+    """
+    group_ids, first_rows, counts = get_param_group_ids(df, check_cols)
+
+    deduped = deduped.iloc[first_rows].reset_index(drop=True)
+    deduped["ParamGroup"] = np.arange(deduped.shape[0]) + 1
+    deduped["Modality"] = modality
+    deduped["EntitySetCount"] = entity_set_count
+
+    param_groups_with_counts = deduped.copy()
+    param_groups_with_counts["Counts"] = counts
+
+    # Sort by counts and relabel the param groups
+    param_groups_with_counts.sort_values(by=["Counts"], inplace=True, ascending=False)
+    param_groups_with_counts["ParamGroup"] = np.arange(param_groups_with_counts.shape[0]) + 1
+
+    # Send the new, ordered param group ids to the files list
+    group_order = np.empty(len(counts), dtype=np.int64)
+    group_order[param_groups_with_counts.index.to_numpy()] = np.arange(len(counts))
+    group_cols = [col for col in param_groups_with_counts.columns if col not in check_cols]
+    file_groups = param_groups_with_counts[group_cols].iloc[group_order[group_ids]]
+    labeled_files = df.rename(
+        columns={
+            col: f"{col}_x" for col in group_cols if col in df.columns and col not in check_cols
+        }
+    )
+    ordered_labeled_files = pd.concat(
+        [labeled_files.reset_index(drop=True), file_groups.reset_index(drop=True)], axis=1
+    )
+
+    return ordered_labeled_files, param_groups_with_counts
+
+
 def round_params(param_group_df, config, modality):
-    """Round columns' values in DataFrame according to requested precision."""
-    to_format = config["sidecar_params"][modality]
-    to_format.update(config["derived_params"][modality])
+    """Round columns' values in DataFrame according to requested precision.
 
-    for column_name, column_fmt in to_format.items():
+    This is the normalization stage that runs before parameter groups are
+    deduplicated and clustered, so that tiny floating point jitter does not
+    produce spurious parameter groups.
+
+    Parameters
+    ----------
+    param_group_df : :obj:`pandas.DataFrame`
+        A data frame with one row per file.
+    config : :obj:`~cubids.config.GroupingSpec` or :obj:`dict`
+        Configuration for defining parameter groups.
+    modality : :obj:`str`
+        Modality of the scan.
+
+    Returns
+    -------
+    param_group_df : :obj:`pandas.DataFrame`
+        The input data frame, with each column that has a ``precision`` in the config rounded.
+        Numeric columns are rounded in bulk.
+        Columns holding lists of numbers (e.g., SliceTiming) are rounded element-wise
+        and converted to tuples, so they can be compared when finding parameter groups.
+    """
+    mod_spec = GroupingSpec.from_config(config)[modality]
+
+    for column_name, precision in zip(mod_spec.precision_columns, mod_spec.precisions):
         if column_name not in param_group_df:
             continue
 
-        if "precision" in column_fmt:
-            if isinstance(param_group_df[column_name], float):
-                param_group_df[column_name] = param_group_df[column_name].round(
-                    column_fmt["precision"]
-                )
+        param_group_df[column_name] = _round_column(param_group_df[column_name], precision)
 
     return param_group_df
 
 
+def _round_column(column, precision):
+    """Round a single DataFrame column to the requested precision."""
+    if pd.api.types.is_bool_dtype(column):
+        return column
+
+    if pd.api.types.is_numeric_dtype(column):
+        return column.round(precision)
+
+    # Object columns may contain numbers mixed with NaNs, strings, or lists of numbers
+    return column.map(partial(_round_value, precision=precision))
+
+
+def _round_value(value, precision):
+    """Round a single metadata value, which may be a list of numbers."""
+    if isinstance(value, (bool, np.bool_)):
+        return value
+
+    if isinstance(value, (int, float, np.number)):
+        return round(value, precision)
+
+    if isinstance(value, (list, tuple)):
+        try:
+            return tuple(np.round(np.asarray(value, dtype=float), precision).tolist())
+        except (TypeError, ValueError):
+            # Not a list of numbers, but still needs to be hashable
+            return tuple(value)
+
+    return value
+
+
 def get_sidecar_metadata(json_file):
     """Get all metadata values in a file's sidecar.
 
@@ -1638,9 +3317,9 @@ def format_params(param_group_df, config, modality):
     param_group_df : :obj:`pandas.DataFrame`
         A data frame with one row per file where the ParamGroup column
         indicates which group each scan is a part of.
-    config : :obj:`dict`
+    config : :obj:`~cubids.config.GroupingSpec` or :obj:`dict`
         Configuration for defining parameter groups.
-        This dictionary has two keys: ``'sidecar_params'`` and ``'derived_params'``.
+        If a dictionary, it has two keys: ``'sidecar_params'`` and ``'derived_params'``.
     modality : :obj:`str`
         Modality of the scan.
         This is used to select the correct configuration from the config dict.
@@ -1669,21 +3348,23 @@ def format_params(param_group_df, config, modality):
     The modality-wise dictionary's keys are names of BIDS fields to derive from the
     NIfTI header and include in the Parameter Groupings.
     """
-    to_format = config["sidecar_params"][modality]
-    to_format.update(config["derived_params"][modality])
+    mod_spec = GroupingSpec.from_config(config)[modality]
 
-    for column_name, column_fmt in to_format.items():
+    for column_name, tolerance in zip(mod_spec.tolerance_columns, mod_spec.tolerances):
         if column_name not in param_group_df:
             continue
 
-        if "tolerance" in column_fmt and len(param_group_df) > 1:
+        # Lists (e.g., rounded SliceTiming) and strings can't be clustered
+        if not pd.api.types.is_numeric_dtype(param_group_df[column_name]):
+            continue
+
+        if len(param_group_df) > 1:
             array = param_group_df[column_name].to_numpy().reshape(-1, 1)
 
             for i in range(len(array)):
                 if np.isnan(array[i, 0]):
                     array[i, 0] = -999
 
-            tolerance = to_format[column_name]["tolerance"]
             clustering = AgglomerativeClustering(
                 n_clusters=None, distance_threshold=tolerance, linkage="complete"
             ).fit(array)
@@ -1698,6 +3379,96 @@ def format_params(param_group_df, config, modality):
     return param_group_df
 
 
+def sweep_tolerance(param_group_df, column_name, tolerances):
+    """Find the parameter groups for a range of tolerances on a single column.
+
+    The complete-linkage tree for the column is built once and then cut at each tolerance,
+    which gives the same groups as running :func:`format_params` with each tolerance.
+
+    Parameters
+    ----------
+    param_group_df : :obj:`pandas.DataFrame`
+        A data frame with one row per file, as returned by :func:`format_params`.
+    column_name : :obj:`str`
+        The column to sweep.
+    tolerances : :obj:`list` of :obj:`float`
+        Tolerances to try.
+
+    Returns
+    -------
+    sweep_labels : :obj:`list` of :obj:`numpy.ndarray`
+        Parameter group labels for each file, for each tolerance.
+        The label values are arbitrary; only which files share a label matters.
+    """
+    cluster_col = f"Cluster_{column_name}"
+    key_cols = [
+        col
+        for col in param_group_df.columns
+        if col not in ("FilePath", column_name, cluster_col)
+        and f"Cluster_{col}" not in param_group_df.columns
+    ]
+    keys = param_group_df[key_cols].copy()
+
+    if (
+        column_name not in param_group_df
+        or not pd.api.types.is_numeric_dtype(param_group_df[column_name])
+        or len(param_group_df) < 2
+    ):
+        # The column can't be clustered, so the tolerance has no effect
+        if column_name in param_group_df:
+            keys[cluster_col] = param_group_df[column_name]
+
+        labels = _param_group_labels(keys)
+        return [labels for _ in tolerances]
+
+    array = param_group_df[column_name].to_numpy(dtype=float).reshape(-1, 1)
+    array[np.isnan(array)] = -999
+    tree = AgglomerativeClustering(
+        n_clusters=1, compute_full_tree=True, compute_distances=True, linkage="complete"
+    ).fit(array)
+
+    sweep_labels = []
+    for tolerance in tolerances:
+        keys[cluster_col] = _cut_tree(tree.children_, tree.distances_, len(array), tolerance)
+        sweep_labels.append(_param_group_labels(keys))
+
+    return sweep_labels
+
+
+def _cut_tree(children, distances, n_samples, threshold):
+    """Cut a clustering tree, keeping only the merges closer than ``threshold``.
+
+    This matches ``AgglomerativeClustering(distance_threshold=threshold)``,
+    whose merge distances only increase with complete linkage.
+    """
+    node_labels = np.arange(n_samples + len(children))
+    # Walk down from the root, so each node takes the label of the cluster it was merged into
+    for i_merge in range(len(children) - 1, -1, -1):
+        if distances[i_merge] < threshold:
+            node_labels[children[i_merge]] = node_labels[n_samples + i_merge]
+
+    return node_labels[:n_samples]
+
+
+def _param_group_labels(param_group_df):
+    """Label each file with its parameter group, as grouped by :func:`_get_param_groups`."""
+    check_cols = [
+        col
+        for col in param_group_df.columns
+        if f"Cluster_{col}" not in param_group_df.columns and col != "FilePath"
+    ]
+    return param_group_df.groupby(check_cols, sort=False, dropna=False).ngroup().to_numpy()
+
+
+def _changed_group_mask(labels, new_labels):
+    """Flag the files whose group members differ between two sets of labels."""
+    pairs = pd.DataFrame({"old": labels, "new": new_labels})
+    pair_sizes = pairs.groupby(["old", "new"])["old"].transform("size")
+    old_sizes = pairs.groupby("old")["old"].transform("size")
+    new_sizes = pairs.groupby("new")["new"].transform("size")
+    return ((pair_sizes != old_sizes) | (pair_sizes != new_sizes)).to_numpy()
+
+
 def _order_columns(df):
     """Organize columns of the summary and files DataFrames.
 
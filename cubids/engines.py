@@ -0,0 +1,137 @@
+"""Dataframe engines for finding parameter and acquisition groups.
+
+The default engine is pandas.
+The optional polars engine runs the grouping steps lazily, on multiple threads,
+and produces the same groups as the pandas engine.
+"""
+
+import numpy as np
+import pandas as pd
+
+ENGINES = ("pandas", "polars")
+
+
+def check_engine(engine):
+    """Make sure an engine is supported and its dependencies are installed.
+
+    Parameters
+    ----------
+    engine : {"pandas", "polars"}
+        Dataframe engine to use for grouping.
+    """
+    if engine not in ENGINES:
+        raise Exception(f"Unknown engine '{engine}'. Options are: {', '.join(ENGINES)}.")
+
+    if engine == "polars":
+        _import_polars()
+
+
+def _import_polars():
+    """Import polars, which is an optional dependency."""
+    try:
+        import polars as pl
+    except ImportError:
+        raise Exception(
+            "The polars engine requires polars. "
+            "Install it with `pip install polars` or `pip install cubids[polars]`."
+        )
+
+    return pl
+
+
+def get_param_group_ids(param_group_df, check_cols):
+    """Find the unique combinations of parameters with polars.
+
+    Each column is first encoded as integer codes with :func:`pandas.factorize`,
+    so values are matched exactly as :meth:`pandas.DataFrame.drop_duplicates` would,
+    including lists of values (e.g., SliceTiming) and missing values.
+
+    Parameters
+    ----------
+    param_group_df : :obj:`pandas.DataFrame`
+        A data frame with one row per file.
+    check_cols : :obj:`list` of :obj:`str`
+        Columns that define a parameter group.
+
+    Returns
+    -------
+    group_ids : :obj:`numpy.ndarray`
+        The parameter group of each file, numbered from 0 in order of first appearance.
+    first_rows : :obj:`numpy.ndarray`
+        The first file in each parameter group.
+    counts : :obj:`numpy.ndarray`
+        The number of files in each parameter group.
+    """
+    pl = _import_polars()
+
+    codes = {
+        f"key{i_col}": pd.factorize(param_group_df[col], use_na_sentinel=True)[0]
+        for i_col, col in enumerate(check_cols)
+    }
+    groups = (
+        pl.LazyFrame(codes)
+        .with_row_index("row")
+        .group_by(list(codes.keys()), maintain_order=True)
+        .agg(
+            pl.col("row").first().alias("first_row"),
+            pl.col("row").alias("rows"),
+            pl.len().alias("count"),
+        )
+        .with_row_index("group")
+        .collect()
+    )
+    members = groups.select("group", "rows").explode("rows")
+
+    group_ids = np.empty(param_group_df.shape[0], dtype=np.int64)
+    group_ids[members["rows"].to_numpy()] = members["group"].to_numpy()
+
+    return (
+        group_ids,
+        groups["first_row"].to_numpy().astype(np.int64),
+        groups["count"].to_numpy().astype(np.int64),
+    )
+
+
+def get_acq_groups(files_tsv, acq_group_level):
+    """Collect the Key/Param groups of each subject or session with polars.
+
+    Parameters
+    ----------
+    files_tsv : :obj:`str`
+        Path to the files tsv.
+    acq_group_level : {"subject", "session"}
+        Level at which to group acquisitions.
+
+    Returns
+    -------
+    acq_groups : :obj:`dict`
+        Mapping of ``(subject, session)`` to a list of the Key/Param groups found for it,
+        in the same order as :func:`~cubids.metadata_merge.group_by_acquisition_sets`
+        finds them with pandas.
+    """
+    from bids.layout.models import Config
+
+    pl = _import_polars()
+
+    entities = Config.load("bids").entities
+    files = pl.scan_csv(files_tsv, separator="\t").select(
+        pl.col("EntitySet"),
+        pl.col("ParamGroup"),
+        pl.col("FilePath").str.extract(entities["subject"].pattern, 1).alias("subject"),
+        pl.col("FilePath").str.extract(entities["session"].pattern, 1).alias("session"),
+    )
+    if acq_group_level == "subject":
+        id_cols = ["subject", "session"]
+        content_cols = ["EntitySet", "ParamGroup"]
+    else:
+        files = files.with_columns(pl.lit(None, dtype=pl.String).alias("no_session"))
+        id_cols = ["subject", "no_session"]
+        content_cols = ["EntitySet", "ParamGroup", "session"]
+
+    grouped = files.group_by(id_cols, maintain_order=True).agg(content_cols).collect()
+
+    acq_groups = {}
+    for row in grouped.iter_rows():
+        acq_groups[row[:2]] = list(zip(*row[2:]))
+
+    return acq_groups
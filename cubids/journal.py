@@ -0,0 +1,357 @@
+"""A journal of the changes made by CuBIDS operations.
+
+Each operation that modifies a dataset (apply, purge, add-nifti-info and remove-metadata-fields)
+appends an entry to ``code/CuBIDS/journal.jsonl``.
+An entry lists the files that were renamed or deleted,
+and the keys that changed in each sidecar,
+so ``cubids undo`` only needs to touch those files to reverse the operation.
+For remove-metadata-fields, only the names of the removed keys are recorded,
+since their values are often PHI.
+
+In datasets that don't use datalad, deleted files are kept in ``code/CuBIDS/journal/<id>/``
+so they can be restored, and the space they use isn't freed until the operation is undone
+or its trash is emptied with :func:`prune_trash` (``cubids undo --prune-trash``).
+"""
+
+import json
+import os
+import subprocess
+import time
+import uuid
+from shutil import rmtree
+
+JOURNAL_FILE = os.path.join("code", "CuBIDS", "journal.jsonl")
+TRASH_DIR = os.path.join("code", "CuBIDS", "journal")
+
+
+class Journal(object):
+    """Record of the changes made by one CuBIDS operation.
+
+    Parameters
+    ----------
+    bids_dir : :obj:`str`
+        Path to the root of the BIDS dataset.
+    operation : :obj:`str`
+        Name of the operation, e.g., "apply".
+    use_datalad : :obj:`bool`, optional
+        If True, deleted files are restored from git when the operation is undone.
+        Otherwise, deleted files are moved into the journal's trash directory.
+        Default is False.
+    state : :obj:`dict`, optional
+        State from :meth:`get_state`, to continue recording an interrupted operation.
+        Default is None.
+    record_values : :obj:`bool`, optional
+        If False, only the names of the changed sidecar keys are written to the journal,
+        not their values, e.g., when the values are PHI that is being scrubbed.
+        The sidecars are then restored from git when the operation is undone,
+        which is only possible if datalad is used.
+        Default is True.
+
+    Attributes
+    ----------
+    entry_id : :obj:`str`
+        Unique identifier of the journal entry.
+    base : :obj:`str` or None
+        The commit the dataset was at before the operation, if datalad is used.
+    renames : :obj:`list` of :obj:`tuple`
+        Old and new paths of the renamed files, relative to the dataset root.
+    deletions : :obj:`list` of :obj:`str`
+        Paths of the deleted files, relative to the dataset root.
+    sidecars_before : :obj:`dict`
+        Contents of the modified sidecars before the operation,
+        keyed by their paths relative to the dataset root.
+    """
+
+    def __init__(self, bids_dir, operation, use_datalad=False, state=None, record_values=True):
+        self.bids_dir = str(bids_dir)
+        self.operation = operation
+        self.use_datalad = use_datalad
+        self.record_values = record_values
+        self.renames = []
+        self.deletions = []
+        if state is not None:
+            self.entry_id = state["id"]
+            self.base = state["base"]
+            self.sidecars_before = state["sidecars_before"]
+        else:
+            self.entry_id = time.strftime("%Y%m%dT%H%M%S") + "_" + uuid.uuid4().hex[:8]
+            self.base = _get_head(self.bids_dir) if use_datalad else None
+            self.sidecars_before = {}
+
+    def get_state(self):
+        """Get the information needed to continue the journal after an interruption."""
+        return {"id": self.entry_id, "base": self.base, "sidecars_before": self.sidecars_before}
+
+    def _relpath(self, path):
+        return os.path.relpath(str(path), self.bids_dir)
+
+    def track_sidecars(self, paths):
+        """Remember the contents of sidecars before they are modified.
+
+        Parameters
+        ----------
+        paths : :obj:`list` of :obj:`str`
+            Sidecars that are about to be modified.
+            Sidecars that are already tracked keep their original contents.
+        """
+        for path in paths:
+            relpath = self._relpath(path)
+            if relpath not in self.sidecars_before:
+                self.sidecars_before[relpath] = _read_json(path)
+
+    def add_renames(self, old_paths, new_paths):
+        """Record files that are renamed."""
+        for old_path, new_path in zip(old_paths, new_paths):
+            self.renames.append((self._relpath(old_path), self._relpath(new_path)))
+
+    def add_deletions(self, paths):
+        """Record files that are deleted."""
+        self.deletions += [self._relpath(path) for path in paths]
+
+    def trash_path(self, path):
+        """Get the path a deleted file is moved to, if datalad isn't used."""
+        return os.path.join(self.bids_dir, TRASH_DIR, self.entry_id, self._relpath(path))
+
+    def to_dict(self):
+        """Summarize the operation as a journal entry.
+
+        Sidecars are stored as the keys that changed, with their values before and after,
+        or only as the names of the keys if ``record_values`` is False.
+        """
+        new_names = dict(self.renames)
+        sidecars = {}
+        for relpath, before in self.sidecars_before.items():
+            after_path = os.path.join(self.bids_dir, new_names.get(relpath, relpath))
+            if not os.path.exists(after_path) and relpath in self.deletions:
+                if self.use_datalad:
+                    # restoring the deleted file from git also restores its contents
+                    continue
+
+                after_path = self.trash_path(after_path)
+
+            changes = diff_metadata(before, _read_json(after_path))
+            if changes["before"] or changes["after"]:
+                sidecars[relpath] = changes if self.record_values else _redact(changes)
+
+        return {
+            "id": self.entry_id,
+            "operation": self.operation,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "base": self.base,
+            "renames": self.renames,
+            "deletions": self.deletions,
+            "sidecars": sidecars,
+            "redacted": not self.record_values,
+        }
+
+    def write(self):
+        """Append the entry to the dataset's journal.
+
+        Returns
+        -------
+        journal_file : :obj:`str` or None
+            Path to the journal file, or None if the operation didn't change anything.
+        """
+        entry = self.to_dict()
+        if not (entry["renames"] or entry["deletions"] or entry["sidecars"]):
+            return None
+
+        journal_file = os.path.join(self.bids_dir, JOURNAL_FILE)
+        os.makedirs(os.path.dirname(journal_file), exist_ok=True)
+        with open(journal_file, "a") as fo:
+            fo.write(json.dumps(entry) + "\n")
+
+        return journal_file
+
+
+def read_journal(bids_dir):
+    """Read the entries in a dataset's journal, oldest first.
+
+    Parameters
+    ----------
+    bids_dir : :obj:`str`
+        Path to the root of the BIDS dataset.
+
+    Returns
+    -------
+    entries : :obj:`list` of :obj:`dict`
+        The journal entries.
+    """
+    journal_file = os.path.join(str(bids_dir), JOURNAL_FILE)
+    if not os.path.exists(journal_file):
+        return []
+
+    with open(journal_file, "r") as fo:
+        return [json.loads(line) for line in fo if line.strip()]
+
+
+def pop_journal_entry(bids_dir):
+    """Remove the most recent entry from a dataset's journal.
+
+    Returns
+    -------
+    journal_file : :obj:`str`
+        Path to the journal file.
+    """
+    return _write_journal(bids_dir, read_journal(bids_dir)[:-1])
+
+
+def prune_trash(bids_dir, keep=0):
+    """Permanently remove the files deleted by earlier operations, to free their space.
+
+    Only plain datasets have a trash; with datalad, deleted files are restored from git.
+    Operations whose trash is emptied can no longer be undone.
+    The values that journals from older versions of CuBIDS recorded
+    for remove-metadata-fields operations are also removed, whatever ``keep`` is,
+    since those fields are usually removed because they hold PHI.
+
+    Parameters
+    ----------
+    bids_dir : :obj:`str`
+        Path to the root of the BIDS dataset.
+    keep : :obj:`int`, optional
+        Number of the most recent operations whose deleted files are kept. Default is 0.
+
+    Returns
+    -------
+    pruned : :obj:`list` of :obj:`str`
+        IDs of the journal entries whose trash was emptied or whose values were removed.
+    """
+    entries = read_journal(bids_dir)
+    pruned = []
+    for entry in entries:
+        if entry["operation"] == "remove-metadata-fields" and not entry.get("redacted"):
+            entry["sidecars"] = {
+                path: _redact(changes) for path, changes in entry["sidecars"].items()
+            }
+            entry["redacted"] = True
+            pruned.append(entry["id"])
+
+    for entry in entries[: max(len(entries) - keep, 0)]:
+        trash_dir = os.path.join(str(bids_dir), TRASH_DIR, entry["id"])
+        if os.path.isdir(trash_dir):
+            rmtree(trash_dir)
+            entry["trash_pruned"] = True
+            pruned.append(entry["id"])
+
+    if pruned:
+        _write_journal(bids_dir, entries)
+
+    return pruned
+
+
+def _write_journal(bids_dir, entries):
+    journal_file = os.path.join(str(bids_dir), JOURNAL_FILE)
+    with open(journal_file, "w") as fo:
+        fo.writelines(json.dumps(entry) + "\n" for entry in entries)
+
+    return journal_file
+
+
+def undo_entry(bids_dir, entry, batch_size=500):
+    """Reverse the changes recorded in a journal entry.
+
+    Renames are reversed first, then deleted files are restored,
+    and finally the changed sidecar keys are set back to their old values.
+    If the entry only lists the names of the changed keys (it is "redacted"),
+    the sidecars are restored from git instead, if the entry has a base commit,
+    and are left as they are otherwise.
+
+    Parameters
+    ----------
+    bids_dir : :obj:`str`
+        Path to the root of the BIDS dataset.
+    entry : :obj:`dict`
+        The journal entry, from :func:`read_journal`.
+    batch_size : :obj:`int`, optional
+        Number of files to restore with each git call. Default is 500.
+
+    Raises
+    ------
+    Exception
+        If the files the operation deleted were removed with :func:`prune_trash`.
+    """
+    bids_dir = str(bids_dir)
+    if entry.get("trash_pruned") and entry["deletions"]:
+        raise Exception(
+            f"The files deleted by {entry['operation']} ({entry['id']}) "
+            "were removed from the trash, so it can't be undone"
+        )
+
+    for old_path, new_path in reversed(entry["renames"]):
+        if os.path.lexists(os.path.join(bids_dir, new_path)):
+            os.renames(os.path.join(bids_dir, new_path), os.path.join(bids_dir, old_path))
+
+    if entry["base"]:
+        _git_checkout(bids_dir, entry["base"], entry["deletions"], batch_size)
+    else:
+        trash_dir = os.path.join(bids_dir, TRASH_DIR, entry["id"])
+        for path in entry["deletions"]:
+            os.renames(os.path.join(trash_dir, path), os.path.join(bids_dir, path))
+
+    if entry.get("redacted"):
+        if entry["base"]:
+            _git_checkout(bids_dir, entry["base"], list(entry["sidecars"]), batch_size)
+        rmtree(os.path.join(bids_dir, TRASH_DIR, entry["id"]), ignore_errors=True)
+        return
+
+    for path, changes in entry["sidecars"].items():
+        sidecar = os.path.join(bids_dir, path)
+        metadata = _read_json(sidecar)
+        for key in changes["after"]:
+            metadata.pop(key, None)
+
+        metadata.update(changes["before"])
+        with open(sidecar, "w") as fo:
+            json.dump(metadata, fo, indent=4)
+
+    rmtree(os.path.join(bids_dir, TRASH_DIR, entry["id"]), ignore_errors=True)
+
+
+def diff_metadata(before, after):
+    """Find the keys that differ between two versions of a sidecar.
+
+    Parameters
+    ----------
+    before, after : :obj:`dict`
+        The sidecar's metadata before and after it was modified.
+
+    Returns
+    -------
+    changes : :obj:`dict`
+        The old values of changed or removed keys under "before",
+        and the new values of changed or added keys under "after".
+    """
+    return {
+        "before": {
+            key: val for key, val in before.items() if key not in after or after[key] != val
+        },
+        "after": {
+            key: val for key, val in after.items() if key not in before or before[key] != val
+        },
+    }
+
+
+def _redact(changes):
+    """Keep only the names of the changed keys of a sidecar."""
+    return {"keys": sorted(set(changes["before"]) | set(changes["after"]))}
+
+
+def _git_checkout(bids_dir, base, paths, batch_size):
+    for start in range(0, len(paths), batch_size):
+        checkout_proc = subprocess.run(
+            ["git", "checkout", base, "--"] + paths[start : start + batch_size], cwd=bids_dir
+        )
+        checkout_proc.check_returncode()
+
+
+def _read_json(path):
+    with open(path, "r") as fo:
+        return json.load(fo)
+
+
+def _get_head(bids_dir):
+    head_proc = subprocess.run(
+        ["git", "rev-parse", "--verify", "-q", "HEAD"], cwd=bids_dir, stdout=subprocess.PIPE
+    )
+    return head_proc.stdout.decode().strip() or None
@@ -9,6 +9,7 @@ import numpy as np
 import pandas as pd
 
 from cubids.constants import IMAGING_PARAMS
+from cubids.engines import get_acq_groups
 
 DIRECT_IMAGING_PARAMS = IMAGING_PARAMS - set(["NSliceTimes"])
 
@@ -266,7 +267,7 @@ def get_acq_dictionary():
     return acq_dict
 
 
-def group_by_acquisition_sets(files_tsv, output_prefix, acq_group_level):
+def group_by_acquisition_sets(files_tsv, output_prefix, acq_group_level, engine="pandas"):
     """Find unique sets of Key/Param groups across subjects.
 
     This writes out the following files:
@@ -284,27 +285,38 @@ def group_by_acquisition_sets(files_tsv, output_prefix, acq_group_level):
         Prefix for output files.
     acq_group_level : {"subject", "session"}
         Level at which to group acquisitions.
+    engine : {"pandas", "polars"}, optional
+        Dataframe engine used to collect the Key/Param groups of each subject/session.
+        Both engines produce the same acquisition groups. Default is "pandas".
+
+    Returns
+    -------
+    acq_group_df : :obj:`pandas.DataFrame`
+        The mapping of subject/session to acquisition group.
     """
     from bids import config
     from bids.layout import parse_file_entities
 
     config.set_option("extension_initial_dot", True)
 
-    files_df = pd.read_table(
-        files_tsv,
-    )
-    acq_groups = defaultdict(list)
-    for _, row in files_df.iterrows():
-        file_entities = parse_file_entities(row.FilePath)
-
-        if acq_group_level == "subject":
-            acq_id = (file_entities.get("subject"), file_entities.get("session"))
-            acq_groups[acq_id].append((row.EntitySet, row.ParamGroup))
-        else:
-            acq_id = (file_entities.get("subject"), None)
-            acq_groups[acq_id].append(
-                (row.EntitySet, row.ParamGroup, file_entities.get("session"))
-            )
+    if engine == "polars":
+        acq_groups = get_acq_groups(files_tsv, acq_group_level)
+    else:
+        files_df = pd.read_table(
+            files_tsv,
+        )
+        acq_groups = defaultdict(list)
+        for _, row in files_df.iterrows():
+            file_entities = parse_file_entities(row.FilePath)
+
+            if acq_group_level == "subject":
+                acq_id = (file_entities.get("subject"), file_entities.get("session"))
+                acq_groups[acq_id].append((row.EntitySet, row.ParamGroup))
+            else:
+                acq_id = (file_entities.get("subject"), None)
+                acq_groups[acq_id].append(
+                    (row.EntitySet, row.ParamGroup, file_entities.get("session"))
+                )
 
     # Map the contents to a list of subjects/sessions
     contents_to_subjects = defaultdict(list)
@@ -356,3 +368,5 @@ def group_by_acquisition_sets(files_tsv, output_prefix, acq_group_level):
 
     with open(output_prefix + "_AcqGroupInfo.json", "w") as outfile:
         json.dump(acq_info_dict, outfile, indent=4)
+
+    return acq_group_df
@@ -0,0 +1,498 @@
+"""Fast, offline checks of filenames and sidecars against a snapshot of the BIDS schema.
+
+These checks run in seconds, without the BIDS validator,
+and catch the most common curation errors before a full validation.
+The issues have the same columns as :func:`~cubids.validator.parse_validator_output`.
+"""
+
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+from pkg_resources import resource_filename as pkgrf
+
+from cubids.validator import ISSUE_COLUMNS
+
+NIFTI_EXTENSIONS = (".nii", ".nii.gz")
+
+ENTITY_FORMATS = {"label": re.compile(r"^[0-9a-zA-Z]+$"), "index": re.compile(r"^[0-9]+$")}
+
+ISSUE_MESSAGES = {
+    "NOT_INCLUDED": "Files with such naming scheme are not part of BIDS specification.",
+    "INVALID_ENTITY_LABEL": "The entity's label is not valid.",
+    "ENTITY_NOT_IN_RULE": "The entity is not allowed for files with this suffix and datatype.",
+    "MISSING_REQUIRED_ENTITY": "The entity is required for files with this suffix and datatype.",
+    "ENTITIES_OUT_OF_ORDER": "The entities in the filename are not in the order set by BIDS.",
+    "JSON_INVALID": "Not a valid JSON file.",
+    "SIDECAR_KEY_REQUIRED": "A required field is missing from the file's sidecars.",
+    "INTENDED_FOR": "'IntendedFor' field needs to point to an existing file.",
+}
+
+_snapshot = None
+
+
+def load_schema_snapshot(snapshot_file=None):
+    """Load the snapshot of the BIDS schema.
+
+    Parameters
+    ----------
+    snapshot_file : :obj:`str`, optional
+        Path to a snapshot written by :func:`build_schema_snapshot`.
+        Default is None, in which case the snapshot bundled with CuBIDS is used.
+
+    Returns
+    -------
+    snapshot : :obj:`dict`
+        The entities, file rules and required sidecar fields of the schema.
+    """
+    global _snapshot
+
+    if snapshot_file is None and _snapshot is not None:
+        return _snapshot
+
+    with open(snapshot_file or pkgrf("cubids", "data/schema.json"), "r") as f:
+        snapshot = json.load(f)
+
+    if snapshot_file is None:
+        _snapshot = snapshot
+
+    return snapshot
+
+
+def build_schema_snapshot(schema=None):
+    """Build a compact snapshot of the parts of the BIDS schema used by :func:`prevalidate`.
+
+    This is how ``cubids/data/schema.json`` is updated, and requires ``bidsschematools``.
+
+    Parameters
+    ----------
+    schema : :obj:`bidsschematools.types.Namespace`, optional
+        The schema. Default is None, in which case the schema in bidsschematools is used.
+
+    Returns
+    -------
+    snapshot : :obj:`dict`
+        A JSON-serializable snapshot of the schema.
+    """
+    if schema is None:
+        from bidsschematools.schema import load_schema
+
+        schema = load_schema()
+
+    entities = [
+        {
+            "name": name,
+            "key": schema.objects.entities[name].name,
+            "format": schema.objects.entities[name].format,
+        }
+        for name in schema.rules.entities
+    ]
+
+    files = []
+    file_groups = list(schema.rules.files.raw.values()) + [schema.rules.files.common.tables]
+    for rules in file_groups:
+        for rule in rules.values():
+            if "suffixes" not in rule:
+                continue
+
+            rule_entities = {}
+            for name, level in rule["entities"].items():
+                if not isinstance(level, str):
+                    level = {"level": level["level"], "enum": list(level["enum"])}
+
+                rule_entities[name] = level
+
+            files.append(
+                {
+                    "datatypes": list(rule.get("datatypes", [])),
+                    "suffixes": list(rule["suffixes"]),
+                    "extensions": list(rule["extensions"]),
+                    "entities": rule_entities,
+                }
+            )
+
+    sidecars = []
+    for rules in schema.rules.sidecars.values():
+        for rule in rules.values():
+            if "fields" not in rule:
+                continue
+
+            fields = [
+                schema.objects.metadata[field].name
+                for field, level in rule["fields"].items()
+                if (level if isinstance(level, str) else level["level"]) == "required"
+            ]
+            selectors = _parse_sidecar_selectors(rule.get("selectors", []))
+            if fields and selectors is not None:
+                sidecars.append({**selectors, "fields": fields})
+
+    return {
+        "bids_version": schema.bids_version,
+        "schema_version": schema.schema_version,
+        "entities": entities,
+        "modalities": {
+            datatype: modality
+            for modality, value in schema.rules.modalities.items()
+            for datatype in value["datatypes"]
+        },
+        "files": files,
+        "sidecars": sidecars,
+    }
+
+
+def _parse_sidecar_selectors(selectors):
+    """Convert the selectors of a sidecar rule to simple filters.
+
+    Returns None if any selector depends on more than the file's
+    modality, datatype, suffix and extension, so the rule is left to the BIDS validator.
+    """
+    parsed = {"modality": None, "datatype": None, "suffixes": None, "nifti_only": False}
+    for selector in selectors:
+        selector = selector.replace("'", '"')
+        simple = re.fullmatch(r'(modality|datatype|suffix) == "([^"]+)"', selector)
+        suffixes = re.fullmatch(r"intersects\(\[suffix\], \[(.+)\]\)", selector)
+        if simple and simple.group(1) == "suffix":
+            new_suffixes = [simple.group(2)]
+        elif simple:
+            parsed[simple.group(1)] = simple.group(2)
+            continue
+        elif suffixes:
+            new_suffixes = re.findall(r'"([^"]+)"', suffixes.group(1))
+        elif selector.startswith("match(extension") and "nii" in selector:
+            parsed["nifti_only"] = True
+            continue
+        else:
+            return None
+
+        if parsed["suffixes"] is None:
+            parsed["suffixes"] = new_suffixes
+        else:
+            parsed["suffixes"] = [s for s in parsed["suffixes"] if s in new_suffixes]
+
+    return parsed
+
+
+def parse_bids_filename(filename, snapshot):
+    """Split a filename into its entities, suffix and extension.
+
+    Parameters
+    ----------
+    filename : :obj:`str`
+        The file's name, without its directory.
+    snapshot : :obj:`dict`
+        The schema snapshot, as returned by :func:`load_schema_snapshot`.
+
+    Returns
+    -------
+    entities : :obj:`list` of :obj:`tuple`
+        ``(key, value)`` for each entity, in the order they appear in the filename.
+        Entities without a "-" have a value of None.
+    suffix : :obj:`str`
+    extension : :obj:`str`
+        The longest extension in the schema that the filename ends with,
+        or everything after the first "." if none of them match.
+    """
+    extensions = _get_extensions(snapshot)
+    extension = next((ext for ext in extensions if filename.endswith(ext)), None)
+    if extension is None:
+        extension = filename[filename.find(".") :] if "." in filename else ""
+
+    stem = filename[: len(filename) - len(extension)]
+    parts = stem.split("_")
+    entities = [tuple(part.split("-", 1)) if "-" in part else (part, None) for part in parts[:-1]]
+    return entities, parts[-1], extension
+
+
+def _get_extensions(snapshot):
+    """Get the file extensions in the schema, longest first."""
+    if "_extensions" not in snapshot:
+        extensions = set()
+        for rule in snapshot["files"]:
+            extensions.update(ext.rstrip("/") for ext in rule["extensions"] if ext.strip("./*"))
+
+        snapshot["_extensions"] = sorted(extensions, key=len, reverse=True)
+
+    return snapshot["_extensions"]
+
+
+def _get_entity_lookups(snapshot):
+    """Map each entity's key (e.g., "sub") to its name, position and format."""
+    if "_entity_lookups" not in snapshot:
+        snapshot["_entity_lookups"] = (
+            {entity["key"]: entity["name"] for entity in snapshot["entities"]},
+            {entity["key"]: i for i, entity in enumerate(snapshot["entities"])},
+            {entity["key"]: entity["format"] for entity in snapshot["entities"]},
+        )
+
+    return snapshot["_entity_lookups"]
+
+
+def _get_suffix_rules(snapshot):
+    """Index the file rules in the schema by suffix."""
+    if "_suffix_rules" not in snapshot:
+        snapshot["_suffix_rules"] = {}
+        for rule in snapshot["files"]:
+            for suffix in rule["suffixes"]:
+                snapshot["_suffix_rules"].setdefault(suffix, []).append(rule)
+
+    return snapshot["_suffix_rules"]
+
+
+def check_filename(relpath, snapshot):
+    """Check a file's name against the file rules in the schema.
+
+    Parameters
+    ----------
+    relpath : :obj:`str`
+        Path to the file, relative to the root of the dataset (e.g., "sub-01/anat/...").
+    snapshot : :obj:`dict`
+        The schema snapshot, as returned by :func:`load_schema_snapshot`.
+
+    Returns
+    -------
+    issues : :obj:`list` of :obj:`dict`
+        The filename's issues.
+    """
+    parts = relpath.split("/")
+    datatype = parts[-2] if len(parts) > 1 and not parts[-2].startswith(("sub-", "ses-")) else ""
+    entities, suffix, extension = parse_bids_filename(parts[-1], snapshot)
+    location = "/" + relpath
+
+    key_to_name, key_order, formats = _get_entity_lookups(snapshot)
+
+    issues = []
+    for key, value in entities:
+        if value is None or key not in key_to_name:
+            issues.append(_issue(location, "ENTITY_NOT_IN_RULE", key))
+        elif not ENTITY_FORMATS.get(formats[key], ENTITY_FORMATS["label"]).match(value):
+            issues.append(_issue(location, "INVALID_ENTITY_LABEL", key))
+
+    known_keys = [key for key, _ in entities if key in key_order]
+    if known_keys != sorted(known_keys, key=key_order.get):
+        issues.append(_issue(location, "ENTITIES_OUT_OF_ORDER"))
+
+    if issues:
+        return issues
+
+    rules = [
+        rule
+        for rule in _get_suffix_rules(snapshot).get(suffix, [])
+        if extension in [ext.rstrip("/") for ext in rule["extensions"]]
+        and (datatype in rule["datatypes"] if rule["datatypes"] else not datatype)
+    ]
+    if not rules:
+        return [_issue(location, "NOT_INCLUDED")]
+
+    # The file only needs to follow one of the rules for its suffix and datatype
+    file_entities = {key_to_name[key]: value for key, value in entities}
+    rule_issues = []
+    for rule in rules:
+        issues = []
+        for name, value in file_entities.items():
+            level = rule["entities"].get(name)
+            if level is None:
+                issues.append(_issue(location, "ENTITY_NOT_IN_RULE", name))
+            elif isinstance(level, dict) and value not in level["enum"]:
+                issues.append(_issue(location, "INVALID_ENTITY_LABEL", name))
+
+        for name, level in rule["entities"].items():
+            level = level if isinstance(level, str) else level["level"]
+            if level == "required" and name not in file_entities:
+                issues.append(_issue(location, "MISSING_REQUIRED_ENTITY", name))
+
+        if not issues:
+            return []
+
+        rule_issues.append(issues)
+
+    return min(rule_issues, key=len)
+
+
+def _issue(location, code, sub_code="", message=None, severity="error"):
+    """Build an issue with the same fields as the BIDS validator's."""
+    return {
+        "location": location,
+        "code": code,
+        "issueMessage": message or ISSUE_MESSAGES[code],
+        "subCode": sub_code,
+        "severity": severity,
+        "rule": "",
+    }
+
+
+def _read_json(json_file):
+    """Read a JSON file, returning None if it can't be parsed."""
+    try:
+        with open(json_file, "rb") as f:
+            return json.loads(f.read().decode("utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def prevalidate(bids_dir, n_jobs=1, snapshot=None):
+    """Check a dataset's filenames and sidecars against the BIDS schema, without the validator.
+
+    This checks that:
+
+    - the filenames in the subject directories follow the schema,
+      with valid entities, in the right order, for their datatype, suffix and extension;
+    - every JSON file can be parsed;
+    - the fields that the schema requires for each data file are in its sidecars,
+      following the inheritance principle;
+    - every "IntendedFor" points to an existing file.
+
+    Sidecar rules that depend on more than the file's modality, datatype, suffix and extension
+    are left to the BIDS validator.
+
+    Parameters
+    ----------
+    bids_dir : :obj:`str`
+        Path to the root of the BIDS dataset.
+    n_jobs : :obj:`int`, optional
+        Number of threads used to read the JSON files. Default is 1.
+    snapshot : :obj:`dict`, optional
+        The schema snapshot. Default is None, in which case the bundled snapshot is used.
+
+    Returns
+    -------
+    parsed : :obj:`pandas.DataFrame`
+        The issues, with the same columns as :func:`~cubids.validator.parse_validator_output`.
+    """
+    bids_dir = os.path.abspath(str(bids_dir))
+    if snapshot is None:
+        snapshot = load_schema_snapshot()
+
+    dir_extensions = tuple(
+        ext.rstrip("/")
+        for rule in snapshot["files"]
+        for ext in rule["extensions"]
+        if ext[-1:] == "/" and ext.strip("./")
+    )
+
+    # Index the dataset in one walk: root-level sidecars and everything in the subjects
+    relpaths = []
+    json_files = [
+        name
+        for name in sorted(os.listdir(bids_dir))
+        if name.endswith(".json") and os.path.isfile(os.path.join(bids_dir, name))
+    ]
+    for name in sorted(os.listdir(bids_dir)):
+        if not name.startswith("sub-") or not os.path.isdir(os.path.join(bids_dir, name)):
+            continue
+
+        for root, dirs, files in os.walk(os.path.join(bids_dir, name)):
+            reldir = os.path.relpath(root, bids_dir)
+            # Directories such as .ome.zarr are single files in BIDS
+            file_dirs = [d for d in dirs if d.endswith(dir_extensions)]
+            dirs[:] = sorted(d for d in dirs if not d.startswith(".") and d not in file_dirs)
+            for file_name in sorted(files + file_dirs):
+                if not file_name.startswith("."):
+                    relpaths.append(f"{reldir}/{file_name}")
+
+    json_files += [relpath for relpath in relpaths if relpath.endswith(".json")]
+    with ThreadPoolExecutor(max_workers=max(1, n_jobs)) as executor:
+        metadata = dict(
+            zip(
+                json_files,
+                executor.map(lambda f: _read_json(os.path.join(bids_dir, f)), json_files),
+            )
+        )
+
+    # Sidecars that can be inherited, by directory
+    sidecars = {}
+    for json_file in json_files:
+        if metadata[json_file] is None or not isinstance(metadata[json_file], dict):
+            continue
+
+        json_dir = os.path.dirname(json_file)
+        entities, suffix, _ = parse_bids_filename(os.path.basename(json_file), snapshot)
+        sidecars.setdefault(json_dir, []).append((dict(entities), suffix, json_file))
+
+    issues = []
+    for json_file in json_files:
+        if metadata[json_file] is None:
+            issues.append(_issue("/" + json_file, "JSON_INVALID"))
+
+    for relpath in relpaths:
+        filename_issues = check_filename(relpath, snapshot)
+        issues += filename_issues
+        if relpath.endswith(".json"):
+            issues += _check_intended_for(bids_dir, relpath, metadata[relpath])
+        elif not filename_issues:
+            issues += _check_required_fields(relpath, sidecars, metadata, snapshot)
+
+    return pd.DataFrame(issues, columns=ISSUE_COLUMNS)
+
+
+def _check_required_fields(relpath, sidecars, metadata, snapshot):
+    """Check that a data file's sidecars have the fields the schema requires."""
+    parts = relpath.split("/")
+    datatype = parts[-2] if not parts[-2].startswith(("sub-", "ses-")) else ""
+    entities, suffix, extension = parse_bids_filename(parts[-1], snapshot)
+    entities = dict(entities)
+
+    required = []
+    for rule in snapshot["sidecars"]:
+        if (
+            (rule["modality"] is None or snapshot["modalities"].get(datatype) == rule["modality"])
+            and (rule["datatype"] is None or rule["datatype"] == datatype)
+            and (rule["suffixes"] is None or suffix in rule["suffixes"])
+            and (not rule["nifti_only"] or extension in NIFTI_EXTENSIONS)
+        ):
+            required += [field for field in rule["fields"] if field not in required]
+
+    if not required:
+        return []
+
+    # Apply the sidecars from the top of the dataset down, and the least specific first
+    file_metadata = {}
+    dirs = [""] + ["/".join(parts[: i + 1]) for i in range(len(parts) - 1)]
+    for json_dir in dirs:
+        applicable = [
+            (len(json_entities), json_file)
+            for json_entities, json_suffix, json_file in sidecars.get(json_dir, [])
+            if json_suffix == suffix and json_entities.items() <= entities.items()
+        ]
+        for _, json_file in sorted(applicable):
+            file_metadata.update(metadata[json_file])
+
+    return [
+        _issue("/" + relpath, "SIDECAR_KEY_REQUIRED", field)
+        for field in required
+        if field not in file_metadata
+    ]
+
+
+def _check_intended_for(bids_dir, relpath, file_metadata):
+    """Check that the targets of a sidecar's IntendedFor exist."""
+    if not isinstance(file_metadata, dict) or "IntendedFor" not in file_metadata:
+        return []
+
+    intended_for = file_metadata["IntendedFor"]
+    if not isinstance(intended_for, list):
+        intended_for = [intended_for]
+
+    parts = relpath.split("/")
+    issues = []
+    for target in intended_for:
+        if not isinstance(target, str):
+            target_path = None
+        elif target.startswith("bids::"):
+            target_path = os.path.join(bids_dir, target[len("bids::") :])
+        elif parts[-2] == "ieeg":
+            target_path = os.path.join(bids_dir, target)
+        else:
+            target_path = os.path.join(bids_dir, parts[0], target)
+
+        if target_path is None or not os.path.lexists(target_path):
+            issues.append(
+                _issue(
+                    "/" + relpath,
+                    "INTENDED_FOR",
+                    message=f"{ISSUE_MESSAGES['INTENDED_FOR']} {target} does not exist.",
+                )
+            )
+
+    return issues
@@ -1,18 +1,36 @@
 """Tests for `cubids` package."""
 
+import io
 import json
+import logging
 import os
+import pickle
 import subprocess
+import sys
 from copy import deepcopy
 from pathlib import Path
 
+import datalad.api as dlapi
 import numpy as np
 import pandas as pd
 import pytest
+import yaml
 from packaging.version import Version
 
-from cubids.cubids import CuBIDS
+from cubids.config import GroupingSpec, load_config
+from cubids.cubids import (
+    CuBIDS,
+    _changed_group_mask,
+    _may_contain_keys,
+    _param_group_labels,
+    format_params,
+    img_to_new_ext,
+    round_params,
+    sweep_tolerance,
+)
+from cubids.journal import Journal, prune_trash, read_journal
 from cubids.metadata_merge import merge_json_into_json, merge_without_overwrite
+from cubids.prevalidator import load_schema_snapshot, prevalidate
 from cubids.tests.utils import (
     _add_deletion,
     _add_ext_files,
@@ -23,14 +41,27 @@ from cubids.tests.utils import (
     file_hash,
     get_data,
 )
+from cubids.utils import link_file
 from cubids.validator import (
+    ISSUE_COLUMNS,
+    IssueAggregator,
+    bids_validator_version,
+    build_subject_paths,
+    build_validation_tree,
     build_validator_call,
+    extract_summary_info,
+    get_acq_group_representatives,
+    get_bids_validator_version,
+    get_changed_subjects,
+    get_validator_versions,
+    iter_validator_issues,
     parse_validator_output,
+    project_acq_group_issues,
     run_validator,
-    get_bids_validator_version,
-    extract_summary_info,
+    run_validator_to_tsv,
+    subject_fingerprint,
     update_dataset_description,
-    bids_validator_version,
+    validate_subjects,
 )
 
 COMPLETE_KEY_GROUPS = [
@@ -138,6 +169,90 @@ def test_copy_exemplars(tmp_path):
     assert Path(exemplars_dir + "/dataset_description.json").exists()
 
 
+def test_copy_exemplars_link_modes(tmp_path, monkeypatch):
+    """Test copying only the exemplars' group files, with hardlinks or from a datalad clone."""
+    for var in ["GIT_AUTHOR", "GIT_COMMITTER"]:
+        monkeypatch.setenv(f"{var}_NAME", "CuBIDS Tests")
+        monkeypatch.setenv(f"{var}_EMAIL", "cubids@example.com")
+
+    data_root = get_data(tmp_path)
+    bids_dir = data_root / "complete"
+    bod = CuBIDS(bids_dir, use_datalad=False)
+    tsv_prefix = str(tmp_path / "tsvs")
+    bod.get_tsvs(tsv_prefix)
+    acq_group_tsv = tsv_prefix + "_AcqGrouping.tsv"
+    exemplars = pd.read_table(acq_group_tsv).drop_duplicates(subset=["AcqGroup"])
+    sessions = set(f"{row.subject}/ses-{row.session}" for row in exemplars.itertuples(index=False))
+
+    exemplars_dir = tmp_path / "exemplars"
+    bod.copy_exemplars(
+        str(exemplars_dir),
+        acq_group_tsv,
+        min_group_size=1,
+        link_mode="hardlink",
+        n_jobs=4,
+        only_group_files=True,
+    )
+    copied = sorted(
+        str(path.relative_to(exemplars_dir)) for path in exemplars_dir.rglob("*") if path.is_file()
+    )
+    assert "dataset_description.json" in copied
+    assert set(str(Path(path).parent.parent) for path in copied if "/" in path) == sessions
+    nifti = next(path for path in copied if path.endswith(".nii.gz"))
+    assert (exemplars_dir / nifti).stat().st_ino == (bids_dir / nifti).stat().st_ino
+    assert img_to_new_ext(nifti, ".json") in copied
+
+    # A local clone only keeps the exemplars, and gets their content from the original
+    bod = CuBIDS(bids_dir, use_datalad=True)
+    bod.datalad_save(message="Save the dataset to clone it")
+    cloned_dir = tmp_path / "cloned"
+    bod.copy_exemplars(
+        str(cloned_dir), acq_group_tsv, min_group_size=1, only_group_files=True, datalad_clone=True
+    )
+    cloned = sorted(
+        str(path.relative_to(cloned_dir))
+        for path in cloned_dir.rglob("*")
+        if not any(part.startswith(".") for part in path.relative_to(cloned_dir).parts)
+        and not path.is_dir()
+    )
+    assert cloned == copied
+    assert (cloned_dir / nifti).read_bytes() == (bids_dir / nifti).read_bytes()
+    assert dlapi.Dataset(str(cloned_dir)).is_installed()
+
+
+def test_copy_exemplars_selection(tmp_path):
+    """Test choosing the exemplars with the fewest bytes."""
+    data_root = get_data(tmp_path)
+    bids_dir = data_root / "complete"
+    bod = CuBIDS(bids_dir, use_datalad=False)
+    tsv_prefix = str(tmp_path / "tsvs")
+    bod.get_tsvs(tsv_prefix)
+    acq_group_tsv = tsv_prefix + "_AcqGrouping.tsv"
+    acq_groups = pd.read_table(acq_group_tsv)
+    files_df = pd.read_table(tsv_prefix + "_files.tsv")
+
+    # make the first subject of the largest acq group much bigger than the others
+    first = acq_groups.drop_duplicates(subset=["AcqGroup"]).iloc[0]
+    big_file = next((bids_dir / first["subject"]).rglob("*.nii.gz"))
+    with open(big_file, "ab") as f:
+        f.truncate(big_file.stat().st_size + 10**8)
+
+    for selection in ["smallest", "cover"]:
+        exemplars_dir = tmp_path / selection
+        bod.copy_exemplars(
+            str(exemplars_dir), acq_group_tsv, min_group_size=1, selection=selection
+        )
+        subjects = sorted(path.name for path in exemplars_dir.glob("sub-*"))
+        assert first["subject"] not in subjects
+
+        # every parameter group is still represented
+        copied = files_df[files_df.FilePath.str.split("/").str[1].isin(subjects)]
+        if selection == "cover":
+            assert set(copied.KeyParamGroup) == set(files_df.KeyParamGroup)
+        else:
+            assert len(subjects) == acq_groups.AcqGroup.nunique()
+
+
 def test_purge_no_datalad(tmp_path):
     """Test purge_no_datalad."""
     data_root = get_data(tmp_path)
@@ -611,6 +726,178 @@ def test_merge_without_overwrite():
     assert not bad_slice_merge
 
 
+def test_round_params():
+    """Test that round_params applies the configured precision to floats and lists."""
+    config = {
+        "sidecar_params": {
+            "func": {
+                "EchoTime": {"tolerance": 0.001, "precision": 3},
+                "SliceTiming": {"precision": 2},
+                "PhaseEncodingDirection": {"precision": 2},
+            },
+        },
+        "derived_params": {"func": {"NumVolumes": {"precision": 1}}},
+    }
+    param_group_df = pd.DataFrame(
+        {
+            "EchoTime": [0.0300001, 0.03, 0.0299999, np.nan],
+            "SliceTiming": [[0.0, 0.50001], [0.0, 0.5], [0.0, 0.49999], np.nan],
+            "PhaseEncodingDirection": ["j-", "j-", "j", "j"],
+            "NumVolumes": [100, 100, 100, 100],
+        }
+    )
+
+    rounded = round_params(param_group_df, config, "func")
+    assert rounded["EchoTime"].iloc[:3].tolist() == [0.03, 0.03, 0.03]
+    assert np.isnan(rounded["EchoTime"].iloc[3])
+    assert rounded["SliceTiming"].iloc[:3].tolist() == [(0.0, 0.5)] * 3
+    assert rounded["PhaseEncodingDirection"].tolist() == ["j-", "j-", "j", "j"]
+    assert rounded["NumVolumes"].tolist() == [100, 100, 100, 100]
+
+    # Rounded list columns are hashable, so they can be deduplicated and skip clustering
+    formatted = format_params(rounded, config, "func")
+    assert "Cluster_SliceTiming" not in formatted.columns
+    assert formatted["Cluster_EchoTime"].nunique() == 2
+    assert formatted.drop_duplicates(subset=["EchoTime", "SliceTiming"]).shape[0] == 2
+
+
+def test_grouping_spec(tmp_path):
+    """Test that the compiled grouping spec is picklable and leaves the config untouched."""
+    config = load_config(None)
+    orig_config = deepcopy(config)
+    spec = GroupingSpec.from_config(config)
+
+    func_spec = spec["func"]
+    assert "EchoTime" in func_spec.sidecar_columns
+    assert "VoxelSizeDim1" in func_spec.derived_columns
+    assert set(func_spec.columns) == set(func_spec.sidecar_columns) | set(
+        func_spec.derived_columns
+    )
+    assert func_spec.tolerance_dict["EchoTime"] == 0.001
+    assert func_spec.precision_dict["RepetitionTime"] == 6
+    assert spec.get_relational("FieldmapKey") == ("bool", True)
+    assert spec.get_relational("NotAKey") is None
+
+    # The spec can be shared with other processes and used as a cache key
+    unpickled = pickle.loads(pickle.dumps(spec))
+    assert unpickled == spec
+    assert hash(unpickled) == hash(spec)
+    assert unpickled["func"] == func_spec
+    assert GroupingSpec.from_config(config).config_hash == spec.config_hash
+
+    # Grouping a dataset must not modify the config
+    data_root = get_data(tmp_path)
+    bod = CuBIDS(data_root / "inconsistent")
+    bod_config = deepcopy(bod.grouping_config)
+    bod._cache_fieldmaps()
+    bod.get_param_groups_dataframes()
+    assert bod.grouping_config == bod_config
+    assert config == orig_config
+
+
+def test_get_tsvs_for_configs(tmp_path):
+    """Test that several grouping configs can be compared in one pass."""
+    data_root = get_data(tmp_path)
+    bod = CuBIDS(data_root / "inconsistent")
+
+    # A config with no tolerances should split the param groups further
+    strict_config = load_config(None)
+    for mod_params in strict_config["sidecar_params"].values():
+        for param in mod_params.values():
+            param.pop("tolerance", None)
+
+    strict_config_file = tmp_path / "strict.yml"
+    with open(strict_config_file, "w") as f:
+        yaml.dump(strict_config, f)
+
+    comparison = bod.get_tsvs_for_configs(
+        str(tmp_path / "multi"), [None, strict_config_file, strict_config_file]
+    )
+    assert list(comparison.columns) == ["EntitySet", "default", "strict", "strict2"]
+    assert (tmp_path / "multi_ConfigComparison.tsv").exists()
+    for label in ["default", "strict", "strict2"]:
+        assert (tmp_path / f"multi_{label}_summary.tsv").exists()
+        assert (tmp_path / f"multi_{label}_AcqGrouping.tsv").exists()
+
+    # The default config's outputs match a single-config run
+    bod.get_tsvs(str(tmp_path / "single"))
+    single_summary = pd.read_table(tmp_path / "single_summary.tsv")
+    multi_summary = pd.read_table(tmp_path / "multi_default_summary.tsv")
+    pd.testing.assert_frame_equal(single_summary, multi_summary)
+
+    totals = comparison.set_index("EntitySet").loc["TotalParamGroups"]
+    assert totals["default"] == single_summary.shape[0]
+    assert totals["strict"] >= totals["default"]
+    assert totals["strict"] == totals["strict2"]
+    assert bod.grouping_spec == GroupingSpec.from_config(load_config(None))
+
+
+def test_sweep_tolerance(tmp_path):
+    """Test that one tolerance sweep matches clustering with each tolerance."""
+    values = [1.0, 1.04, 1.08, 1.5, 2.0, np.nan, 2.01, 5.0]
+    param_group_df = pd.DataFrame(
+        {
+            "EchoTime": values,
+            "FlipAngle": [90, 90, 90, 90, 45, 90, 90, 90],
+            "FilePath": [f"file{i}" for i in range(len(values))],
+        }
+    )
+    tolerances = [0.0, 0.01, 0.05, 0.1, 0.5, 1.0, 10.0]
+    sweep_labels = sweep_tolerance(param_group_df, "EchoTime", tolerances)
+
+    for tolerance, labels in zip(tolerances, sweep_labels):
+        config = {
+            "sidecar_params": {"func": {"EchoTime": {"tolerance": tolerance}, "FlipAngle": {}}},
+            "derived_params": {"func": {}},
+        }
+        clustered = format_params(param_group_df.copy(), config, "func")
+        assert not _changed_group_mask(_param_group_labels(clustered), labels).any()
+
+    # Columns that aren't in the data don't change the groups
+    unswept = sweep_tolerance(param_group_df, "NotAColumn", [0.1, 1.0])
+    assert len(np.unique(unswept[0])) == len(np.unique(unswept[1])) == 8
+
+    # Sweep a real dataset
+    data_root = get_data(tmp_path)
+    bod = CuBIDS(data_root / "inconsistent")
+    sweep_df = bod.get_tolerance_sweep(
+        str(tmp_path / "sweep"), {"EchoTime": [0.0, 0.001], "RepetitionTime": [0.000001]}
+    )
+    assert sweep_df.shape[0] == 3
+    bod.get_tsvs(str(tmp_path / "group"))
+    n_param_groups = pd.read_table(tmp_path / "group_summary.tsv").shape[0]
+
+    # The configured tolerances give the usual param groups
+    configured = sweep_df.set_index(["Column", "Tolerance"])
+    assert configured.loc[("EchoTime", 0.001), "ParamGroups"] == n_param_groups
+    assert configured.loc[("EchoTime", 0.001), "ChangedFiles"] == 0
+    assert configured.loc[("EchoTime", 0.0), "ParamGroups"] > n_param_groups
+    changed_files = pd.read_table(tmp_path / "sweep_ToleranceSweepFiles.tsv")
+    assert (changed_files["Tolerance"] == 0.0).sum() == configured.loc[
+        ("EchoTime", 0.0), "ChangedFiles"
+    ]
+
+
+def test_polars_engine(tmp_path):
+    """Test that the polars engine writes the same groups as the pandas engine."""
+    pytest.importorskip("polars")
+    data_root = get_data(tmp_path)
+
+    outputs = {}
+    for engine in ["pandas", "polars"]:
+        bod = CuBIDS(data_root / "inconsistent", engine=engine)
+        bod.get_tsvs(str(tmp_path / engine))
+        outputs[engine] = {
+            suffix: (tmp_path / f"{engine}_{suffix}").read_text()
+            for suffix in ["files.tsv", "summary.tsv", "AcqGrouping.tsv", "AcqGroupInfo.txt"]
+        }
+
+    assert outputs["polars"] == outputs["pandas"]
+
+    with pytest.raises(Exception, match="Unknown engine"):
+        CuBIDS(data_root / "inconsistent", engine="spark")
+
+
 def test_entitysets(tmp_path):
     """Test entitysets."""
     data_root = get_data(tmp_path)
@@ -894,6 +1181,68 @@ def test_remove_fields(tmp_path):
     assert not set(new_fields).intersection(fields_to_remove)
 
 
+def test_remove_fields_prefilter(tmp_path):
+    """Test that the byte prefilter never hides a field that should be removed."""
+    data_root = get_data(tmp_path)
+    bids_dir = data_root / "complete"
+    needles = [b'"EchoTime"']
+
+    sidecar = tmp_path / "sidecar.json"
+    sidecar.write_text('{"RepetitionTime": 2}')
+    assert not _may_contain_keys(str(sidecar), needles)
+    sidecar.write_text('{"\\u0045choTime": 0.03}')
+    assert _may_contain_keys(str(sidecar), needles)
+    sidecar.write_text('{"EchoTime": 0.03}', encoding="utf-16")
+    assert _may_contain_keys(str(sidecar), needles)
+
+    escaped = bids_dir / "sub-01" / "ses-phdiff" / "anat" / "sub-01_ses-phdiff_T1w.json"
+    escaped.write_text('{"\\u0045choTime": 0.03, "RepetitionTime": 2}')
+    mentioned = bids_dir / "task-rest_bold.json"
+    mentioned.write_text('{"Notes": "EchoTime was not recorded"}')
+
+    bod = CuBIDS(bids_dir, use_datalad=False)
+    bod.remove_metadata_fields(["EchoTime"], n_jobs=4, chunk_size=5)
+    assert "EchoTime" not in bod.get_all_metadata_fields()
+    assert json.loads(escaped.read_text()) == {"RepetitionTime": 2}
+    assert str(mentioned) not in bod.touched_paths
+    assert str(escaped) in bod.touched_paths
+
+
+def test_metadata_field_census(tmp_path):
+    """Test counting metadata fields without walking .git or non-BIDS directories."""
+    data_root = get_data(tmp_path)
+    bids_dir = data_root / "complete"
+    for hidden in [".git/annex", ".datalad", "code/CuBIDS"]:
+        (bids_dir / hidden).mkdir(parents=True, exist_ok=True)
+        (bids_dir / hidden / "hidden.json").write_text('{"HiddenField": 1}')
+
+    bod = CuBIDS(bids_dir, use_datalad=False)
+    census = bod.get_metadata_field_census(n_jobs=4, chunk_size=3)
+    assert "HiddenField" not in set(census.Field)
+    assert bod.get_all_metadata_fields() == sorted(set(census.Field))
+
+    # every sidecar with the field is counted once
+    sidecars = [
+        path
+        for path in bids_dir.rglob("*.json")
+        if not any(part.startswith(".") or part == "code" for part in path.parts)
+    ]
+    echo_times = [path for path in sidecars if "EchoTime" in json.loads(path.read_text())]
+    echo_time = census[census.Field == "EchoTime"]
+    assert echo_time.Count.sum() == len(echo_times)
+    assert set(echo_time.Modality) <= {"anat", "dwi", "fmap", "func", "perf", "other"}
+    anat_entity_sets = echo_time[echo_time.Modality == "anat"].EntitySet.tolist()
+    assert len(anat_entity_sets) == 1
+    assert "datatype-anat" in anat_entity_sets[0]
+
+    bod.write_metadata_field_census(str(tmp_path / "fields"), census)
+    by_modality = pd.read_table(tmp_path / "fields_MetadataFields.tsv")
+    assert by_modality.columns[:2].tolist() == ["Field", "Count"]
+    assert by_modality.set_index("Field").loc["EchoTime", "Count"] == len(echo_times)
+    by_entity_set = pd.read_table(tmp_path / "fields_MetadataFieldsByEntitySet.tsv")
+    assert len(by_entity_set) == len(census)
+
+
 def test_datalad_integration(tmp_path):
     """Test that datalad works for basic file modification operations."""
     data_root = get_data(tmp_path)
@@ -989,6 +1338,929 @@ def test_datalad_integration(tmp_path):
     assert original_binary_content == restored_binary_content
 
 
+def test_build_validation_tree(tmp_path):
+    """Test that per-subject validation trees are built without copying data."""
+    data_root = get_data(tmp_path)
+    bids_dir = data_root / "complete"
+    subjects_dict = build_subject_paths(bids_dir)
+    files_list = subjects_dict["sub-01"]
+
+    # Every file ends up in the same place as with a copy
+    for link_mode in ["auto", "copy", "hardlink", "symlink", "reflink"]:
+        tree = tmp_path / f"tree-{link_mode}"
+        tree.mkdir()
+        build_validation_tree(files_list, "sub-01", str(tree), link_mode=link_mode)
+        for fi in files_list:
+            rel_path = os.path.relpath(fi, bids_dir)
+            assert (tree / rel_path).read_bytes() == Path(fi).read_bytes()
+
+    # Hardlinks share the source file's data
+    source = bids_dir / "dataset_description.json"
+    hardlink = tmp_path / "hardlink.json"
+    if link_file(str(source), str(hardlink), "hardlink") == "hardlink":
+        assert hardlink.stat().st_ino == source.stat().st_ino
+
+    # NIfTIs can be replaced with sparse stubs of the same size
+    tree = tmp_path / "tree-stub"
+    tree.mkdir()
+    build_validation_tree(files_list, "sub-01", str(tree), stub_niftis=True)
+    niftis = [fi for fi in files_list if fi.endswith(".nii.gz")]
+    assert niftis
+    for fi in niftis:
+        stub = tree / os.path.relpath(fi, bids_dir)
+        assert stub.stat().st_size == os.path.getsize(fi)
+        assert not stub.is_symlink()
+        assert set(stub.read_bytes()) <= {0}
+
+    with pytest.raises(Exception, match="Unknown link mode"):
+        link_file(files_list[0], str(tmp_path / "bad"), mode="teleport")
+
+
+def test_validate_subjects(tmp_path, monkeypatch):
+    """Test that subjects are validated in parallel and merged in a fixed order."""
+    data_root = get_data(tmp_path)
+    subjects_dict = build_subject_paths(data_root / "complete")
+    subjects_dict = dict(sorted(subjects_dict.items()))
+
+    # Stand in for the validator with a script that reports one issue per subject,
+    # finishing in the reverse order of the subjects
+    script = (
+        "import json, os, sys, time\n"
+        "sub = [d for d in os.listdir(sys.argv[1]) if d.startswith('sub-')][0]\n"
+        "if sub == 'sub-02':\n"
+        "    time.sleep(60)\n"
+        "if sub == 'sub-03':\n"
+        "    print('not json')\n"
+        "    sys.exit(1)\n"
+        "time.sleep(0.5 if sub == 'sub-01' else 0)\n"
+        "issue = {'location': '/' + sub, 'code': 'TEST', 'severity': 'warning'}\n"
+        "print(json.dumps({'issues': {'issues': [issue]}}))\n"
+    )
+    monkeypatch.setattr(
+        "cubids.validator.build_validator_call",
+        lambda path, ignore_headers=False: [sys.executable, "-c", script, path],
+    )
+
+    results = list(validate_subjects(subjects_dict, n_jobs=3, timeout=5))
+    assert [result["subject"].iloc[0] for result in results] == list(subjects_dict.keys())
+
+    codes = {result["subject"].iloc[0]: result["code"].iloc[0] for result in results}
+    assert codes["sub-01"] == "TEST"
+    assert codes["sub-02"] == "VALIDATOR_TIMEOUT"
+    assert codes["sub-03"] == "VALIDATOR_FAILED"
+
+
+def test_validation_cache(tmp_path, monkeypatch):
+    """Test that only subjects whose files changed are validated again."""
+    data_root = get_data(tmp_path)
+    bids_dir = data_root / "complete"
+    subjects_dict = build_subject_paths(bids_dir)
+    runs_dir = tmp_path / "runs"
+    runs_dir.mkdir()
+
+    # Stand in for the validator with a script that records which subjects it ran on
+    script = (
+        "import json, os, sys\n"
+        "sub = [d for d in os.listdir(sys.argv[1]) if d.startswith('sub-')][0]\n"
+        f"open(os.path.join({str(runs_dir)!r}, sub), 'a').write('x')\n"
+        "issue = {'location': '/' + sub, 'code': 'TEST', 'severity': 'warning'}\n"
+        "print(json.dumps({'issues': {'issues': [issue]}}))\n"
+    )
+    monkeypatch.setattr(
+        "cubids.validator.build_validator_call",
+        lambda path, ignore_headers=False: [sys.executable, "-c", script, path],
+    )
+
+    cache = {}
+    first = list(validate_subjects(subjects_dict, cache=cache, validator_version="2.0.0"))
+    assert sorted(cache.keys()) == sorted(subjects_dict.keys())
+
+    # Change one subject's sidecar
+    sidecar = bids_dir / "sub-02" / "ses-phdiff" / "func" / "sub-02_ses-phdiff_task-rest_bold.json"
+    metadata = json.loads(sidecar.read_text())
+    metadata["TaskName"] = "changed"
+    sidecar.write_text(json.dumps(metadata))
+    assert subject_fingerprint("sub-02", subjects_dict["sub-02"], "2.0.0") != subject_fingerprint(
+        "sub-02", subjects_dict["sub-02"], "2.0.1"
+    )
+
+    second = list(validate_subjects(subjects_dict, cache=cache, validator_version="2.0.0"))
+    assert {sub.name: len(sub.read_text()) for sub in runs_dir.iterdir()} == {
+        "sub-01": 1,
+        "sub-02": 2,
+        "sub-03": 1,
+    }
+    for first_issues, second_issues in zip(first, second):
+        pd.testing.assert_frame_equal(first_issues, second_issues)
+
+    # A new validator version invalidates the whole cache
+    list(validate_subjects(subjects_dict, cache=cache, validator_version="2.0.1"))
+    assert all(len(sub.read_text()) >= 2 for sub in runs_dir.iterdir())
+
+
+def test_validate_use_cache(tmp_path, monkeypatch):
+    """Test that the validation cache is kept with the outputs and saved as subjects finish."""
+    from cubids import workflows
+
+    data_root = get_data(tmp_path)
+    bids_dir = data_root / "complete"
+    script = "import json; print(json.dumps({'issues': {'issues': []}}))"
+    monkeypatch.setattr(
+        "cubids.validator.build_validator_call",
+        lambda path, ignore_headers=False: [sys.executable, "-c", script, path],
+    )
+    monkeypatch.setattr(workflows, "get_validator_versions", lambda: {"ValidatorVersion": "2.0.0"})
+    monkeypatch.setattr(workflows, "CACHE_SAVE_INTERVAL", 1)
+    saved = []
+    save_validation_cache = workflows.save_validation_cache
+    monkeypatch.setattr(
+        workflows,
+        "save_validation_cache",
+        lambda *args, **kwargs: saved.append(kwargs["subjects"])
+        or save_validation_cache(*args, **kwargs),
+    )
+
+    out_dir = tmp_path / "out"
+    out_dir.mkdir()
+    with pytest.raises(SystemExit):
+        workflows.validate(bids_dir, out_dir / "v0", None, True, None, False, use_cache=True)
+
+    assert [len(subjects) for subjects in saved] == [1, 2, 3, 3]
+    with open(out_dir / "validation_cache.json") as f:
+        assert sorted(json.load(f)) == ["sub-01", "sub-02", "sub-03"]
+    assert not (bids_dir / "code" / "CuBIDS" / "validation_cache.json").exists()
+
+
+def test_validate_sequential_duplicates(tmp_path, monkeypatch):
+    """Test that sequential runs drop repeated issues as drop_duplicates would."""
+    from cubids.workflows import validate
+
+    data_root = get_data(tmp_path)
+    bids_dir = data_root / "complete"
+    issue = {"location": "/dataset_description.json", "code": "TEST", "severity": "warning"}
+    frames = {
+        "sub-01": pd.DataFrame([{**issue, "rule": np.nan, "subject": "sub-01"}]),
+        "sub-02": pd.DataFrame([{**issue, "subject": "sub-02"}]),
+        "sub-03": pd.DataFrame([{**issue, "rule": np.nan, "subject": "sub-03"}]),
+    }
+    monkeypatch.setattr(
+        "cubids.workflows.validate_subjects",
+        lambda subjects_dict, **kwargs: (frames[sub] for sub in subjects_dict),
+    )
+    parsed = validate(bids_dir, None, None, True, None, False)
+    assert parsed.shape[0] == 1
+
+    # A dataset without issues is valid
+    frames = {sub: pd.DataFrame(columns=ISSUE_COLUMNS + ["subject"]) for sub in frames}
+    with pytest.raises(SystemExit):
+        validate(bids_dir, None, None, True, None, False)
+
+
+def test_validate_shards(tmp_path, monkeypatch):
+    """Test that sharded validation runs merge into one validation tsv."""
+    from cubids.workflows import validate, validate_merge
+
+    data_root = get_data(tmp_path)
+    bids_dir = data_root / "complete"
+
+    # Stand in for the validator with a script that reports a dataset-level issue
+    # and a subject-level issue
+    script = (
+        "import json, os, sys\n"
+        "sub = [d for d in os.listdir(sys.argv[1]) if d.startswith('sub-')][0]\n"
+        "issues = [\n"
+        "    {'location': '/README', 'code': 'README_SHORT', 'severity': 'warning'},\n"
+        "    {'location': '/' + sub, 'code': 'TEST', 'severity': 'warning'},\n"
+        "]\n"
+        "print(json.dumps({'issues': {'issues': issues}}))\n"
+    )
+    monkeypatch.setattr(
+        "cubids.validator.build_validator_call",
+        lambda path, ignore_headers=False: [sys.executable, "-c", script, path],
+    )
+
+    for i_shard in range(2):
+        with pytest.raises(SystemExit):
+            validate(bids_dir, tmp_path / "v0", None, True, None, False, shard=(i_shard, 2))
+
+    assert (tmp_path / "v0_shard-0-of-2_validation.tsv").exists()
+    (tmp_path / "v1_shard-1-of-2_validation.tsv").write_text("")
+    with pytest.raises(Exception, match="Missing validation shards 0 of 2"):
+        validate_merge(bids_dir, tmp_path / "v1")
+
+    validate_merge(bids_dir, tmp_path / "v0")
+    merged = pd.read_table(tmp_path / "v0_validation.tsv")
+    assert (tmp_path / "v0_validation.json").exists()
+    assert merged["subject"].tolist() == ["sub-01", "sub-01", "sub-02", "sub-03"]
+    assert merged["code"].tolist() == ["README_SHORT", "TEST", "TEST", "TEST"]
+
+
+def test_stream_validator_output(tmp_path):
+    """Test that streamed validator output matches parsing it all at once."""
+    issues = [
+        {
+            "location": f"/sub-{i:02d}/func/sub-{i:02d}_bold.nii.gz",
+            "code": "JSON_KEY_RECOMMENDED",
+            "issueMessage": 'A "quoted", [bracketed] {message}\nwith \u00e9scapes',
+            "severity": "warning",
+            "affects": [{"issues": []}],
+        }
+        for i in range(500)
+    ]
+    output = json.dumps(
+        {
+            "summary": {"issues": ["not", "these"]},
+            "issues": {"codeMessages": {"issues": 0}, "issues": issues},
+        },
+        indent=2,
+    )
+
+    # Issues are found no matter where the reads split the output
+    for read_size in [1, 7, 4096]:
+        assert list(iter_validator_issues(io.StringIO(output), read_size=read_size)) == issues
+
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_validator_issues(io.StringIO(output[: len(output) // 2])))
+
+    # The streamed tsv is the same as the one written from the parsed output
+    output_file = tmp_path / "output.json"
+    output_file.write_text(output)
+    call = [sys.executable, "-c", f"print(open({str(output_file)!r}).read())"]
+    assert run_validator_to_tsv(call, str(tmp_path / "streamed.tsv"), chunk_size=64) == 500
+    parse_validator_output(output).to_csv(tmp_path / "parsed.tsv", sep="\t", index=False)
+    assert (tmp_path / "streamed.tsv").read_text() == (tmp_path / "parsed.tsv").read_text()
+
+    # A valid dataset doesn't get a tsv
+    call = [sys.executable, "-c", 'print(\'{"issues": {"issues": []}}\')']
+    assert run_validator_to_tsv(call, str(tmp_path / "valid.tsv")) == 0
+    assert not (tmp_path / "valid.tsv").exists()
+
+
+def test_issue_aggregator(tmp_path, monkeypatch):
+    """Test that aggregating issues in chunks matches aggregating them all at once."""
+    from cubids.workflows import validate
+
+    issues = pd.DataFrame(
+        [
+            {
+                "location": f"/sub-{i % 7:02d}/anat/sub-{i % 7:02d}_run-{i}_T1w.nii.gz",
+                "code": ["JSON_KEY_RECOMMENDED", "NIFTI_HEADER_UNREADABLE"][i % 2],
+                "subCode": "",
+                "issueMessage": f"message {i}",
+                "severity": ["warning", "error"][i % 2],
+                "rule": None,
+            }
+            for i in range(100)
+        ]
+    )
+
+    aggregator = IssueAggregator(n_locations=3)
+    aggregator.add(issues)
+    summary = aggregator.to_dataframe()
+
+    # Errors come first, with every issue and subject counted
+    assert summary["code"].tolist() == ["NIFTI_HEADER_UNREADABLE", "JSON_KEY_RECOMMENDED"]
+    assert summary["count"].tolist() == [50, 50]
+    assert summary["n_subjects"].tolist() == [7, 7]
+    assert summary.loc[0, "issueMessage"] == "message 1"
+    assert len(summary.loc[0, "example_locations"].split(", ")) == 3
+
+    chunked = IssueAggregator(n_locations=3)
+    for start in range(0, 100, 13):
+        chunked.add(issues.iloc[start : start + 13])
+    chunked.add(issues.iloc[:0])
+    pd.testing.assert_frame_equal(chunked.to_dataframe(), summary)
+
+    # Sequential runs aggregate each subject's issues as they arrive
+    script = (
+        "import json, sys; "
+        "print(json.dumps({'issues': {'issues': [{'location': '/dataset_description.json', "
+        "'code': 'README_FILE_MISSING', 'severity': 'warning'}]}}))"
+    )
+    monkeypatch.setattr(
+        "cubids.validator.build_validator_call",
+        lambda path, ignore_headers=False: [sys.executable, "-c", script, path],
+    )
+    data_root = get_data(tmp_path)
+    summary = validate(data_root / "complete", None, None, True, None, False, aggregate=True)
+
+    # A root file's issue is reported by every subject's run, but is only counted once
+    assert summary.shape[0] == 1
+    assert summary.loc[0, "count"] == 1
+
+    # Repeated issues are counted once
+    repeated = IssueAggregator()
+    for start in range(0, 100, 13):
+        repeated.add(pd.concat([issues.iloc[start : start + 13]] * 2))
+    assert repeated.to_dataframe()["count"].tolist() == [50, 50]
+
+
+def test_get_changed_subjects(tmp_path):
+    """Test finding the subjects that changed since a git revision."""
+    data_root = get_data(tmp_path)
+    bids_dir = data_root / "complete"
+
+    git = ["git", "-C", str(bids_dir), "-c", "user.name=test", "-c", "user.email=test@test"]
+    subprocess.run(git + ["init", "-q"], check=True)
+    subprocess.run(git + ["add", "."], check=True)
+    subprocess.run(git + ["commit", "-q", "-m", "initial"], check=True)
+    assert get_changed_subjects(bids_dir, "HEAD") == ([], False)
+
+    # Edited, untracked and deleted files are found; CuBIDS outputs are ignored
+    _edit_a_json(str(bids_dir / "sub-01" / "ses-phdiff" / "anat" / "sub-01_ses-phdiff_T1w.json"))
+    (bids_dir / "sub-02" / "ses-phdiff" / "anat" / "sub-02_ses-phdiff_T2w.json").write_text("{}")
+    os.remove(bids_dir / "sub-03" / "ses-phdiff" / "anat" / "sub-03_ses-phdiff_T1w.json")
+    (bids_dir / "code" / "CuBIDS").mkdir(parents=True)
+    (bids_dir / "code" / "CuBIDS" / "v0_validation.tsv").write_text("")
+    assert get_changed_subjects(bids_dir, "HEAD") == (["sub-01", "sub-02", "sub-03"], False)
+
+    subprocess.run(git + ["add", "."], check=True)
+    subprocess.run(git + ["commit", "-q", "-m", "edit"], check=True)
+    assert get_changed_subjects(bids_dir, "HEAD~1") == (["sub-01", "sub-02", "sub-03"], False)
+
+    # A changed root file affects every subject
+    _edit_a_json(str(bids_dir / "dataset_description.json"))
+    assert get_changed_subjects(bids_dir, "HEAD")[1]
+
+    with pytest.raises(Exception, match="Could not find the files changed"):
+        get_changed_subjects(bids_dir, "not-a-revision")
+
+
+def test_validate_since(tmp_path, monkeypatch, caplog):
+    """Test that validating changed subjects skips the subjects that were removed."""
+    import shutil
+
+    from cubids.workflows import validate
+
+    data_root = get_data(tmp_path)
+    bids_dir = data_root / "complete"
+    git = ["git", "-C", str(bids_dir), "-c", "user.name=test", "-c", "user.email=test@test"]
+    subprocess.run(git + ["init", "-q"], check=True)
+    subprocess.run(git + ["add", "."], check=True)
+    subprocess.run(git + ["commit", "-q", "-m", "initial"], check=True)
+
+    shutil.rmtree(bids_dir / "sub-02")
+    with caplog.at_level(logging.INFO, logger="cubids-cli"):
+        with pytest.raises(SystemExit) as exit_info:
+            validate(bids_dir, "v0", None, False, None, False, since="HEAD")
+
+    assert exit_info.value.code == 0
+    assert "nothing to validate" in caplog.text
+
+
+def test_validate_by_acq_group(tmp_path, monkeypatch):
+    """Test projecting representatives' issues onto their acquisition groups."""
+    from cubids.workflows import validate
+
+    data_root = get_data(tmp_path)
+    bids_dir = data_root / "complete"
+    acq_grouping_tsv = tmp_path / "v0_AcqGrouping.tsv"
+    pd.DataFrame(
+        {
+            "subject": ["sub-01", "sub-02", "sub-02", "sub-03"],
+            "session": ["phdiff"] * 4,
+            "AcqGroup": [1, 1, 1, 2],
+        }
+    ).to_csv(acq_grouping_tsv, sep="\t", index=False)
+
+    groups = get_acq_group_representatives(
+        acq_grouping_tsv, ["sub-01", "sub-02", "sub-03", "sub-04"]
+    )
+    assert groups == [
+        ("n/a", ["sub-04"], ["sub-04"]),
+        ("1", ["sub-01"], ["sub-01", "sub-02"]),
+        ("2", ["sub-03"], ["sub-03"]),
+    ]
+
+    script = (
+        "import json, os, sys\n"
+        "sub = [d for d in os.listdir(sys.argv[1]) if d.startswith('sub-')][0]\n"
+        "location = f'/{sub}/anat/{sub}_T1w.json'\n"
+        "issues = [{'location': location, 'code': 'TEST', 'severity': 'warning'}]\n"
+        "print(json.dumps({'issues': {'issues': issues}}))\n"
+    )
+    monkeypatch.setattr(
+        "cubids.validator.build_validator_call",
+        lambda path, ignore_headers=False: [sys.executable, "-c", script, path],
+    )
+    parsed = validate(bids_dir, None, None, False, None, False, by_acq_group=acq_grouping_tsv)
+    assert parsed["subject"].tolist() == ["sub-01", "sub-02", "sub-03"]
+    assert parsed["inferred"].tolist() == [False, True, False]
+    assert parsed.loc[1, "location"] == "/sub-02/anat/sub-02_T1w.json"
+    assert parsed.loc[1, "inferred_from"] == "sub-01"
+
+    # Representatives that disagree flag their group for a full validation
+    issues = {
+        "sub-1": pd.DataFrame({"location": ["/sub-1/a"], "severity": ["warning"]}),
+        "sub-10": pd.DataFrame({"location": ["/sub-10/b"], "severity": ["warning"]}),
+        "sub-2": pd.DataFrame(),
+    }
+    parsed, triage = project_acq_group_issues(
+        issues,
+        [("1", ["sub-1", "sub-10"], ["sub-1", "sub-10", "sub-11"]), ("2", ["sub-2"], ["sub-2"])],
+    )
+    assert sorted(parsed.loc[parsed["subject"] == "sub-11", "location"]) == [
+        "/sub-11/a",
+        "/sub-11/b",
+    ]
+    assert triage["needs_full_pass"].tolist() == [True, False]
+    assert triage["n_issues"].tolist() == [2, 0]
+
+
+def test_validate_container_options(tmp_path, monkeypatch):
+    """Test that docker and singularity runs pass on the same validate options."""
+    from cubids.workflows import validate
+
+    calls = []
+    monkeypatch.setattr(
+        "cubids.workflows.subprocess.run",
+        lambda cmd: calls.append(cmd) or subprocess.CompletedProcess(cmd, 0),
+    )
+    acq_grouping = tmp_path / "v0_AcqGrouping.tsv"
+    for container_type in ["docker", "singularity"]:
+        monkeypatch.setattr("cubids.workflows._get_container_type", lambda c, t=container_type: t)
+        with pytest.raises(SystemExit):
+            validate(
+                tmp_path,
+                tmp_path / "out" / "v0",
+                "image",
+                True,
+                None,
+                False,
+                n_jobs=2,
+                timeout=60,
+                aggregate=True,
+                by_acq_group=acq_grouping,
+                n_representatives=2,
+            )
+
+    docker, singularity = calls
+    options = ["--sequential", "--n-jobs", "--timeout", "--aggregate", "--by-acq-group"]
+    for option in options:
+        assert option in docker
+        assert option in singularity
+
+    assert docker[docker.index("image") - 2] == "-v"
+    assert singularity[singularity.index("image") - 2] == "-B"
+
+
+def test_cached_validator_versions(tmp_path, monkeypatch):
+    """Test that validator and schema versions are cached per validator install."""
+    from cubids.workflows import bids_version
+
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    calls = []
+
+    def _validator_version():
+        calls.append("version")
+        return {"ValidatorVersion": "2.0.1"}
+
+    script = (
+        "import json, os, sys\n"
+        "assert sorted(os.listdir(sys.argv[1])) == ['README', 'dataset_description.json']\n"
+        "print(json.dumps({'issues': {'issues': []}, 'summary': {'schemaVersion': '1.0.0'}}))\n"
+    )
+    monkeypatch.setattr("cubids.validator.get_bids_validator_version", _validator_version)
+    monkeypatch.setattr(
+        "cubids.validator.build_validator_call",
+        lambda path, ignore_headers=False: [sys.executable, "-c", script, path],
+    )
+
+    versions = {"ValidatorVersion": "2.0.1", "SchemaVersion": "1.0.0"}
+    assert get_validator_versions() == versions
+    assert get_validator_versions() == versions
+    assert len(calls) == 1
+    assert (tmp_path / "cache" / "cubids" / "validator_versions.json").exists()
+
+    assert get_validator_versions(refresh=True) == versions
+    assert len(calls) == 2
+
+    data_root = get_data(tmp_path)
+    bids_version(data_root / "complete", write=True)
+    with open(data_root / "complete" / "dataset_description.json") as f:
+        description = json.load(f)
+
+    assert description["SchemaVersion"] == "1.0.0"
+    assert len(calls) == 2
+
+
+def test_prevalidate(tmp_path):
+    """Test the offline filename and sidecar checks."""
+    data_root = get_data(tmp_path)
+    bids_dir = data_root / "complete"
+    snapshot = load_schema_snapshot()
+    assert snapshot["entities"][0]["key"] == "sub"
+
+    parsed = prevalidate(bids_dir, n_jobs=2)
+    assert list(parsed.columns) == [
+        "location",
+        "code",
+        "issueMessage",
+        "subCode",
+        "severity",
+        "rule",
+    ]
+    assert parsed.shape[0] == 0
+
+    ses_dir = bids_dir / "sub-01" / "ses-phdiff"
+    os.rename(
+        ses_dir / "anat" / "sub-01_ses-phdiff_T1w.nii.gz",
+        ses_dir / "anat" / "sub-01_acq-x_ses-phdiff_T1w.nii.gz",
+    )
+    (ses_dir / "anat" / "sub-01_ses-phdiff_T1w.json").write_text("{")
+    (ses_dir / "anat" / "sub-01_ses-phdiff_run-x_T1w.nii.gz").write_text("")
+    (ses_dir / "anat" / "sub-01_ses-phdiff_foo-bar_T1w.nii.gz").write_text("")
+    (ses_dir / "anat" / "sub-01_ses-phdiff_T1w.txt").write_text("")
+    bold_json = ses_dir / "func" / "sub-01_ses-phdiff_task-rest_bold.json"
+    metadata = json.loads(bold_json.read_text())
+    del metadata["TaskName"]
+    bold_json.write_text(json.dumps(metadata))
+    fmap_json = ses_dir / "fmap" / "sub-01_ses-phdiff_acq-v4_phasediff.json"
+    metadata = json.loads(fmap_json.read_text())
+    metadata["IntendedFor"] = ["ses-phdiff/func/sub-01_ses-phdiff_task-missing_bold.nii.gz"]
+    fmap_json.write_text(json.dumps(metadata))
+
+    # A TaskName inherited from the top of the dataset is enough
+    (bids_dir / "task-rest_bold.json").write_text(json.dumps({"TaskName": "rest"}))
+    parsed = prevalidate(bids_dir)
+    assert sorted(zip(parsed["location"].str.split("/").str[-1], parsed["code"])) == [
+        ("sub-01_acq-x_ses-phdiff_T1w.nii.gz", "ENTITIES_OUT_OF_ORDER"),
+        ("sub-01_ses-phdiff_T1w.json", "JSON_INVALID"),
+        ("sub-01_ses-phdiff_T1w.txt", "NOT_INCLUDED"),
+        ("sub-01_ses-phdiff_acq-v4_phasediff.json", "INTENDED_FOR"),
+        ("sub-01_ses-phdiff_foo-bar_T1w.nii.gz", "ENTITY_NOT_IN_RULE"),
+        ("sub-01_ses-phdiff_run-x_T1w.nii.gz", "INVALID_ENTITY_LABEL"),
+    ]
+
+    os.remove(bids_dir / "task-rest_bold.json")
+    parsed = prevalidate(bids_dir)
+    missing = parsed[parsed["code"] == "SIDECAR_KEY_REQUIRED"]
+    assert missing["subCode"].tolist() == ["TaskName"]
+    assert missing["location"].tolist() == [
+        "/sub-01/ses-phdiff/func/sub-01_ses-phdiff_task-rest_bold.nii.gz"
+    ]
+
+
+def test_path_scoped_datalad(tmp_path):
+    """Test that datalad saves and status checks are limited to the touched paths."""
+    data_root = get_data(tmp_path)
+    bod = CuBIDS(data_root / "complete", use_datalad=True)
+    bod.datalad_save("Initial save")
+    assert bod.is_datalad_clean()
+
+    bod.add_nifti_info()
+    assert bod.touched_paths
+    assert all(path.endswith(".json") for path in bod.touched_paths)
+    assert bod.is_datalad_clean()
+
+    # Nothing new to add, so no sidecars are rewritten
+    bod.add_nifti_info()
+    assert bod.touched_paths == set()
+
+    sidecars = sorted(str(path) for path in Path(bod.path).rglob("sub-*/**/*.json"))
+    _edit_a_json(sidecars[0])
+    assert not bod.is_datalad_clean()
+    assert not bod.is_datalad_clean(paths=[sidecars[0]])
+    assert bod.is_datalad_clean(paths=[sidecars[1]])
+    assert bod.is_datalad_clean(paths=[])
+
+    # An empty save is a no-op, and a scoped save only commits the listed path
+    bod.datalad_save("Nothing to save", paths=[])
+    assert not bod.is_datalad_clean(paths=[sidecars[0]])
+    bod.datalad_save("Save one sidecar", paths=[sidecars[0]])
+    assert bod.is_datalad_clean()
+
+
+def test_unlock_modified_sidecars(tmp_path):
+    """Test that only the sidecars that will be modified are unlocked."""
+    data_root = get_data(tmp_path)
+    bids_dir = data_root / "complete"
+
+    # Annex everything, including the sidecars
+    dataset = dlapi.create(bids_dir, force=True, annex=True)
+    dataset.save(message="Annex everything")
+    sidecars = sorted(str(path) for path in bids_dir.rglob("sub-*/**/*.json"))
+    niftis = sorted(str(path) for path in bids_dir.rglob("sub-*/**/*.nii.gz"))
+    assert all(os.path.islink(path) for path in sidecars + niftis)
+
+    # Don't save, so the unlocked files aren't locked again
+    bod = CuBIDS(bids_dir, use_datalad=False, force_unlock=True)
+    bod.add_nifti_info()
+    assert bod.touched_paths
+
+    # The modified sidecars were unlocked, but the niftis were not
+    assert not any(os.path.islink(path) for path in bod.touched_paths)
+    assert all(os.path.islink(path) for path in niftis)
+
+    # Unlocked files are not unlocked again
+    assert bod.unlock_files(bod.touched_paths) == []
+    assert bod.unlock_files(niftis[:2], batch_size=1) == niftis[:2]
+
+
+def test_journal_undo(tmp_path):
+    """Test that operations are undone with the CuBIDS journal."""
+    data_root = get_data(tmp_path)
+    bids_dir = data_root / "complete"
+
+    def _snapshot():
+        contents = {}
+        for path in sorted(bids_dir.rglob("sub-*/**/*.*")):
+            if path.suffix == ".json":
+                with open(path) as f:
+                    contents[str(path)] = json.load(f)
+            else:
+                contents[str(path)] = file_hash(path)
+        return contents
+
+    original = _snapshot()
+    scan_name = "sub-01/ses-phdiff/dwi/sub-01_ses-phdiff_acq-HASC55AP_dwi.nii.gz"
+    purge_path = str(tmp_path / "purge_scans.txt")
+    with open(purge_path, "w") as filehandle:
+        filehandle.write(f"{scan_name}\n")
+
+    bod = CuBIDS(bids_dir, use_datalad=False)
+    bod.add_nifti_info()
+    bod.purge(purge_path)
+    assert not (bids_dir / scan_name).exists()
+
+    entries = read_journal(bids_dir)
+    assert [entry["operation"] for entry in entries] == ["add-nifti-info", "purge"]
+    assert scan_name in entries[1]["deletions"]
+    assert "IntendedFor" in json.dumps(entries[1]["sidecars"])
+
+    assert bod.undo_last_operation()["operation"] == "purge"
+    assert (bids_dir / scan_name).exists()
+    assert bod.undo_last_operation()["operation"] == "add-nifti-info"
+    assert _snapshot() == original
+    assert read_journal(bids_dir) == []
+    with pytest.raises(Exception, match="No operations to undo"):
+        bod.undo_last_operation()
+
+    # Deleted files and removed metadata fields are restored from git in datalad datasets
+    bod = CuBIDS(bids_dir, use_datalad=True)
+    bod.datalad_save("Initial save")
+    bod.purge(purge_path)
+    bod.remove_metadata_fields(["Obliquity", "EchoTime"])
+    bod.datalad_save("Removed metadata fields")
+    assert not (bids_dir / scan_name).exists()
+    assert bod.is_datalad_clean()
+
+    assert bod.undo_last_operation()["operation"] == "remove-metadata-fields"
+    assert bod.undo_last_operation()["operation"] == "purge"
+    assert (bids_dir / scan_name).exists()
+    assert bod.is_datalad_clean()
+    assert _snapshot() == original
+
+
+def test_journal_remove_metadata_fields(tmp_path, capsys):
+    """Test that the values of removed metadata fields are never written to the journal."""
+    data_root = get_data(tmp_path)
+    bids_dir = data_root / "complete"
+    sidecar = bids_dir / "sub-01" / "ses-phdiff" / "anat" / "sub-01_ses-phdiff_T1w.json"
+    metadata = json.loads(sidecar.read_text())
+    metadata["PatientName"] = "Jane Doe"
+    sidecar.write_text(json.dumps(metadata))
+
+    bod = CuBIDS(bids_dir, use_datalad=False)
+    bod.remove_metadata_fields(["PatientName"])
+    assert "PatientName" not in json.loads(sidecar.read_text())
+    assert "can't restore them" in capsys.readouterr().out
+
+    journal_text = (bids_dir / "code" / "CuBIDS" / "journal.jsonl").read_text()
+    assert "Jane Doe" not in journal_text
+    entry = read_journal(bids_dir)[-1]
+    assert entry["redacted"]
+    assert entry["sidecars"] == {str(sidecar.relative_to(bids_dir)): {"keys": ["PatientName"]}}
+
+    # Undo can't restore the values, but still removes the entry
+    bod.undo_last_operation()
+    assert "were not restored" in capsys.readouterr().out
+    assert "PatientName" not in json.loads(sidecar.read_text())
+    assert read_journal(bids_dir) == []
+
+    # Values recorded by older versions of CuBIDS are removed when the trash is pruned
+    journal = Journal(bids_dir, "remove-metadata-fields")
+    sidecar.write_text(json.dumps(metadata))
+    journal.track_sidecars([str(sidecar)])
+    bod.remove_metadata_fields(["PatientName"])
+    journal.write()
+    journal_file = bids_dir / "code" / "CuBIDS" / "journal.jsonl"
+    assert "Jane Doe" in journal_file.read_text()
+    assert prune_trash(bids_dir) == [journal.entry_id]
+    assert "Jane Doe" not in journal_file.read_text()
+
+
+def test_journal_prune_trash(tmp_path):
+    """Test that the files kept to undo deletions can be removed."""
+    data_root = get_data(tmp_path)
+    bids_dir = data_root / "complete"
+    purge_path = str(tmp_path / "purge_scans.txt")
+    with open(purge_path, "w") as filehandle:
+        filehandle.write("sub-01/ses-phdiff/dwi/sub-01_ses-phdiff_acq-HASC55AP_dwi.nii.gz\n")
+
+    bod = CuBIDS(bids_dir, use_datalad=False)
+    bod.purge(purge_path)
+    bod.remove_metadata_fields(["EchoTime"])
+    purge_id, remove_id = [entry["id"] for entry in read_journal(bids_dir)]
+    trash_dir = bids_dir / "code" / "CuBIDS" / "journal"
+    assert (trash_dir / purge_id).is_dir()
+
+    # Only the operations that deleted files have a trash to empty
+    assert prune_trash(bids_dir, keep=2) == []
+    assert prune_trash(bids_dir, keep=1) == [purge_id]
+    assert not (trash_dir / purge_id).exists()
+
+    assert bod.undo_last_operation()["id"] == remove_id
+    with pytest.raises(Exception, match="removed from the trash"):
+        bod.undo_last_operation()
+    assert [entry["id"] for entry in read_journal(bids_dir)] == [purge_id]
+
+
+def test_apply_resume(tmp_path, monkeypatch):
+    """Test that an interrupted apply continues from its plan."""
+    import cubids.cubids
+
+    data_root = get_data(tmp_path)
+    bids_dir = data_root / "complete"
+    original = sorted(str(path) for path in bids_dir.rglob("sub-*/**/*.*"))
+
+    bod = CuBIDS(bids_dir, use_datalad=False)
+    bod.get_tsvs(str(tmp_path / "originals"))
+    summary_tsv = str(tmp_path / "originals_summary.tsv")
+    summary_df = pd.read_table(summary_tsv)
+    row = summary_df[summary_df.EntitySet.str.contains("task-rest")].index[0]
+    summary_df["RenameEntitySet"] = summary_df["RenameEntitySet"].astype(object)
+    summary_df.loc[row, "RenameEntitySet"] = summary_df.loc[row, "EntitySet"].replace(
+        "task-rest", "task-restvariant"
+    )
+    summary_df.to_csv(summary_tsv, sep="\t", index=False)
+    args = (summary_tsv, str(tmp_path / "originals_files.tsv"), str(tmp_path / "modified"))
+
+    # Interrupt the apply after the third rename, before it is marked as done
+    get_step_commands = cubids.cubids._get_step_commands
+    renames = []
+
+    def _interrupted_step_commands(step, journal, use_datalad):
+        commands = get_step_commands(step, journal, use_datalad)
+        if step["op"] == "rename":
+            renames.append(step)
+            if len(renames) == 3:
+                return commands + ["exit 1"]
+        return commands
+
+    monkeypatch.setattr(cubids.cubids, "_get_step_commands", _interrupted_step_commands)
+    with pytest.raises(Exception, match="Failed to run"):
+        bod.apply_tsv_changes(*args)
+
+    plan_file = tmp_path / "modified_apply_plan.json"
+    with open(plan_file) as f:
+        plan = json.load(f)
+    with open(tmp_path / "modified_apply_progress.txt") as f:
+        done = [int(line) for line in f]
+    assert [step["op"] for step in plan["steps"]].count("rename") == len(renames)
+    assert plan["steps"][done[-1]] == renames[1]
+    assert not Path(renames[1]["old"]).exists()
+    assert not Path(renames[2]["old"]).exists()
+    assert Path(renames[2]["new"]).exists()
+
+    # Don't start over while a plan is unfinished
+    monkeypatch.setattr(cubids.cubids, "_get_step_commands", get_step_commands)
+    with pytest.raises(Exception, match="unfinished apply"):
+        bod.apply_tsv_changes(*args)
+
+    # The rename that ran but wasn't marked as done is skipped
+    bod.apply_tsv_changes(*args, resume=True)
+    assert not plan_file.exists()
+    assert all(Path(step["new"]).exists() for step in renames)
+    assert not any(Path(step["old"]).exists() for step in renames)
+    with pytest.raises(Exception, match="No unfinished apply"):
+        bod.apply_tsv_changes(*args, resume=True)
+
+    # The resumed apply is undone as one operation
+    assert len(read_journal(bids_dir)) == 1
+    bod.undo_last_operation()
+    assert sorted(str(path) for path in bids_dir.rglob("sub-*/**/*.*")) == original
+
+
+def test_apply_incremental_tsvs(tmp_path):
+    """Test that apply only groups the changed entity sets, with the same result as get_tsvs."""
+    data_root = get_data(tmp_path)
+    bids_dir = data_root / "complete"
+
+    bod = CuBIDS(bids_dir, use_datalad=False)
+    bod.get_tsvs(str(tmp_path / "originals"))
+    summary_tsv = str(tmp_path / "originals_summary.tsv")
+    summary_df = pd.read_table(summary_tsv)
+    summary_df["RenameEntitySet"] = summary_df["RenameEntitySet"].astype(object)
+    rest_row = summary_df[summary_df.EntitySet.str.contains("task-rest")].index[0]
+    summary_df.loc[rest_row, "RenameEntitySet"] = summary_df.loc[rest_row, "EntitySet"].replace(
+        "task-rest", "task-restvariant"
+    )
+    dwi_row = summary_df[summary_df.Modality == "dwi"].index[0]
+    summary_df.loc[dwi_row, "MergeInto"] = 0
+    summary_df.to_csv(summary_tsv, sep="\t", index=False)
+
+    plan = bod._plan_tsv_changes(summary_tsv, str(tmp_path / "originals_files.tsv"))
+    # the renamed and deleted entity sets, and the fieldmaps whose IntendedFor changed
+    anat_row = summary_df[summary_df.Modality == "anat"].index[0]
+    assert summary_df.loc[anat_row, "EntitySet"] not in plan["regroup"]
+    assert summary_df.loc[rest_row, "RenameEntitySet"] in plan["regroup"]
+    assert summary_df.loc[dwi_row, "EntitySet"] in plan["regroup"]
+    assert any("fmap" in entity_set for entity_set in plan["regroup"])
+
+    bod.apply_tsv_changes(
+        summary_tsv, str(tmp_path / "originals_files.tsv"), str(tmp_path / "modified")
+    )
+    bod.get_tsvs(str(tmp_path / "full"))
+
+    for kind, sort_by in [("summary", ["KeyParamGroup"]), ("files", ["FilePath"])]:
+        incremental = pd.read_table(tmp_path / f"modified_{kind}.tsv")
+        full = pd.read_table(tmp_path / f"full_{kind}.tsv")
+        assert list(incremental.columns) == list(full.columns)
+        pd.testing.assert_frame_equal(
+            incremental.sort_values(by=sort_by, ignore_index=True),
+            full.sort_values(by=sort_by, ignore_index=True),
+        )
+
+    assert "task-restvariant" in " ".join(pd.read_table(tmp_path / "modified_files.tsv").FilePath)
+
+
+def test_dry_run(tmp_path):
+    """Test that apply and purge can write their plans without changing the dataset."""
+    data_root = get_data(tmp_path)
+    bids_dir = data_root / "complete"
+
+    bod = CuBIDS(bids_dir, use_datalad=False)
+    bod.get_tsvs(str(tmp_path / "originals"))
+    original = sorted(str(path) for path in bids_dir.rglob("*"))
+    summary_tsv = str(tmp_path / "originals_summary.tsv")
+    summary_df = pd.read_table(summary_tsv)
+    summary_df["RenameEntitySet"] = summary_df["RenameEntitySet"].astype(object)
+    row = summary_df[summary_df.EntitySet.str.contains("task-rest")].index[0]
+    summary_df.loc[row, "RenameEntitySet"] = summary_df.loc[row, "EntitySet"].replace(
+        "task-rest", "task-restvariant"
+    )
+    summary_df.to_csv(summary_tsv, sep="\t", index=False)
+    args = (summary_tsv, str(tmp_path / "originals_files.tsv"), str(tmp_path / "modified"))
+
+    # A file in the way of a rename is reported as a collision
+    renamed_bold = bids_dir / "sub-01/ses-phdiff/func/sub-01_ses-phdiff_task-restvariant_bold.json"
+    renamed_bold.write_text("{}")
+    plan = bod.apply_tsv_changes(*args, dry_run=True)
+    assert [collision["path"] for collision in plan["estimate"]["collisions"]] == [
+        str(renamed_bold)
+    ]
+
+    # and the plan doesn't run over it
+    with pytest.raises(Exception, match="would overwrite files"):
+        bod.apply_tsv_changes(*args, resume=True)
+    assert renamed_bold.read_text() == "{}"
+    os.remove(tmp_path / "modified_apply_plan.json")
+    renamed_bold.unlink()
+
+    plan = bod.apply_tsv_changes(*args, dry_run=True)
+    estimate = plan["estimate"]
+    n_renames = [step["op"] for step in plan["steps"]].count("rename")
+    assert estimate["renamed"]["files"] == n_renames > 0
+    assert estimate["renamed"]["bytes"] > 0
+    assert estimate["deleted"] == {"files": 0, "bytes": 0}
+    assert estimate["intended_for_edits"] > 0
+    assert estimate["sidecars_rewritten"]["files"] > 0
+    assert estimate["collisions"] == []
+    assert sorted(str(path) for path in bids_dir.rglob("*")) == original
+    assert not (tmp_path / "modified_summary.tsv").exists()
+
+    # A plan isn't run if the files it touches changed since it was written
+    with open(tmp_path / "modified_apply_plan.json") as f:
+        assert json.load(f) == plan
+    renamed = next(step["old"] for step in plan["steps"] if step["op"] == "rename")
+    contents = Path(renamed).read_bytes()
+    Path(renamed).write_bytes(contents + b" ")
+    with pytest.raises(Exception, match="changed since the apply was planned"):
+        bod.apply_tsv_changes(*args, resume=True)
+    assert sorted(str(path) for path in bids_dir.rglob("*")) == original
+
+    # The written plan is run later
+    os.remove(tmp_path / "modified_apply_plan.json")
+    plan = bod.apply_tsv_changes(*args, dry_run=True)
+    bod.apply_tsv_changes(*args, resume=True)
+    assert not (tmp_path / "modified_apply_plan.json").exists()
+    assert all(Path(step["new"]).exists() for step in plan["steps"] if step["op"] == "rename")
+
+    purge_path = tmp_path / "purge_scans.txt"
+    purge_path.write_text("sub-01/ses-phdiff/dwi/sub-01_ses-phdiff_acq-HASC55AP_dwi.nii.gz\n")
+    scan = bids_dir / "sub-01/ses-phdiff/dwi/sub-01_ses-phdiff_acq-HASC55AP_dwi.nii.gz"
+    plan = bod.purge(str(purge_path), dry_run=True)
+    assert plan["estimate"]["deleted"]["files"] == 4
+    assert plan["estimate"]["intended_for_edits"] == 1
+    assert scan.exists()
+    with pytest.raises(Exception, match="unfinished purge"):
+        bod.purge(str(purge_path))
+    bod.purge(str(purge_path), resume=True)
+    assert not scan.exists()
+    assert not (tmp_path / "purge_scans_purge_plan.json").exists()
+
+
 def test_validator(tmp_path):
     """Test validator."""
     data_root = get_data(tmp_path)
@@ -1,8 +1,16 @@
 """Miscellaneous utility functions for CuBIDS."""
 
+import errno
+import os
 import re
+import shutil
 from pathlib import Path
 
+LINK_MODES = ("auto", "copy", "hardlink", "symlink", "reflink")
+
+# ioctl request code for cloning a file on Linux (btrfs, XFS, ...)
+FICLONE = 0x40049409
+
 
 def _get_container_type(image_name):
     """Get and return the container type.
@@ -31,3 +39,86 @@ def _get_container_type(image_name):
         return "docker"
 
     raise Exception("Unable to determine the container type of " + image_name)
+
+
+def _reflink(src, dst):
+    """Make a copy-on-write clone of a file, where the filesystem supports it."""
+    import fcntl
+
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            os.remove(dst)
+            raise
+
+    shutil.copystat(src, dst)
+
+
+def link_file(src, dst, mode="auto"):
+    """Place a file at a new path without copying its data, where possible.
+
+    Parameters
+    ----------
+    src : :obj:`str`
+        Path to the existing file.
+    dst : :obj:`str`
+        Path to create.
+    mode : {"auto", "copy", "hardlink", "symlink", "reflink"}, optional
+        How to create ``dst``.
+        "auto" tries a reflink, then a hardlink, then a symlink
+        (e.g., when ``dst`` is on another device), and then falls back to a copy.
+        "hardlink", "symlink" and "reflink" also fall back to a copy
+        if the filesystem doesn't support them (e.g., across devices).
+        Default is "auto".
+
+    Returns
+    -------
+    :obj:`str`
+        The mode that was actually used.
+    """
+    if mode not in LINK_MODES:
+        raise Exception(f"Unknown link mode '{mode}'. Options are: {', '.join(LINK_MODES)}.")
+
+    attempts = {
+        "auto": ["reflink", "hardlink", "symlink"],
+        "copy": [],
+        "hardlink": ["hardlink"],
+        "symlink": ["symlink"],
+        "reflink": ["reflink"],
+    }[mode]
+
+    for attempt in attempts:
+        try:
+            if attempt == "reflink":
+                _reflink(src, dst)
+            elif attempt == "hardlink":
+                os.link(src, dst)
+            else:
+                os.symlink(os.path.abspath(src), dst)
+            return attempt
+        except (OSError, ImportError) as exc:
+            if isinstance(exc, OSError) and exc.errno == errno.EEXIST:
+                raise
+
+    shutil.copy2(src, dst)
+    return "copy"
+
+
+def make_sparse_stub(src, dst):
+    """Create an empty, sparse file with the same size as ``src``.
+
+    This is used in place of NIfTI files when their contents will never be read
+    (e.g., when validating with ``--ignore_nifti_headers``),
+    so that file sizes are still reported correctly without reading or writing any data.
+
+    Parameters
+    ----------
+    src : :obj:`str`
+        Path to the existing file.
+    dst : :obj:`str`
+        Path to create.
+    """
+    with open(dst, "wb") as fdst:
+        fdst.truncate(os.path.getsize(src))
@@ -1,18 +1,38 @@
 """Methods for validating BIDS datasets."""
 
 import glob
+import hashlib
+import io
 import json
 import logging
 import os
 import pathlib
 import re
+import shutil
 import subprocess
+import tempfile
+import time
 import warnings
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from json.decoder import scanstring
 
 import pandas as pd
 
+from cubids.utils import link_file, make_sparse_stub
+
 logger = logging.getLogger("cubids-cli")
 
+ISSUE_COLUMNS = ["location", "code", "issueMessage", "subCode", "severity", "rule"]
+
+# Files whose contents are part of a subject's fingerprint, rather than just their size and mtime
+FINGERPRINT_CONTENT_EXTENSIONS = (".json", ".tsv", ".bval", ".bvec")
+
+# The validator is run from jsr without a pinned version,
+# so cached versions are looked up again after a day in case a newer one was fetched
+VERSION_CACHE_TTL = 24 * 60 * 60
+
 
 def build_validator_call(path, ignore_headers=False):
     """Build a subprocess command to the bids validator."""
@@ -43,6 +63,98 @@ def get_bids_validator_version():
     return {"ValidatorVersion": clean_ver}
 
 
+def get_version_cache_file():
+    """Get the path to the cache of validator and schema versions.
+
+    The cache is stored in ``$XDG_CACHE_HOME/cubids``, or ``~/.cache/cubids`` by default.
+    """
+    cache_dir = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(cache_dir, "cubids", "validator_versions.json")
+
+
+def _validator_install_key():
+    """Identify the installed validator by the deno executable and its module cache."""
+    command = build_validator_call("")
+    deno = shutil.which(command[0]) or command[0]
+    try:
+        deno_stat = os.stat(deno)
+        deno_id = [deno, deno_stat.st_size, deno_stat.st_mtime_ns]
+    except OSError:
+        deno_id = [deno]
+
+    key = json.dumps(
+        deno_id + [arg for arg in command[1:] if arg] + [os.environ.get("DENO_DIR", "")]
+    )
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def get_schema_version():
+    """Get the version of the BIDS schema used by the validator.
+
+    The validator is run on a stub dataset, with only a dataset_description.json and a README,
+    since the schema version doesn't depend on the dataset.
+
+    Returns
+    -------
+    version : :obj:`dict`
+        The schema version, as returned by :func:`extract_summary_info`.
+    """
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        with open(os.path.join(tmpdirname, "dataset_description.json"), "w") as f:
+            json.dump({"Name": "CuBIDS schema version check", "BIDSVersion": "1.9.0"}, f)
+
+        with open(os.path.join(tmpdirname, "README"), "w") as f:
+            f.write("Stub dataset used by CuBIDS to find the BIDS schema version.\n")
+
+        ret = run_validator(build_validator_call(tmpdirname))
+
+    return extract_summary_info(ret.stdout.decode("UTF-8"))
+
+
+def get_validator_versions(refresh=False):
+    """Get the validator and schema versions, from the cache if possible.
+
+    The versions are cached for each validator install (see :func:`get_version_cache_file`),
+    so only the first call in a day needs to run the validator.
+
+    Parameters
+    ----------
+    refresh : :obj:`bool`, optional
+        Look the versions up again, even if they are cached. Default is False.
+
+    Returns
+    -------
+    versions : :obj:`dict`
+        The "ValidatorVersion" and "SchemaVersion".
+    """
+    cache_file = get_version_cache_file()
+    key = _validator_install_key()
+    try:
+        with open(cache_file, "r") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+
+    entry = cache.get(key)
+    if not refresh and entry and time.time() - entry.get("time", 0) < VERSION_CACHE_TTL:
+        return {k: entry[k] for k in ["ValidatorVersion", "SchemaVersion"]}
+
+    versions = {**get_bids_validator_version(), **get_schema_version()}
+    if versions["ValidatorVersion"] and versions["SchemaVersion"]:
+        cache[key] = {**versions, "time": time.time()}
+        try:
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+            with open(tmp_file, "w") as f:
+                json.dump(cache, f, indent=4)
+
+            os.replace(tmp_file, cache_file)
+        except OSError as exc:
+            logger.warning("Could not cache the validator versions: %s", exc)
+
+    return versions
+
+
 def build_subject_paths(bids_dir):
     """Build a list of BIDS dirs with 1 subject each."""
     bids_dir = str(bids_dir)
@@ -91,27 +203,624 @@ def build_first_subject_path(bids_dir, subject):
     return subject_dict
 
 
-def run_validator(call):
+def build_validation_tree(files_list, subject, tmpdirname, link_mode="auto", stub_niftis=False):
+    """Place one subject's files, and the root files, into a temporary BIDS tree.
+
+    Parameters
+    ----------
+    files_list : :obj:`list` of :obj:`str`
+        Paths to the subject's files and the dataset's root files,
+        as returned by :func:`build_subject_paths`.
+    subject : :obj:`str`
+        Subject label (e.g., "sub-01").
+    tmpdirname : :obj:`str`
+        Root of the temporary BIDS tree.
+    link_mode : {"auto", "copy", "hardlink", "symlink", "reflink"}, optional
+        How files are placed in the tree. See :func:`cubids.utils.link_file`.
+        Default is "auto".
+    stub_niftis : :obj:`bool`, optional
+        If True, NIfTI files are replaced with sparse files of the same size.
+        Only use this when the validator will ignore the NIfTI headers.
+        Default is False.
+    """
+    for fi in files_list:
+        # cut the path down to the subject label
+        bids_start = fi.find(subject)
+
+        # maybe it's a single file
+        if bids_start < 1:
+            bids_folder = tmpdirname
+            fi_tmpdir = tmpdirname
+
+        else:
+            bids_folder = pathlib.Path(fi[bids_start:]).parent
+            fi_tmpdir = tmpdirname + "/" + str(bids_folder)
+
+        if not os.path.exists(fi_tmpdir):
+            os.makedirs(fi_tmpdir)
+        output = fi_tmpdir + "/" + str(pathlib.Path(fi).name)
+        if stub_niftis and re.search(r"\.nii(\.gz)?$", fi):
+            make_sparse_stub(fi, output)
+        else:
+            link_file(fi, output, mode=link_mode)
+
+
+def run_validator(call, timeout=None):
     """Run the validator with subprocess.
 
     Parameters
     ----------
     call : :obj:`list`
         List of strings to pass to subprocess.run().
+    timeout : :obj:`float`, optional
+        Number of seconds after which the validator is killed.
+        If None, the validator is allowed to run until it finishes.
 
     Returns
     -------
     :obj:`subprocess.CompletedProcess`
         The result of the subprocess call.
+
+    Raises
+    ------
+    :obj:`subprocess.TimeoutExpired`
+        If the validator runs for longer than ``timeout``.
     """
     # if verbose:
     #     logger.info("Running the validator with call:")
     #     logger.info('\"' + ' '.join(call) + '\"')
 
-    ret = subprocess.run(call, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    ret = subprocess.run(call, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=timeout)
     return ret
 
 
+def validate_subject(
+    subject, files_list, ignore_nifti_headers=False, link_mode="auto", timeout=None
+):
+    """Run the validator on a single subject, in its own temporary BIDS tree.
+
+    Problems running the validator are recorded as issues,
+    so one failing subject doesn't stop the validation of the others.
+
+    Parameters
+    ----------
+    subject : :obj:`str`
+        Subject label (e.g., "sub-01").
+    files_list : :obj:`list` of :obj:`str`
+        Paths to the subject's files and the dataset's root files,
+        as returned by :func:`build_subject_paths`.
+    ignore_nifti_headers : :obj:`bool`, optional
+        Ignore NIfTI headers when validating. Default is False.
+    link_mode : {"auto", "copy", "hardlink", "symlink", "reflink"}, optional
+        How files are placed in the temporary tree. Default is "auto".
+    timeout : :obj:`float`, optional
+        Number of seconds after which the validator is killed.
+
+    Returns
+    -------
+    parsed : :obj:`pandas.DataFrame`
+        The subject's issues, with a "subject" column.
+        If the validator timed out or its output couldn't be parsed,
+        there is a single issue with the code "VALIDATOR_TIMEOUT" or "VALIDATOR_FAILED".
+    """
+    with tempfile.TemporaryDirectory() as tmpdirname:
+        try:
+            build_validation_tree(
+                files_list,
+                subject,
+                tmpdirname,
+                link_mode=link_mode,
+                stub_niftis=ignore_nifti_headers,
+            )
+            call = build_validator_call(tmpdirname, ignore_nifti_headers)
+            ret = run_validator(call, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            logger.error("Validator timed out on %s", subject)
+            parsed = _validation_failure(
+                subject, "VALIDATOR_TIMEOUT", f"Validator timed out after {timeout} seconds."
+            )
+        except OSError as exc:
+            logger.error("Could not run the validator on %s: %s", subject, exc)
+            parsed = _validation_failure(subject, "VALIDATOR_FAILED", str(exc))
+        else:
+            if ret.returncode != 0:
+                logger.error("Errors returned from validator run, parsing now")
+
+            try:
+                parsed = parse_validator_output(ret.stdout.decode("UTF-8"))
+            except ValueError:
+                logger.error("Could not parse the validator output for %s", subject)
+                message = ret.stderr.decode("UTF-8", errors="replace").strip()
+                parsed = _validation_failure(
+                    subject, "VALIDATOR_FAILED", message or "Validator output could not be parsed."
+                )
+
+    parsed["subject"] = subject
+    return parsed
+
+
+def subject_fingerprint(subject, files_list, validator_version, ignore_nifti_headers=False):
+    """Summarize everything that can change a subject's validation results.
+
+    Parameters
+    ----------
+    subject : :obj:`str`
+        Subject label (e.g., "sub-01").
+    files_list : :obj:`list` of :obj:`str`
+        Paths to the subject's files and the dataset's root files,
+        as returned by :func:`build_subject_paths`.
+    validator_version : :obj:`str`
+        Version of the BIDS validator.
+    ignore_nifti_headers : :obj:`bool`, optional
+        Whether NIfTI headers are ignored when validating. Default is False.
+
+    Returns
+    -------
+    :obj:`str`
+        SHA-256 hash of the file list, sizes and modification times,
+        the contents of sidecars, tsvs and root files,
+        the validator version and the ``ignore_nifti_headers`` flag.
+    """
+    fingerprint = hashlib.sha256()
+    fingerprint.update(f"{validator_version}\0{bool(ignore_nifti_headers)}\0".encode("utf-8"))
+
+    tree_paths = []
+    for fi in files_list:
+        bids_start = fi.find(subject)
+        tree_paths.append((fi[bids_start:] if bids_start >= 1 else os.path.basename(fi), fi))
+
+    for tree_path, fi in sorted(tree_paths):
+        stat = os.stat(fi)
+        fingerprint.update(f"{tree_path}\0{stat.st_size}\0{stat.st_mtime_ns}\0".encode("utf-8"))
+        is_root_file = tree_path == os.path.basename(fi)
+        if is_root_file or fi.endswith(FINGERPRINT_CONTENT_EXTENSIONS):
+            with open(fi, "rb") as fobj:
+                fingerprint.update(hashlib.sha256(fobj.read()).digest())
+
+    return fingerprint.hexdigest()
+
+
+def load_validation_cache(cache_file):
+    """Load cached validation results.
+
+    Parameters
+    ----------
+    cache_file : :obj:`str`
+        Path to the cache file.
+
+    Returns
+    -------
+    cache : :obj:`dict`
+        Mapping of subject labels to their fingerprint and issues.
+        Empty if the cache file doesn't exist or can't be read.
+    """
+    if not os.path.exists(cache_file):
+        return {}
+
+    try:
+        with open(cache_file, "r") as fobj:
+            return json.load(fobj)
+    except ValueError:
+        logger.warning("Ignoring unreadable validation cache %s", cache_file)
+        return {}
+
+
+def save_validation_cache(cache_file, cache, subjects=None):
+    """Write cached validation results.
+
+    Parameters
+    ----------
+    cache_file : :obj:`str`
+        Path to the cache file.
+    cache : :obj:`dict`
+        Mapping of subject labels to their fingerprint and issues.
+    subjects : :obj:`list` of :obj:`str`, optional
+        If provided, only these subjects' entries are updated in the existing cache file.
+        The file is locked while it is updated,
+        so several processes (e.g., shards of one run) can share a cache file.
+    """
+    import fcntl
+
+    with open(cache_file + ".lock", "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if subjects is not None:
+            updated = {subject: cache[subject] for subject in subjects if subject in cache}
+            cache = load_validation_cache(cache_file)
+            cache.update(updated)
+
+        tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+        with open(tmp_file, "w") as fobj:
+            json.dump(cache, fobj, indent=1, sort_keys=True)
+
+        os.replace(tmp_file, cache_file)
+
+
+def shard_subjects(subjects_dict, shard_index, n_shards):
+    """Select one shard's subjects.
+
+    Subjects are sorted by label and dealt out to the shards in turn,
+    so every shard gets the same subjects no matter which machine it runs on
+    or what order the file system lists them in.
+
+    Parameters
+    ----------
+    subjects_dict : :obj:`dict`
+        Mapping of subject labels to their files, as returned by :func:`build_subject_paths`.
+    shard_index : :obj:`int`
+        Index of the shard, from 0 to ``n_shards - 1``.
+    n_shards : :obj:`int`
+        Total number of shards.
+
+    Returns
+    -------
+    :obj:`dict`
+        The shard's subjects and their files.
+    """
+    if not 0 <= shard_index < n_shards:
+        raise ValueError(f"Shard index must be between 0 and {n_shards - 1}: {shard_index}")
+
+    shard = sorted(subjects_dict.keys())[shard_index::n_shards]
+    return {subject: subjects_dict[subject] for subject in shard}
+
+
+def get_shard_tsv(val_prefix, shard_index, n_shards):
+    """Get the path to the partial validation tsv written by one shard."""
+    return f"{val_prefix}_shard-{shard_index}-of-{n_shards}_validation.tsv"
+
+
+def merge_validation_shards(val_prefix):
+    """Combine the partial validation tsvs written by each shard.
+
+    Parameters
+    ----------
+    val_prefix : :obj:`str`
+        Prefix of the shards' validation tsvs.
+
+    Returns
+    -------
+    parsed : :obj:`pandas.DataFrame`
+        The issues from every shard, sorted by subject,
+        with repeated issues across subjects removed.
+
+    Raises
+    ------
+    :obj:`Exception`
+        If no shards are found, the shards disagree on the number of shards,
+        or any shard is missing.
+    """
+    shard_files = {}
+    for shard_tsv in glob.glob(glob.escape(val_prefix) + "_shard-*-of-*_validation.tsv"):
+        match = re.search(r"_shard-(\d+)-of-(\d+)_validation\.tsv$", shard_tsv)
+        if match:
+            shard_files[(int(match.group(1)), int(match.group(2)))] = shard_tsv
+
+    if not shard_files:
+        raise Exception(f"No validation shards found for {val_prefix}")
+
+    n_shards = set(n_shards for _, n_shards in shard_files.keys())
+    if len(n_shards) > 1:
+        raise Exception(f"Found shards from runs with different numbers of shards: {n_shards}")
+
+    n_shards = n_shards.pop()
+    missing = [
+        str(i_shard) for i_shard in range(n_shards) if (i_shard, n_shards) not in shard_files
+    ]
+    if missing:
+        raise Exception(f"Missing validation shards {', '.join(missing)} of {n_shards}")
+
+    parsed = pd.concat(
+        [
+            pd.read_table(shard_files[(i_shard, n_shards)], dtype=str, keep_default_na=False)
+            for i_shard in range(n_shards)
+        ],
+        ignore_index=True,
+    )
+    parsed = parsed.sort_values(by="subject", kind="stable")
+    return parsed.drop_duplicates(subset=parsed.columns.difference(["subject"]))
+
+
+# Top-level directories that the validator skips, so changes in them never need a new run
+UNVALIDATED_DIRS = ("code", "derivatives", "sourcedata")
+
+
+def get_changed_subjects(bids_dir, since):
+    """Find the subjects with files that have changed since a git revision.
+
+    Committed changes, changes in the working tree and untracked files are all included.
+    Annexed files are git-annex symlinks or pointer files,
+    so a change to their content changes the file git sees, and is found as well.
+
+    Parameters
+    ----------
+    bids_dir : :obj:`pathlib.Path`
+        Path to the BIDS directory. It must be in a git (or datalad) repository.
+    since : :obj:`str`
+        Git revision to compare against (e.g., "HEAD~1" or a tag).
+
+    Returns
+    -------
+    changed_subjects : :obj:`list` of :obj:`str`
+        Sorted labels of the subjects (e.g., "sub-01") with changed files.
+    root_changed : :obj:`bool`
+        True if files outside of the subject directories have changed
+        (e.g., dataset_description.json), which may affect every subject.
+        Changes in hidden files and in the code, derivatives and sourcedata directories
+        are ignored.
+    """
+    calls = [
+        ["git", "-C", str(bids_dir), "diff", "--name-only", "--no-renames", "--relative", since],
+        ["git", "-C", str(bids_dir), "ls-files", "--others", "--exclude-standard"],
+    ]
+    changed_files = []
+    for call in calls:
+        ret = subprocess.run(call, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if ret.returncode != 0:
+            raise Exception(
+                f"Could not find the files changed since {since}:\n"
+                + ret.stderr.decode("utf-8", errors="replace")
+            )
+
+        changed_files.extend(ret.stdout.decode("utf-8").splitlines())
+
+    changed_subjects = set()
+    root_changed = False
+    for changed_file in changed_files:
+        top = changed_file.split("/")[0]
+        if top.startswith("sub-") and "/" in changed_file:
+            changed_subjects.add(top)
+        elif not (top.startswith(".") or top in UNVALIDATED_DIRS):
+            root_changed = True
+
+    return sorted(changed_subjects), root_changed
+
+
+def get_acq_group_representatives(acq_grouping_tsv, subjects, n_representatives=1):
+    """Choose the subjects to validate from each acquisition group.
+
+    Subjects are grouped by the acquisition groups they belong to
+    in the ``_AcqGrouping.tsv`` written by ``cubids group``.
+    A subject whose sessions are in different acquisition groups is grouped with the subjects
+    that have the same combination of groups (e.g., "1+3").
+
+    Parameters
+    ----------
+    acq_grouping_tsv : :obj:`str`
+        Path to the ``_AcqGrouping.tsv``.
+    subjects : :obj:`list` of :obj:`str`
+        Labels of the subjects in the dataset (e.g., "sub-01").
+    n_representatives : :obj:`int`, optional
+        Number of subjects to validate from each group. Default is 1.
+
+    Returns
+    -------
+    groups : :obj:`list` of :obj:`tuple`
+        ``(acq_group, representatives, members)`` for each group.
+        The representatives are the first subjects of the group, in sorted order.
+        Subjects that aren't in the tsv are validated on their own,
+        with the acquisition group "n/a".
+    """
+    acq_grouping = pd.read_table(acq_grouping_tsv, dtype=str, keep_default_na=False)
+    subject_groups = acq_grouping.groupby("subject")["AcqGroup"].agg(
+        lambda acq_groups: "+".join(sorted(set(acq_groups), key=int))
+    )
+
+    members = {}
+    groups = []
+    for subject in sorted(subjects):
+        if subject not in subject_groups:
+            logger.warning("%s is not in %s, validating it directly", subject, acq_grouping_tsv)
+            groups.append(("n/a", [subject], [subject]))
+            continue
+
+        members.setdefault(subject_groups[subject], []).append(subject)
+
+    for acq_group in sorted(members, key=lambda label: [int(x) for x in label.split("+")]):
+        groups.append(
+            (acq_group, members[acq_group][: max(1, n_representatives)], members[acq_group])
+        )
+
+    return groups
+
+
+def _replace_subject(values, old_subject, new_subject):
+    """Replace a subject label in a column of locations or messages."""
+    return values.str.replace(re.escape(old_subject) + r"(?![a-zA-Z0-9])", new_subject, regex=True)
+
+
+def project_acq_group_issues(subject_issues, groups):
+    """Project the issues of each group's representatives onto the rest of the group.
+
+    Parameters
+    ----------
+    subject_issues : :obj:`dict`
+        Mapping of each representative to its issues, as returned by :func:`validate_subject`.
+    groups : :obj:`list` of :obj:`tuple`
+        Groups, as returned by :func:`get_acq_group_representatives`.
+
+    Returns
+    -------
+    parsed : :obj:`pandas.DataFrame`
+        The issues of every subject. Each representative's own issues are kept.
+        The other members get every issue found in the group's representatives,
+        with the subject label in the location and message replaced,
+        "inferred" set to True and the representatives in "inferred_from".
+    triage : :obj:`pandas.DataFrame`
+        One row per group, with its representatives, the number of distinct issues,
+        whether the representatives all had the same issues ("consistent"),
+        and whether the group needs a full validation ("needs_full_pass"),
+        because its representatives disagree or found errors.
+    """
+    columns = ISSUE_COLUMNS + ["subject"]
+    placeholder = "sub-<subject>"
+
+    parsed = []
+    triage = []
+    for acq_group, representatives, members in groups:
+        group_issues = []
+        signatures = []
+        for representative in representatives:
+            issues = subject_issues[representative].reindex(columns=columns)
+            issues = issues.assign(inferred=False, inferred_from="")
+            parsed.append(issues)
+
+            normalized = issues[ISSUE_COLUMNS].fillna("").astype(str)
+            for column in ["location", "issueMessage"]:
+                normalized[column] = _replace_subject(
+                    normalized[column], representative, placeholder
+                )
+
+            group_issues.append(normalized)
+            signatures.append(set(normalized.itertuples(index=False, name=None)))
+
+        group_issues = pd.concat(group_issues, axis=0)
+        consistent = all(signature == signatures[0] for signature in signatures)
+        group_issues = group_issues.drop_duplicates()
+        has_errors = (group_issues["severity"] == "error").any()
+
+        for member in members:
+            if member in representatives:
+                continue
+
+            issues = group_issues.copy()
+            for column in ["location", "issueMessage"]:
+                issues[column] = _replace_subject(issues[column], placeholder, member)
+
+            issues["subject"] = member
+            issues["inferred"] = True
+            issues["inferred_from"] = ", ".join(representatives)
+            parsed.append(issues)
+
+        triage.append(
+            {
+                "AcqGroup": acq_group,
+                "n_subjects": len(members),
+                "representatives": ", ".join(representatives),
+                "n_issues": group_issues.shape[0],
+                "consistent": consistent,
+                "needs_full_pass": not consistent or has_errors,
+            }
+        )
+
+    parsed = pd.concat(parsed, axis=0) if parsed else pd.DataFrame(columns=columns)
+    parsed = parsed.sort_values(by="subject", kind="stable").reset_index(drop=True)
+    return parsed, pd.DataFrame(triage)
+
+
+def _validate_subject_cached(subject, files_list, cache, validator_version, **kwargs):
+    """Reuse a subject's cached issues if its fingerprint hasn't changed."""
+    fingerprint = subject_fingerprint(
+        subject,
+        files_list,
+        validator_version,
+        ignore_nifti_headers=kwargs.get("ignore_nifti_headers", False),
+    )
+    cached = cache.get(subject)
+    if cached is not None and cached.get("fingerprint") == fingerprint:
+        parsed = pd.DataFrame(cached["issues"], columns=ISSUE_COLUMNS)
+        parsed["subject"] = subject
+        return parsed
+
+    parsed = validate_subject(subject, files_list, **kwargs)
+
+    # Don't cache failed runs, so they are retried next time
+    if not parsed["code"].isin(["VALIDATOR_TIMEOUT", "VALIDATOR_FAILED"]).any():
+        cache[subject] = {
+            "fingerprint": fingerprint,
+            "issues": parsed[ISSUE_COLUMNS].to_dict(orient="records"),
+        }
+
+    return parsed
+
+
+def _validation_failure(subject, code, message):
+    """Record a failed validator run as an issue."""
+    return pd.DataFrame(
+        [
+            {
+                "location": f"/{subject}",
+                "code": code,
+                "issueMessage": message,
+                "subCode": "",
+                "severity": "error",
+                "rule": "",
+            }
+        ]
+    )
+
+
+def validate_subjects(
+    subjects_dict,
+    ignore_nifti_headers=False,
+    link_mode="auto",
+    n_jobs=1,
+    timeout=None,
+    cache=None,
+    validator_version=None,
+):
+    """Run the validator on each subject, with several subjects at a time.
+
+    At most ``2 * n_jobs`` subjects are in flight at once, and the results are
+    yielded in the same order as ``subjects_dict``,
+    so only a few subjects' issues are held in memory
+    and the merged output doesn't depend on which subject finishes first.
+
+    Parameters
+    ----------
+    subjects_dict : :obj:`dict`
+        Mapping of subject labels to their files, as returned by :func:`build_subject_paths`.
+    ignore_nifti_headers : :obj:`bool`, optional
+        Ignore NIfTI headers when validating. Default is False.
+    link_mode : {"auto", "copy", "hardlink", "symlink", "reflink"}, optional
+        How files are placed in each subject's temporary tree. Default is "auto".
+    n_jobs : :obj:`int`, optional
+        Number of validator processes to run at once. Default is 1.
+    timeout : :obj:`float`, optional
+        Number of seconds after which a subject's validator run is killed.
+    cache : :obj:`dict`, optional
+        Cached results, as returned by :func:`load_validation_cache`.
+        If provided, subjects whose :func:`subject_fingerprint` matches the cache
+        are not validated again, and the cache is updated with the new results.
+    validator_version : :obj:`str`, optional
+        Version of the BIDS validator. Required if ``cache`` is provided.
+
+    Yields
+    ------
+    parsed : :obj:`pandas.DataFrame`
+        Each subject's issues, as returned by :func:`validate_subject`.
+    """
+    n_jobs = max(1, n_jobs)
+    subject_items = iter(subjects_dict.items())
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+
+        def _submit(n_subjects):
+            for subject, files_list in islice(subject_items, n_subjects):
+                kwargs = {
+                    "ignore_nifti_headers": ignore_nifti_headers,
+                    "link_mode": link_mode,
+                    "timeout": timeout,
+                }
+                if cache is None:
+                    future = executor.submit(validate_subject, subject, files_list, **kwargs)
+                else:
+                    future = executor.submit(
+                        _validate_subject_cached,
+                        subject,
+                        files_list,
+                        cache,
+                        validator_version,
+                        **kwargs,
+                    )
+
+                futures.append(future)
+
+        futures = deque()
+        _submit(2 * n_jobs)
+        while futures:
+            parsed = futures.popleft().result()
+            _submit(1)
+            yield parsed
+
+
 def parse_validator_output(output):
     """Parse the JSON output of the BIDS validator into a pandas dataframe.
 
@@ -125,47 +834,372 @@ def parse_validator_output(output):
     df : :obj:`pandas.DataFrame`
         Dataframe of validator output.
     """
-
-    def parse_issue(issue_dict):
-        """Parse a single issue from the validator output.
-
-        Parameters
-        ----------
-        issue_dict : :obj:`dict`
-            Dictionary of issue.
-
-        Returns
-        -------
-        return_dict : :obj:`dict`
-            Dictionary of parsed issue.
-        """
-        return {
-            "location": issue_dict.get("location", ""),
-            "code": issue_dict.get("code", ""),
-            "issueMessage": issue_dict.get("issueMessage", ""),
-            "subCode": issue_dict.get("subCode", ""),
-            "severity": issue_dict.get("severity", ""),
-            "rule": issue_dict.get("rule", ""),
-        }
-
     # Load JSON data
     data = json.loads(output)
 
     # Extract issues
     issues = data.get("issues", {}).get("issues", [])
     if not issues:
-        return pd.DataFrame(
-            columns=["location", "code", "issueMessage", "subCode", "severity", "rule"]
-        )
+        return pd.DataFrame(columns=ISSUE_COLUMNS)
 
     # Parse all issues
-    parsed_issues = [parse_issue(issue) for issue in issues]
+    parsed_issues = [_parse_issue(issue) for issue in issues]
 
     # Convert to DataFrame
     df = pd.DataFrame(parsed_issues)
     return df
 
 
+def _parse_issue(issue_dict):
+    """Parse a single issue from the validator output.
+
+    Parameters
+    ----------
+    issue_dict : :obj:`dict`
+        Dictionary of issue.
+
+    Returns
+    -------
+    return_dict : :obj:`dict`
+        Dictionary of parsed issue.
+    """
+    return {
+        "location": issue_dict.get("location", ""),
+        "code": issue_dict.get("code", ""),
+        "issueMessage": issue_dict.get("issueMessage", ""),
+        "subCode": issue_dict.get("subCode", ""),
+        "severity": issue_dict.get("severity", ""),
+        "rule": issue_dict.get("rule", ""),
+    }
+
+
+def iter_validator_issues(stream, read_size=1 << 16):
+    """Parse the issues in the validator's JSON output one at a time, as it is read.
+
+    Only the ``issues.issues`` array is decoded.
+    Each issue is yielded as soon as it has been read,
+    so memory use depends on the size of one issue rather than of the whole output.
+
+    Parameters
+    ----------
+    stream : file-like
+        Text stream with the validator's JSON output (e.g., the validator's stdout).
+    read_size : :obj:`int`, optional
+        Number of characters to read from the stream at a time.
+
+    Yields
+    ------
+    issue : :obj:`dict`
+        Each issue, as it appears in the validator output.
+
+    Raises
+    ------
+    :obj:`json.JSONDecodeError`
+        If the output ends before the JSON is complete.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    eof = False
+
+    def _fill():
+        """Drop the parsed part of the buffer and read more. Return False at the end."""
+        nonlocal buffer, pos, eof
+        chunk = stream.read(read_size) if not eof else ""
+        if not chunk:
+            eof = True
+            return False
+
+        buffer = buffer[pos:] + chunk
+        pos = 0
+        return True
+
+    # Each open object or array, with the last key read in each object
+    stack = []
+    expect_key = False
+    while True:
+        if pos >= len(buffer):
+            if not _fill():
+                break
+            continue
+
+        char = buffer[pos]
+        if char == '"':
+            try:
+                value, end = scanstring(buffer, pos + 1)
+            except json.JSONDecodeError:
+                if not _fill():
+                    raise
+                continue
+
+            if expect_key and stack and stack[-1][0] == "object":
+                stack[-1][1] = value
+                expect_key = False
+            pos = end
+            continue
+
+        if char == "{":
+            stack.append(["object", None])
+            expect_key = True
+        elif char == ",":
+            expect_key = bool(stack) and stack[-1][0] == "object"
+        elif char in "}]":
+            stack.pop()
+        elif char == "[":
+            in_issues = stack == [["object", "issues"], ["object", "issues"]]
+            stack.append(["array", None])
+            if in_issues:
+                pos += 1
+                while True:
+                    while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                        pos += 1
+
+                    if pos >= len(buffer):
+                        if not _fill():
+                            raise json.JSONDecodeError("Unterminated issues array", buffer, pos)
+                        continue
+
+                    if buffer[pos] == "]":
+                        break
+
+                    try:
+                        issue, end = decoder.raw_decode(buffer, pos)
+                    except json.JSONDecodeError:
+                        if not _fill():
+                            raise
+                        continue
+
+                    # A value that runs to the end of the buffer may continue in the stream
+                    if end >= len(buffer) and not eof and _fill():
+                        continue
+
+                    pos = end
+                    yield issue
+
+                # Leave the closing bracket to pop the array
+                continue
+
+        pos += 1
+
+
+def stream_validator_issues(call, chunk_size=10000):
+    """Run the validator and parse its issues in chunks, as they are produced.
+
+    Parameters
+    ----------
+    call : :obj:`list`
+        List of strings to pass to subprocess.Popen().
+    chunk_size : :obj:`int`, optional
+        Maximum number of issues in each chunk. Default is 10000.
+
+    Yields
+    ------
+    chunk : :obj:`pandas.DataFrame`
+        Up to ``chunk_size`` parsed issues.
+        At least one (possibly empty) chunk is always yielded.
+    """
+    chunk = []
+    with tempfile.TemporaryFile() as stderr:
+        proc = subprocess.Popen(call, stdout=subprocess.PIPE, stderr=stderr)
+        try:
+            with io.TextIOWrapper(proc.stdout, encoding="utf-8") as stdout:
+                n_chunks = 0
+                try:
+                    for issue in iter_validator_issues(stdout):
+                        chunk.append(_parse_issue(issue))
+                        if len(chunk) >= chunk_size:
+                            yield pd.DataFrame(chunk, columns=ISSUE_COLUMNS)
+                            n_chunks += 1
+                            chunk = []
+                except json.JSONDecodeError:
+                    proc.kill()
+                    proc.wait()
+                    stderr.seek(0)
+                    raise Exception(
+                        "Could not parse the validator output:\n"
+                        + stderr.read().decode("utf-8", errors="replace")
+                    )
+
+                if chunk or n_chunks == 0:
+                    yield pd.DataFrame(chunk, columns=ISSUE_COLUMNS)
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+
+            if proc.wait() != 0:
+                logger.error("Errors returned from validator run, parsing now")
+
+
+def run_validator_to_tsv(call, val_tsv, chunk_size=10000):
+    """Run the validator and stream its issues into a tsv.
+
+    The validator's output is parsed as it is produced,
+    and the issues are appended to ``val_tsv`` in chunks,
+    so the full output is never held in memory.
+    If there are no issues, ``val_tsv`` isn't written.
+
+    Parameters
+    ----------
+    call : :obj:`list`
+        List of strings to pass to subprocess.Popen().
+    val_tsv : :obj:`str`
+        Path to the tsv to write.
+    chunk_size : :obj:`int`, optional
+        Number of issues to write at a time. Default is 10000.
+
+    Returns
+    -------
+    n_issues : :obj:`int`
+        The number of issues written.
+    """
+    n_issues = 0
+    for chunk in stream_validator_issues(call, chunk_size=chunk_size):
+        if chunk.shape[0] == 0:
+            continue
+
+        chunk.to_csv(
+            val_tsv,
+            sep="\t",
+            index=False,
+            mode="w" if n_issues == 0 else "a",
+            header=n_issues == 0,
+        )
+        n_issues += chunk.shape[0]
+
+    return n_issues
+
+
+class IssueAggregator:
+    """Collapse repeated validator issues into counts, as the issues arrive.
+
+    Issues are grouped by their code, subCode, severity and rule.
+    For each group, the aggregator keeps the number of issues, the first issue message,
+    the first few distinct locations and the subjects it affects,
+    so its size depends on the number of distinct issues rather than on the number of files.
+
+    Repeated issues (same group, location and message) are counted once,
+    as :meth:`pandas.DataFrame.drop_duplicates` would count them.
+    Issues outside subject directories, such as ones on ``dataset_description.json``,
+    are reported again by every per-subject validator run,
+    so the aggregator remembers them across chunks.
+    Issues within subject directories are only compared within a chunk,
+    which keeps the memory bounded by the number of files at the top of the dataset.
+
+    Parameters
+    ----------
+    n_locations : :obj:`int`, optional
+        Number of example locations to keep for each group of issues. Default is 5.
+    """
+
+    key_columns = ["code", "subCode", "severity", "rule"]
+
+    def __init__(self, n_locations=5):
+        self.n_locations = n_locations
+        self.groups = {}
+        self._seen_root_issues = set()
+
+    def add(self, parsed):
+        """Add a chunk of issues.
+
+        Parameters
+        ----------
+        parsed : :obj:`pandas.DataFrame`
+            Parsed issues, as returned by :func:`parse_validator_output`.
+            If there is no "subject" column, the subjects are found from the locations.
+        """
+        if parsed.shape[0] == 0:
+            return
+
+        parsed = parsed.copy()
+        unique_columns = self.key_columns + ["location", "issueMessage"]
+        parsed[unique_columns] = parsed[unique_columns].fillna("").astype(str)
+        if "subject" not in parsed:
+            parsed["subject"] = parsed["location"].str.extract(r"(sub-[a-zA-Z0-9]+)", expand=False)
+
+        parsed = parsed.drop_duplicates(subset=unique_columns)
+        is_root = ~parsed["location"].str.contains(r"(?:^|/)sub-[a-zA-Z0-9]+/")
+        is_new = []
+        for issue, root in zip(parsed[unique_columns].itertuples(index=False), is_root):
+            if not root:
+                is_new.append(True)
+            else:
+                is_new.append(issue not in self._seen_root_issues)
+                self._seen_root_issues.add(issue)
+
+        parsed = parsed[is_new]
+        if parsed.shape[0] == 0:
+            return
+
+        grouped = parsed.groupby(self.key_columns, sort=False)
+        counts = grouped.size()
+        messages = grouped["issueMessage"].first()
+        locations = (
+            parsed.drop_duplicates(subset=self.key_columns + ["location"])
+            .groupby(self.key_columns, sort=False)
+            .head(self.n_locations)
+            .groupby(self.key_columns, sort=False)["location"]
+            .agg(list)
+        )
+        subjects = (
+            parsed.dropna(subset=["subject"])
+            .groupby(self.key_columns, sort=False)["subject"]
+            .agg(set)
+        )
+
+        for key, count in counts.items():
+            if key not in self.groups:
+                self.groups[key] = {
+                    "count": 0,
+                    "issueMessage": messages[key],
+                    "locations": [],
+                    "subjects": set(),
+                }
+
+            group = self.groups[key]
+            group["count"] += int(count)
+            for location in locations.get(key, []):
+                if len(group["locations"]) >= self.n_locations:
+                    break
+                if location not in group["locations"]:
+                    group["locations"].append(location)
+
+            group["subjects"].update(subjects.get(key, set()))
+
+    def to_dataframe(self):
+        """Summarize the issues that have been added.
+
+        Returns
+        -------
+        summary : :obj:`pandas.DataFrame`
+            One row per group of issues, with errors first and then the most common issues.
+        """
+        rows = []
+        for key, group in self.groups.items():
+            row = dict(zip(self.key_columns, key))
+            row["count"] = group["count"]
+            row["n_subjects"] = len(group["subjects"])
+            row["subjects"] = ", ".join(sorted(group["subjects"]))
+            row["example_locations"] = ", ".join(group["locations"])
+            row["issueMessage"] = group["issueMessage"]
+            rows.append(row)
+
+        columns = self.key_columns + [
+            "count",
+            "n_subjects",
+            "subjects",
+            "example_locations",
+            "issueMessage",
+        ]
+        summary = pd.DataFrame(rows, columns=columns)
+        summary["is_error"] = summary["severity"] == "error"
+        summary = summary.sort_values(
+            by=["is_error", "count", "code", "subCode", "rule"],
+            ascending=[False, False, True, True, True],
+            kind="stable",
+        )
+        return summary.drop(columns="is_error").reset_index(drop=True)
+
+
 def get_val_dictionary():
     """Get value dictionary.
 
@@ -277,3 +1311,24 @@ def bids_validator_version(output, path, write=False):
         update_dataset_description(path, combined_info)
     elif not write:
         print(combined_info)
+
+
+def get_val_summary_dictionary():
+    """Get the data dictionary for the aggregated validation summary.
+
+    Returns
+    -------
+    val_dict : dict
+        Dictionary of values.
+    """
+    return {
+        "code": {"Description": "Code of the validation issue."},
+        "subCode": {"Description": "Subcode providing additional issue details."},
+        "severity": {"Description": "Severity of the issue (e.g., warning, error)."},
+        "rule": {"Description": "Validation rule that triggered the issue."},
+        "count": {"Description": "Number of times the issue was found."},
+        "n_subjects": {"Description": "Number of subjects with the issue."},
+        "subjects": {"Description": "Subjects with the issue."},
+        "example_locations": {"Description": "Some of the files with the issue."},
+        "issueMessage": {"Description": "Validation issue message (from the first issue)."},
+    }
@@ -3,33 +3,49 @@
 import json
 import logging
 import os
-import shutil
 import subprocess
 import sys
-import tempfile
 import warnings
-from pathlib import Path
 
+import numpy as np
 import pandas as pd
 import tqdm
 
 from cubids.cubids import CuBIDS
+from cubids.journal import prune_trash
 from cubids.metadata_merge import merge_json_into_json
+from cubids.prevalidator import prevalidate as prevalidate_dataset
 from cubids.utils import _get_container_type
 from cubids.validator import (
-    bids_validator_version,
-    build_first_subject_path,
+    ISSUE_COLUMNS,
+    IssueAggregator,
     build_subject_paths,
     build_validator_call,
+    get_acq_group_representatives,
+    get_changed_subjects,
+    get_shard_tsv,
     get_val_dictionary,
+    get_val_summary_dictionary,
+    get_validator_versions,
+    load_validation_cache,
+    merge_validation_shards,
     parse_validator_output,
+    project_acq_group_issues,
     run_validator,
+    run_validator_to_tsv,
+    save_validation_cache,
+    shard_subjects,
+    stream_validator_issues,
+    update_dataset_description,
+    validate_subjects,
 )
 
 warnings.simplefilter(action="ignore", category=FutureWarning)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("cubids-cli")
 GIT_CONFIG = os.path.join(os.path.expanduser("~"), ".gitconfig")
+# Number of subjects validated between saves of the validation cache
+CACHE_SAVE_INTERVAL = 20
 logging.getLogger("datalad").setLevel(logging.ERROR)
 
 
@@ -40,6 +56,15 @@ def validate(
     sequential,
     sequential_subjects,
     ignore_nifti_headers,
+    link_mode="auto",
+    n_jobs=1,
+    timeout=None,
+    use_cache=False,
+    shard=None,
+    aggregate=False,
+    since=None,
+    by_acq_group=None,
+    n_representatives=1,
 ):
     """Run the bids validator.
 
@@ -57,7 +82,71 @@ def validate(
         Filter the sequential run to only include the listed subjects.
     ignore_nifti_headers : :obj:`bool`
         Ignore NIfTI headers when validating.
+        In sequential runs, the NIfTI files are then replaced with sparse stubs
+        in each subject's temporary tree, since their contents are never read.
+    link_mode : {"auto", "copy", "hardlink", "symlink", "reflink"}, optional
+        How files are placed in each subject's temporary tree in sequential runs.
+        "auto" uses a reflink, hardlink or symlink, whichever the filesystem supports,
+        and only copies the data as a last resort.
+        Default is "auto".
+    n_jobs : :obj:`int`, optional
+        Number of subjects to validate at once in sequential runs. Default is 1.
+    timeout : :obj:`float`, optional
+        Number of seconds after which a subject's validator run is stopped in sequential runs.
+        Subjects that time out or fail are recorded as issues in the output,
+        rather than stopping the run.
+        Default is None (no timeout).
+    use_cache : :obj:`bool`, optional
+        In sequential runs, reuse the issues from the last run for subjects whose files,
+        root files, validator version and ``ignore_nifti_headers`` setting haven't changed.
+        The cache is stored in ``validation_cache.json``, next to the validation outputs
+        (``code/CuBIDS`` if ``output_prefix`` is relative),
+        so it stays writable when the dataset is mounted read-only in a container.
+        It is saved every ``CACHE_SAVE_INTERVAL`` subjects, so an interrupted run keeps
+        most of its results.
+        Default is False.
+    shard : :obj:`tuple` of :obj:`int`, optional
+        ``(shard_index, n_shards)``. If provided, a sequential run only validates
+        the subjects in this shard (see :func:`~cubids.validator.shard_subjects`),
+        and writes them to ``<output_prefix>_shard-<i>-of-<N>_validation.tsv``.
+        Combine the shards with :func:`validate_merge`.
+    aggregate : :obj:`bool`, optional
+        Instead of listing every issue, write ``<output_prefix>_validation_summary.tsv``,
+        with one row per code, subCode, severity and rule,
+        the number of issues, the affected subjects and a few example locations.
+        The summary is built as the issues arrive, so its size doesn't grow with the dataset.
+        Sharded runs always write every issue; aggregate them with :func:`validate_merge`.
+        Default is False.
+    since : :obj:`str`, optional
+        Git revision. If provided, only the subjects with files that changed since
+        this revision are validated, sequentially
+        (see :func:`~cubids.validator.get_changed_subjects`).
+        If files outside of the subject directories changed (e.g., dataset_description.json),
+        the whole dataset is validated instead.
+        Default is None (validate everything).
+    by_acq_group : :obj:`pathlib.Path`, optional
+        Path to the ``_AcqGrouping.tsv`` written by ``cubids group``.
+        If provided, only ``n_representatives`` subjects from each acquisition group
+        are validated, sequentially, and their issues are projected onto the rest of the group,
+        with "inferred" set to True (see :func:`~cubids.validator.project_acq_group_issues`).
+        ``<output_prefix>_validation_triage.tsv`` lists the groups,
+        and flags the ones that need a full validation.
+        Default is None (validate every subject).
+    n_representatives : :obj:`int`, optional
+        Number of subjects to validate from each acquisition group. Default is 1.
     """
+    if aggregate and shard is not None:
+        raise Exception(
+            "Shards are written in full. "
+            "Use `cubids validate-merge --aggregate` to aggregate the merged issues."
+        )
+
+    if by_acq_group is not None:
+        if shard is not None or since is not None:
+            raise Exception("--by-acq-group can't be combined with --shard or --since.")
+
+        sequential = True
+
     # check status of output_prefix, absolute or relative?
     abs_path_output = True
     if "/" not in str(output_prefix):
@@ -71,12 +160,73 @@ def validate(
 
     # Run directly from python using subprocess
     if container is None:
+        if since is not None:
+            changed_subjects, root_changed = get_changed_subjects(bids_dir, since)
+            if root_changed:
+                logger.info("Files outside of the subjects changed since %s", since)
+                logger.info("Validating the whole dataset")
+            else:
+                # subjects that were removed since the revision have nothing to validate
+                changed_subjects = [sub for sub in changed_subjects if (bids_dir / sub).is_dir()]
+                if sequential_subjects:
+                    changed_subjects = [
+                        sub for sub in changed_subjects if sub in sequential_subjects
+                    ]
+
+                if not changed_subjects:
+                    logger.info("No subjects changed since %s, nothing to validate", since)
+                    sys.exit(0)
+
+                logger.info(
+                    "Validating %d subjects changed since %s", len(changed_subjects), since
+                )
+                sequential = True
+                sequential_subjects = changed_subjects
+
         if not sequential:
             # run on full dataset
             call = build_validator_call(
                 str(bids_dir),
                 ignore_nifti_headers,
             )
+
+            if output_prefix:
+                # check if absolute or relative path
+                if abs_path_output:
+                    # normally, write dataframe to file in CLI
+                    val_tsv = str(output_prefix) + "_validation.tsv"
+
+                else:
+                    val_tsv = (
+                        str(bids_dir) + "/code/CuBIDS/" + str(output_prefix) + "_validation.tsv"
+                    )
+
+                if aggregate:
+                    # parse the output as it is produced, only keeping the counts
+                    aggregator = IssueAggregator()
+                    for chunk in stream_validator_issues(call):
+                        aggregator.add(chunk)
+
+                    _write_validation_summary(aggregator, val_tsv)
+                    sys.exit(0)
+
+                # parse the output as it is produced, appending the issues to the tsv
+                n_issues = run_validator_to_tsv(call, val_tsv)
+                if n_issues < 1:
+                    logger.info("No issues/warnings parsed, your dataset is BIDS valid.")
+                    sys.exit(0)
+
+                logger.info("BIDS issues/warnings found in the dataset")
+
+                # build validation data dictionary json sidecar
+                val_dict = get_val_dictionary()
+                val_json = val_tsv.replace("tsv", "json")
+                with open(val_json, "w") as outfile:
+                    json.dump(val_dict, outfile, indent=4)
+
+                logger.info("Writing issues out to %s", val_tsv)
+                sys.exit(0)
+
             ret = run_validator(call)
 
             # parse the string output
@@ -87,33 +237,8 @@ def validate(
             else:
                 logger.info("BIDS issues/warnings found in the dataset")
 
-                if output_prefix:
-                    # check if absolute or relative path
-                    if abs_path_output:
-                        # normally, write dataframe to file in CLI
-                        val_tsv = str(output_prefix) + "_validation.tsv"
-
-                    else:
-                        val_tsv = (
-                            str(bids_dir)
-                            + "/code/CuBIDS/"
-                            + str(output_prefix)
-                            + "_validation.tsv"
-                        )
-
-                    parsed.to_csv(val_tsv, sep="\t", index=False)
-
-                    # build validation data dictionary json sidecar
-                    val_dict = get_val_dictionary()
-                    val_json = val_tsv.replace("tsv", "json")
-                    with open(val_json, "w") as outfile:
-                        json.dump(val_dict, outfile, indent=4)
-
-                    logger.info("Writing issues out to %s", val_tsv)
-                    sys.exit(0)
-                else:
-                    # user may be in python session, return dataframe
-                    return parsed
+                # user may be in python session, return dataframe
+                return parsed
         else:
             # logger.info("Prepping sequential validator run...")
 
@@ -129,43 +254,148 @@ def validate(
                 subjects_dict = {
                     k: v for k, v in subjects_dict.items() if k in sequential_subjects
                 }
-            assert len(list(subjects_dict.keys())) > 1, "No subjects found in filter"
-            for subject, files_list in tqdm.tqdm(subjects_dict.items()):
-                # logger.info(" ".join(["Processing subject:", subject]))
-                # create a temporary directory and symlink the data
-                with tempfile.TemporaryDirectory() as tmpdirname:
-                    for fi in files_list:
-                        # cut the path down to the subject label
-                        bids_start = fi.find(subject)
-
-                        # maybe it's a single file
-                        if bids_start < 1:
-                            bids_folder = tmpdirname
-                            fi_tmpdir = tmpdirname
-
-                        else:
-                            bids_folder = Path(fi[bids_start:]).parent
-                            fi_tmpdir = tmpdirname + "/" + str(bids_folder)
-
-                        if not os.path.exists(fi_tmpdir):
-                            os.makedirs(fi_tmpdir)
-                        output = fi_tmpdir + "/" + str(Path(fi).name)
-                        shutil.copy2(fi, output)
-
-                    # run the validator
-                    nifti_head = ignore_nifti_headers
-                    call = build_validator_call(tmpdirname, nifti_head)
-                    ret = run_validator(call)
-                    # parse output
-                    if ret.returncode != 0:
-                        logger.error("Errors returned from validator run, parsing now")
-
-                    # parse the output and add to list if it returns a df
-                    decoded = ret.stdout.decode("UTF-8")
-                    tmp_parse = parse_validator_output(decoded)
-                    if tmp_parse.shape[1] > 1:
-                        tmp_parse["subject"] = subject
-                        parsed.append(tmp_parse)
+            assert len(list(subjects_dict.keys())) >= 1, "No subjects found in filter"
+            if shard is not None:
+                subjects_dict = shard_subjects(subjects_dict, *shard)
+
+            if by_acq_group is not None:
+                acq_groups = get_acq_group_representatives(
+                    by_acq_group, list(subjects_dict.keys()), n_representatives
+                )
+                representatives = set(sub for _, reps, _ in acq_groups for sub in reps)
+                logger.info(
+                    "Validating %d representatives of %d acquisition groups",
+                    len(representatives),
+                    len(acq_groups),
+                )
+                subjects_dict = {k: v for k, v in subjects_dict.items() if k in representatives}
+                rep_parsed = []
+
+            cache = None
+            validator_version = None
+            if use_cache:
+                if abs_path_output:
+                    cache_file = str(output_prefix.parent / "validation_cache.json")
+                else:
+                    cache_file = str(bids_dir / "code" / "CuBIDS" / "validation_cache.json")
+
+                os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+                cache = load_validation_cache(cache_file)
+                validator_version = get_validator_versions()["ValidatorVersion"]
+
+            # Drop repeated issues as each subject's results arrive,
+            # so only the unique issues are kept in memory
+            seen_issues = set()
+            aggregator = IssueAggregator() if aggregate else None
+            subject_labels = list(subjects_dict.keys())
+            for i_subject, tmp_parse in enumerate(
+                tqdm.tqdm(
+                    validate_subjects(
+                        subjects_dict,
+                        ignore_nifti_headers=ignore_nifti_headers,
+                        link_mode=link_mode,
+                        n_jobs=n_jobs,
+                        timeout=timeout,
+                        cache=cache,
+                        validator_version=validator_version,
+                    ),
+                    total=len(subjects_dict),
+                )
+            ):
+                if use_cache and (i_subject + 1) % CACHE_SAVE_INTERVAL == 0:
+                    save_validation_cache(
+                        cache_file, cache, subjects=subject_labels[: i_subject + 1]
+                    )
+
+                if by_acq_group is not None:
+                    # keep every issue, to project onto the rest of the group
+                    rep_parsed.append(tmp_parse)
+                    continue
+
+                if aggregate:
+                    aggregator.add(tmp_parse)
+                    continue
+
+                # compare the same columns for every subject, with missing values as "",
+                # as drop_duplicates would (NaN != NaN, so NaNs would never match)
+                issues = tmp_parse.reindex(columns=ISSUE_COLUMNS).fillna("").astype(str)
+                is_new = []
+                for issue in issues.itertuples(index=False, name=None):
+                    is_new.append(issue not in seen_issues)
+                    seen_issues.add(issue)
+
+                # valid subjects add nothing, so a valid dataset is reported as valid
+                if any(is_new):
+                    parsed.append(tmp_parse.loc[is_new])
+
+            if use_cache:
+                save_validation_cache(cache_file, cache, subjects=subject_labels)
+
+            if by_acq_group is not None:
+                # subjects are validated in the order of subjects_dict
+                projected, triage = project_acq_group_issues(
+                    dict(zip(subjects_dict.keys(), rep_parsed)), acq_groups
+                )
+                if aggregate:
+                    aggregator.add(projected)
+                elif projected.shape[0] > 0:
+                    parsed.append(projected)
+
+                needs_full_pass = triage.loc[triage["needs_full_pass"], "AcqGroup"].tolist()
+                if needs_full_pass:
+                    logger.info(
+                        "Acquisition groups that need a full validation: %s",
+                        ", ".join(needs_full_pass),
+                    )
+
+                if output_prefix:
+                    if abs_path_output:
+                        triage_tsv = str(output_prefix) + "_validation_triage.tsv"
+                    else:
+                        triage_tsv = (
+                            str(bids_dir)
+                            + "/code/CuBIDS/"
+                            + str(output_prefix)
+                            + "_validation_triage.tsv"
+                        )
+
+                    triage.to_csv(triage_tsv, sep="\t", index=False)
+                    logger.info("Writing acquisition group triage out to file %s", triage_tsv)
+
+            if shard is not None:
+                if abs_path_output:
+                    val_prefix = str(output_prefix)
+                else:
+                    val_prefix = str(bids_dir) + "/code/CuBIDS/" + str(output_prefix)
+
+                shard_tsv = get_shard_tsv(val_prefix, *shard)
+                if parsed:
+                    parsed = pd.concat(parsed, axis=0)
+                else:
+                    parsed = pd.DataFrame(columns=ISSUE_COLUMNS + ["subject"])
+
+                parsed.to_csv(shard_tsv, sep="\t", index=False)
+                logger.info("Writing shard issues out to file %s", shard_tsv)
+                sys.exit(0)
+
+            if aggregate:
+                summary = aggregator.to_dataframe()
+                if output_prefix:
+                    if abs_path_output:
+                        val_tsv = str(output_prefix) + "_validation.tsv"
+                    else:
+                        val_tsv = (
+                            str(bids_dir)
+                            + "/code/CuBIDS/"
+                            + str(output_prefix)
+                            + "_validation.tsv"
+                        )
+
+                    _write_validation_summary(aggregator, val_tsv)
+                    sys.exit(0)
+
+                # user may be in python session, return dataframe
+                return summary
 
             # concatenate the parsed data and exit
             if len(parsed) < 1:
@@ -174,8 +404,6 @@ def validate(
 
             else:
                 parsed = pd.concat(parsed, axis=0)
-                subset = parsed.columns.difference(["subject"])
-                parsed = parsed.drop_duplicates(subset=subset)
 
                 logger.info("BIDS issues/warnings found in the dataset")
 
@@ -195,6 +423,16 @@ def validate(
 
                     # build validation data dictionary json sidecar
                     val_dict = get_val_dictionary()
+                    if by_acq_group is not None:
+                        val_dict["inferred"] = {
+                            "Description": (
+                                "Whether the issue was projected from another subject "
+                                "in the same acquisition group, rather than validated."
+                            )
+                        }
+                        val_dict["inferred_from"] = {
+                            "Description": "Subjects the inferred issue was projected from."
+                        }
                     val_json = val_tsv.replace("tsv", "json")
                     with open(val_json, "w") as outfile:
                         json.dump(val_dict, outfile, indent=4)
@@ -211,6 +449,10 @@ def validate(
     output_dir_link_t = str(output_prefix.parent.absolute()) + ":/tsv:rw"
     output_dir_link_j = str(output_prefix.parent.absolute()) + ":/json:rw"
     linked_output_prefix_t = "/tsv/" + output_prefix.name
+    if by_acq_group is not None:
+        acq_grouping_link = str(by_acq_group.parent.absolute()) + ":/in_acq_grouping:ro"
+        linked_acq_grouping = "/in_acq_grouping/" + by_acq_group.name
+
     if container_type == "docker":
         cmd = [
             "docker",
@@ -252,15 +494,157 @@ def validate(
         if ignore_nifti_headers:
             cmd.append("--ignore_nifti_headers")
 
-        if sequential:
-            cmd.append("--sequential")
+    if sequential:
+        cmd.append("--sequential")
+
+    if link_mode != "auto":
+        cmd += ["--link-mode", link_mode]
+
+    if n_jobs != 1:
+        cmd += ["--n-jobs", str(n_jobs)]
+
+    if timeout is not None:
+        cmd += ["--timeout", str(timeout)]
+
+    if use_cache:
+        cmd.append("--use-cache")
+
+    if shard is not None:
+        cmd += ["--shard", f"{shard[0]}/{shard[1]}"]
+
+    if aggregate:
+        cmd.append("--aggregate")
+
+    if since is not None:
+        cmd += ["--since", since]
+
+    if by_acq_group is not None:
+        bind_flag = "-v" if container_type == "docker" else "-B"
+        cmd[cmd.index(container) : cmd.index(container)] = [bind_flag, acq_grouping_link]
+        cmd += ["--by-acq-group", linked_acq_grouping]
+        cmd += ["--n-representatives", str(n_representatives)]
 
     logger.info("RUNNING: " + " ".join(cmd))
     proc = subprocess.run(cmd)
     sys.exit(proc.returncode)
 
 
-def bids_version(bids_dir, write=False):
+def _write_validation_summary(aggregator, val_tsv):
+    """Write an aggregated validation summary and its data dictionary.
+
+    Parameters
+    ----------
+    aggregator : :obj:`~cubids.validator.IssueAggregator`
+        The aggregated issues.
+    val_tsv : :obj:`str`
+        Path to the full validation tsv.
+        The summary is written next to it, as ``*_validation_summary.tsv``.
+    """
+    summary = aggregator.to_dataframe()
+    if summary.shape[0] < 1:
+        logger.info("No issues/warnings parsed, your dataset is BIDS valid.")
+    else:
+        logger.info("BIDS issues/warnings found in the dataset")
+
+    summary_tsv = val_tsv.replace("_validation.tsv", "_validation_summary.tsv")
+    summary.to_csv(summary_tsv, sep="\t", index=False)
+
+    with open(summary_tsv.replace(".tsv", ".json"), "w") as outfile:
+        json.dump(get_val_summary_dictionary(), outfile, indent=4)
+
+    logger.info("Writing issue summary out to file %s", summary_tsv)
+
+
+def validate_merge(bids_dir, output_prefix, aggregate=False):
+    """Combine the outputs of a sharded validation run.
+
+    Parameters
+    ----------
+    bids_dir : :obj:`pathlib.Path`
+        Path to the BIDS directory.
+    output_prefix : :obj:`pathlib.Path`
+        Output filename prefix that was given to each shard.
+        The combined issues are written to ``<output_prefix>_validation.tsv``.
+    aggregate : :obj:`bool`, optional
+        Write ``<output_prefix>_validation_summary.tsv`` instead,
+        with the issues aggregated as in :func:`validate`. Default is False.
+    """
+    if "/" not in str(output_prefix):
+        val_prefix = str(bids_dir) + "/code/CuBIDS/" + str(output_prefix)
+    else:
+        val_prefix = str(output_prefix)
+
+    parsed = merge_validation_shards(val_prefix)
+    if aggregate:
+        aggregator = IssueAggregator()
+        aggregator.add(parsed)
+        _write_validation_summary(aggregator, val_prefix + "_validation.tsv")
+        return
+
+    if parsed.shape[0] < 1:
+        logger.info("No issues/warnings parsed, your dataset is BIDS valid.")
+    else:
+        logger.info("BIDS issues/warnings found in the dataset")
+
+    val_tsv = val_prefix + "_validation.tsv"
+    parsed.to_csv(val_tsv, sep="\t", index=False)
+
+    # build validation data dictionary json sidecar
+    val_dict = get_val_dictionary()
+    val_json = val_tsv.replace("tsv", "json")
+    with open(val_json, "w") as outfile:
+        json.dump(val_dict, outfile, indent=4)
+
+    logger.info("Writing issues out to file %s", val_tsv)
+
+
+def prevalidate(bids_dir, output_prefix, n_jobs=1):
+    """Check filenames and sidecars against the BIDS schema, without the BIDS validator.
+
+    Parameters
+    ----------
+    bids_dir : :obj:`pathlib.Path`
+        Path to the BIDS directory.
+    output_prefix : :obj:`pathlib.Path`
+        Output filename prefix.
+        The issues are written to ``<output_prefix>_prevalidation.tsv``,
+        in ``code/CuBIDS`` if the prefix isn't a path.
+    n_jobs : :obj:`int`, optional
+        Number of threads used to read the JSON files. Default is 1.
+
+    Returns
+    -------
+    parsed : :obj:`pandas.DataFrame`
+        The issues, if ``output_prefix`` is None.
+    """
+    parsed = prevalidate_dataset(bids_dir, n_jobs=n_jobs)
+    if parsed.shape[0] < 1:
+        logger.info("No issues found by the schema checks.")
+    else:
+        logger.info("Issues found by the schema checks")
+
+    if not output_prefix:
+        # user may be in python session, return dataframe
+        return parsed
+
+    if "/" not in str(output_prefix):
+        os.makedirs(bids_dir / "code" / "CuBIDS", exist_ok=True)
+        val_tsv = str(bids_dir) + "/code/CuBIDS/" + str(output_prefix) + "_prevalidation.tsv"
+    else:
+        val_tsv = str(output_prefix) + "_prevalidation.tsv"
+
+    parsed.to_csv(val_tsv, sep="\t", index=False)
+
+    # build validation data dictionary json sidecar
+    val_dict = get_val_dictionary()
+    val_json = val_tsv.replace("tsv", "json")
+    with open(val_json, "w") as outfile:
+        json.dump(val_dict, outfile, indent=4)
+
+    logger.info("Writing issues out to file %s", val_tsv)
+
+
+def bids_version(bids_dir, write=False, refresh=False):
     """Get BIDS validator and schema version.
 
     Parameters
@@ -269,59 +653,19 @@ def bids_version(bids_dir, write=False):
         Path to the BIDS directory.
     write : :obj:`bool`
         If True, write to dataset_description.json. If False, print to terminal.
+    refresh : :obj:`bool`, optional
+        Look the versions up again, instead of using the cached versions
+        (see :func:`~cubids.validator.get_validator_versions`). Default is False.
     """
-    # Need to run validator to get output with schema version
-    # Copy code from `validate --sequential`
-
-    try:  # return first subject
-        # Get all folders that start with "sub-"
-        sub_folders = [
-            name
-            for name in os.listdir(bids_dir)
-            if os.path.isdir(os.path.join(bids_dir, name)) and name.startswith("sub-")
-        ]
-        if not sub_folders:
-            raise ValueError("No folders starting with 'sub-' found. Please provide a valid BIDS.")
-        subject = sub_folders[0]
-    except FileNotFoundError:
+    if not os.path.isdir(bids_dir):
         raise FileNotFoundError(f"The directory {bids_dir} does not exist.")
-    except ValueError as ve:
-        raise ve
-
-    # build a dictionary with {SubjectLabel: [List of files]}
-    # run first subject only
-    subject_dict = build_first_subject_path(bids_dir, subject)
-
-    # iterate over the dictionary
-    for subject, files_list in subject_dict.items():
-        # logger.info(" ".join(["Processing subject:", subject]))
-        # create a temporary directory and symlink the data
-        with tempfile.TemporaryDirectory() as tmpdirname:
-            for fi in files_list:
-                # cut the path down to the subject label
-                bids_start = fi.find(subject)
-
-                # maybe it's a single file
-                if bids_start < 1:
-                    bids_folder = tmpdirname
-                    fi_tmpdir = tmpdirname
-
-                else:
-                    bids_folder = Path(fi[bids_start:]).parent
-                    fi_tmpdir = tmpdirname + "/" + str(bids_folder)
-
-                if not os.path.exists(fi_tmpdir):
-                    os.makedirs(fi_tmpdir)
-                output = fi_tmpdir + "/" + str(Path(fi).name)
-                shutil.copy2(fi, output)
-
-            # run the validator
-            call = build_validator_call(tmpdirname)
-            ret = run_validator(call)
 
-            # Get BIDS validator and schema version
-            decoded = ret.stdout.decode("UTF-8")
-            bids_validator_version(decoded, bids_dir, write=write)
+    combined_info = get_validator_versions(refresh=refresh)
+    if write:
+        # Update the dataset_description.json file
+        update_dataset_description(bids_dir, combined_info)
+    else:
+        print(combined_info)
 
 
 def bids_sidecar_merge(from_json, to_json):
@@ -330,7 +674,15 @@ def bids_sidecar_merge(from_json, to_json):
     sys.exit(merge_status)
 
 
-def group(bids_dir, container, acq_group_level, config, output_prefix):
+def group(
+    bids_dir,
+    container,
+    acq_group_level,
+    config,
+    output_prefix,
+    sweep_tolerance=None,
+    engine="pandas",
+):
     """Find key and param groups.
 
     Parameters
@@ -341,21 +693,41 @@ def group(bids_dir, container, acq_group_level, config, output_prefix):
         Container in which to run the workflow.
     acq_group_level : {"subject", "session"}
         Level at which acquisition groups are created.
-    config : :obj:`pathlib.Path`
+    config : :obj:`pathlib.Path` or :obj:`list` of :obj:`pathlib.Path`
         Path to the grouping config file.
+        If more than one config is provided, the outputs for each config are written
+        side by side, along with a comparison of the group counts.
     output_prefix : :obj:`pathlib.Path`
         Output filename prefix.
+    sweep_tolerance : :obj:`list` of :obj:`tuple`, optional
+        ``(column, start, stop, steps)`` for each column to run a tolerance sweep on.
+        If provided, the parameter group counts over the range of tolerances are written
+        instead of the usual grouping outputs.
+    engine : {"pandas", "polars"}, optional
+        Dataframe engine used to find parameter and acquisition groups.
     """
+    configs = config if isinstance(config, list) else [config]
+
     # Run directly from python using
     if container is None:
         bod = CuBIDS(
             data_root=str(bids_dir),
             acq_group_level=acq_group_level,
-            grouping_config=config,
-        )
-        bod.get_tsvs(
-            str(output_prefix),
+            grouping_config=configs[0],
+            engine=engine,
         )
+        if sweep_tolerance:
+            sweeps = {
+                column: np.linspace(start, stop, steps).tolist()
+                for column, start, stop, steps in sweep_tolerance
+            }
+            bod.get_tolerance_sweep(str(output_prefix), sweeps)
+        elif len(configs) > 1:
+            bod.get_tsvs_for_configs(str(output_prefix), configs)
+        else:
+            bod.get_tsvs(
+                str(output_prefix),
+            )
         sys.exit(0)
 
     # Run it through a container
@@ -363,10 +735,13 @@ def group(bids_dir, container, acq_group_level, config, output_prefix):
     bids_dir_link = str(bids_dir.absolute()) + ":/bids"
     output_dir_link = str(output_prefix.parent.absolute()) + ":/tsv:rw"
 
-    apply_config = config is not None
-    if apply_config:
-        input_config_dir_link = str(config.parent.absolute()) + ":/in_config:ro"
-        linked_input_config = "/in_config/" + config.name
+    input_config_dir_links = []
+    linked_input_configs = []
+    for i_config, config_file in enumerate(c for c in configs if c is not None):
+        input_config_dir_links.append(
+            str(config_file.parent.absolute()) + f":/in_config{i_config}:ro"
+        )
+        linked_input_configs.append(f"/in_config{i_config}/" + config_file.name)
 
     linked_output_prefix = "/tsv/" + output_prefix.name
     if container_type == "docker":
@@ -386,7 +761,9 @@ def group(bids_dir, container, acq_group_level, config, output_prefix):
             "/bids",
             linked_output_prefix,
         ]
-        if apply_config:
+        for input_config_dir_link, linked_input_config in zip(
+            input_config_dir_links, linked_input_configs
+        ):
             cmd.insert(3, "-v")
             cmd.insert(4, input_config_dir_link)
             cmd += ["--config", linked_input_config]
@@ -405,7 +782,9 @@ def group(bids_dir, container, acq_group_level, config, output_prefix):
             "/bids",
             linked_output_prefix,
         ]
-        if apply_config:
+        for input_config_dir_link, linked_input_config in zip(
+            input_config_dir_links, linked_input_configs
+        ):
             cmd.insert(3, "-B")
             cmd.insert(4, input_config_dir_link)
             cmd += ["--config", linked_input_config]
@@ -414,6 +793,12 @@ def group(bids_dir, container, acq_group_level, config, output_prefix):
         cmd.append("--acq-group-level")
         cmd.append(str(acq_group_level))
 
+    for column, start, stop, steps in sweep_tolerance or []:
+        cmd += ["--sweep-tolerance", f"{column}={start}:{stop}:{steps}"]
+
+    if engine != "pandas":
+        cmd += ["--engine", engine]
+
     logger.info("RUNNING: " + " ".join(cmd))
     proc = subprocess.run(cmd)
     sys.exit(proc.returncode)
@@ -428,6 +813,8 @@ def apply(
     files_tsv,
     new_tsv_prefix,
     container,
+    resume=False,
+    dry_run=False,
 ):
     """Apply the tsv changes.
 
@@ -449,6 +836,10 @@ def apply(
         Path to the new tsv prefix.
     container : :obj:`str`
         Container in which to run the workflow.
+    resume : :obj:`bool`
+        Continue an interrupted apply, skipping the steps that were already done.
+    dry_run : :obj:`bool`
+        Only write the plan and its estimated cost, without changing the dataset.
     """
     # Run directly from python using
     if container is None:
@@ -458,7 +849,8 @@ def apply(
             acq_group_level=acq_group_level,
             grouping_config=config,
         )
-        if use_datalad:
+        # an interrupted apply leaves unsaved changes behind
+        if use_datalad and not resume:
             if not bod.is_datalad_clean():
                 raise Exception("Untracked change in " + str(bids_dir))
         bod.apply_tsv_changes(
@@ -466,6 +858,8 @@ def apply(
             str(files_tsv),
             str(new_tsv_prefix),
             raise_on_error=False,
+            resume=resume,
+            dry_run=dry_run,
         )
         sys.exit(0)
 
@@ -548,6 +942,12 @@ def apply(
         cmd.append("--acq-group-level")
         cmd.append(str(acq_group_level))
 
+    if resume:
+        cmd.append("--resume")
+
+    if dry_run:
+        cmd.append("--dry-run")
+
     logger.info("RUNNING: " + " ".join(cmd))
     proc = subprocess.run(cmd)
     sys.exit(proc.returncode)
@@ -608,8 +1008,11 @@ def datalad_save(bids_dir, container, m):
     sys.exit(proc.returncode)
 
 
-def undo(bids_dir, container):
-    """Revert the most recent commit.
+def undo(bids_dir, container, prune=False, keep=0):
+    """Undo the most recent CuBIDS operation.
+
+    The operation is reversed with the CuBIDS journal.
+    If the journal is empty, the most recent datalad commit is reverted instead.
 
     Parameters
     ----------
@@ -617,11 +1020,27 @@ def undo(bids_dir, container):
         Path to the BIDS directory.
     container : :obj:`str`
         Container in which to run the workflow.
+    prune : :obj:`bool`, optional
+        Instead of undoing an operation, permanently remove the files that earlier operations
+        deleted from a dataset without datalad, which are kept in the journal's trash
+        (see :func:`cubids.journal.prune_trash`). Default is False.
+    keep : :obj:`int`, optional
+        With ``prune``, the number of the most recent operations that can still be undone.
+        Default is 0.
     """
     # Run directly from python using
     if container is None:
-        bod = CuBIDS(data_root=str(bids_dir), use_datalad=True)
-        bod.datalad_undo_last_commit()
+        if prune:
+            pruned = prune_trash(str(bids_dir), keep=keep)
+            logger.info("Emptied the trash of %d operations", len(pruned))
+            sys.exit(0)
+
+        use_datalad = os.path.isdir(os.path.join(str(bids_dir), ".datalad"))
+        bod = CuBIDS(data_root=str(bids_dir), use_datalad=use_datalad)
+        entry = bod.undo_last_operation()
+        if entry is not None:
+            logger.info("Undid %s (%s)", entry["operation"], entry["id"])
+
         sys.exit(0)
 
     # Run it through a container
@@ -652,6 +1071,10 @@ def undo(bids_dir, container):
             "cubids-undo",
             "/bids",
         ]
+
+    if prune:
+        cmd += ["--prune", "--keep", str(keep)]
+
     logger.info("RUNNING: " + " ".join(cmd))
     proc = subprocess.run(cmd)
     sys.exit(proc.returncode)
@@ -665,6 +1088,11 @@ def copy_exemplars(
     exemplars_tsv,
     min_group_size,
     force_unlock,
+    link_mode="copy",
+    n_jobs=1,
+    only_group_files=False,
+    datalad_clone=False,
+    selection="first",
 ):
     """Create and save a directory with one subject from each acquisition group.
 
@@ -684,6 +1112,21 @@ def copy_exemplars(
         Minimum number of subjects in a group to be considered for exemplar.
     force_unlock : :obj:`bool`
         Force unlock the dataset.
+    link_mode : {"copy", "auto", "hardlink", "symlink", "reflink"}, optional
+        How files are placed in the exemplar dataset. Default is "copy".
+    n_jobs : :obj:`int`, optional
+        Number of files to copy at once. Default is 1.
+    only_group_files : :obj:`bool`, optional
+        Only copy the scans of each exemplar's acquisition group, with their associated files,
+        instead of the exemplar subjects' whole directories. Default is False.
+    datalad_clone : :obj:`bool`, optional
+        Make the exemplar dataset as a local datalad clone that gets its content
+        from this dataset's annex, instead of copying the files. Default is False.
+    selection : {"first", "smallest", "cover"}, optional
+        How exemplars are chosen: the first subject of each acquisition group,
+        the smallest subject of each acquisition group,
+        or the smallest subjects that together cover every parameter group.
+        Default is "first".
     """
     # Run directly from python using
     if container is None:
@@ -699,6 +1142,11 @@ def copy_exemplars(
             str(exemplars_dir),
             str(exemplars_tsv),
             min_group_size=min_group_size,
+            link_mode=link_mode,
+            n_jobs=n_jobs,
+            only_group_files=only_group_files,
+            datalad_clone=datalad_clone,
+            selection=selection,
         )
         sys.exit(0)
 
@@ -757,6 +1205,21 @@ def copy_exemplars(
         if min_group_size:
             cmd.append("--min-group-size")
 
+    if link_mode != "copy":
+        cmd += ["--link-mode", link_mode]
+
+    if n_jobs != 1:
+        cmd += ["--n-jobs", str(n_jobs)]
+
+    if only_group_files:
+        cmd.append("--only-group-files")
+
+    if datalad_clone:
+        cmd.append("--datalad-clone")
+
+    if selection != "first":
+        cmd += ["--selection", selection]
+
     logger.info("RUNNING: " + " ".join(cmd))
     proc = subprocess.run(cmd)
     sys.exit(proc.returncode)
@@ -774,7 +1237,7 @@ def add_nifti_info(bids_dir, container, use_datalad, force_unlock):
     use_datalad : :obj:`bool`
         Use datalad to track changes.
     force_unlock : :obj:`bool`
-        Force unlock the dataset.
+        Unlock the sidecars that will be modified.
     """
     # Run directly from python using
     if container is None:
@@ -830,7 +1293,7 @@ def add_nifti_info(bids_dir, container, use_datalad, force_unlock):
     sys.exit(proc.returncode)
 
 
-def purge(bids_dir, container, use_datalad, scans):
+def purge(bids_dir, container, use_datalad, scans, resume=False, dry_run=False):
     """Purge scan associations.
 
     Parameters
@@ -843,20 +1306,26 @@ def purge(bids_dir, container, use_datalad, scans):
         Use datalad to track changes.
     scans : :obj:`pathlib.Path`
         Path to the scans tsv.
+    resume : :obj:`bool`
+        Continue an interrupted purge, skipping the steps that were already done.
+    dry_run : :obj:`bool`
+        Only write the plan and its estimated cost, without changing the dataset.
     """
     # Run directly from python using
     if container is None:
         bod = CuBIDS(data_root=str(bids_dir), use_datalad=use_datalad)
-        if use_datalad:
+        # an interrupted purge leaves unsaved changes behind
+        if use_datalad and not resume:
             if not bod.is_datalad_clean():
                 raise Exception("Untracked change in " + str(bids_dir))
-        bod.purge(str(scans))
+        bod.purge(str(scans), resume=resume, dry_run=dry_run)
         sys.exit(0)
 
     # Run it through a container
     container_type = _get_container_type(container)
     bids_dir_link = str(bids_dir.absolute()) + ":/bids"
-    input_scans_link = str(scans.parent.absolute()) + ":/in_scans:ro"
+    # the plan is written next to the scans file
+    input_scans_link = str(scans.parent.absolute()) + ":/in_scans:rw"
     if container_type == "docker":
         cmd = [
             "docker",
@@ -892,11 +1361,15 @@ def purge(bids_dir, container, use_datalad, scans):
     logger.info("RUNNING: " + " ".join(cmd))
     if use_datalad:
         cmd.append("--use-datalad")
+    if resume:
+        cmd.append("--resume")
+    if dry_run:
+        cmd.append("--dry-run")
     proc = subprocess.run(cmd)
     sys.exit(proc.returncode)
 
 
-def remove_metadata_fields(bids_dir, container, fields):
+def remove_metadata_fields(bids_dir, container, fields, n_jobs=1):
     """Delete fields from metadata.
 
     Parameters
@@ -907,11 +1380,13 @@ def remove_metadata_fields(bids_dir, container, fields):
         Container in which to run the workflow.
     fields : :obj:`list` of :obj:`str`
         List of fields to remove.
+    n_jobs : :obj:`int`, optional
+        Number of threads used to read and write the sidecars. Default is 1.
     """
     # Run directly from python
     if container is None:
         bod = CuBIDS(data_root=str(bids_dir), use_datalad=False)
-        bod.remove_metadata_fields(fields)
+        bod.remove_metadata_fields(fields, n_jobs=n_jobs)
         sys.exit(0)
 
     # Run it through a container
@@ -942,32 +1417,50 @@ def remove_metadata_fields(bids_dir, container, fields):
             "/bids",
             "--fields",
         ] + fields
+
+    if n_jobs != 1:
+        cmd += ["--n-jobs", str(n_jobs)]
+
     logger.info("RUNNING: " + " ".join(cmd))
     proc = subprocess.run(cmd)
     sys.exit(proc.returncode)
 
 
-def print_metadata_fields(bids_dir, container):
+def print_metadata_fields(bids_dir, container, n_jobs=1, output_prefix=None):
     """Print unique metadata fields.
 
+    Only the BIDS data is read: sidecars in the top-level code, sourcedata, stimuli
+    and models directories (including CuBIDS's own outputs in code/CuBIDS) are skipped.
+
     Parameters
     ----------
     bids_dir : :obj:`pathlib.Path`
         Path to the BIDS directory.
     container : :obj:`str`
         Container in which to run the workflow.
+    n_jobs : :obj:`int`, optional
+        Number of threads used to read the sidecars. Default is 1.
+    output_prefix : :obj:`pathlib.Path`, optional
+        If provided, also write the number of sidecars with each field,
+        by modality and by entity set, to tsv files with this prefix.
+        Default is None.
     """
     # Run directly from python
     if container is None:
         bod = CuBIDS(data_root=str(bids_dir), use_datalad=False)
-        fields = bod.get_all_metadata_fields()
+        census = bod.get_metadata_field_census(n_jobs=n_jobs)
+        fields = sorted(census["Field"].unique())
         print("\n".join(fields))  # logger not printing
         # logger.info("\n".join(fields))
+        if output_prefix is not None:
+            bod.write_metadata_field_census(str(output_prefix), census)
         sys.exit(0)
 
     # Run it through a container
     container_type = _get_container_type(container)
     bids_dir_link = str(bids_dir.absolute()) + ":/bids:ro"
+    if output_prefix is not None:
+        output_dir_link = str(output_prefix.parent.absolute()) + ":/out:rw"
     if container_type == "docker":
         cmd = [
             "docker",
@@ -980,6 +1473,9 @@ def print_metadata_fields(bids_dir, container):
             container,
             "/bids",
         ]
+        if output_prefix is not None:
+            cmd.insert(3, "-v")
+            cmd.insert(4, output_dir_link)
     elif container_type == "singularity":
         cmd = [
             "singularity",
@@ -991,6 +1487,16 @@ def print_metadata_fields(bids_dir, container):
             "cubids-print-metadata-fields",
             "/bids",
         ]
+        if output_prefix is not None:
+            cmd.insert(3, "-B")
+            cmd.insert(4, output_dir_link)
+
+    if n_jobs != 1:
+        cmd += ["--n-jobs", str(n_jobs)]
+
+    if output_prefix is not None:
+        cmd += ["--output-prefix", "/out/" + output_prefix.name]
+
     logger.info("RUNNING: " + " ".join(cmd))
     proc = subprocess.run(cmd)
     sys.exit(proc.returncode)